@@ -41,4 +41,5 @@ from .event import Event
 from .schedule import scheduled_job, add_job
 from .typing import T_State
 from .service import Service
-from .util import aiohttpx, get_bot_list, sucmd, sucmds
\ No newline at end of file
+from .util import aiohttpx, get_bot_list, sucmd, sucmds
+from .poller import poll_source, Push
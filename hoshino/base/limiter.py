@@ -0,0 +1,31 @@
+import nonebot
+from hoshino import sucmd, scheduled_job, Bot
+from hoshino.util import run_sync
+from hoshino.util.limiter import capture_all, get_limiters, snapshot_all, write_all
+lmtstat = sucmd('限流统计', True, {'limiterstat'})
+
+
+@lmtstat.handle()
+async def _(bot: Bot):
+    limiters = get_limiters()
+    if not limiters:
+        await lmtstat.finish('暂无已注册的限制器')
+    msg = ['限制器统计:']
+    total = 0
+    for name, lmt in limiters.items():
+        lmt.purge()
+        st = lmt.stats()
+        total += st['bytes']
+        extra = ' 持久化' if lmt.persist else ''
+        msg.append(f'[{name}] {type(lmt).__name__} 键{st["keys"]}个 约{st["bytes"]/1024:.1f}KB{extra}')
+    msg.append(f'合计约{total/1024:.1f}KB')
+    await lmtstat.finish('\n'.join(msg))
+
+
+# 限制器的字典在事件循环里被修改，不能整个放到线程里，只有写文件在线程里
+@scheduled_job('interval', minutes=5, id='限制器快照')
+async def snapshot_limiters():
+    await run_sync(write_all)(capture_all())
+
+
+nonebot.get_driver().on_shutdown(snapshot_all)
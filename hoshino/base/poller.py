@@ -0,0 +1,29 @@
+import time
+import nonebot
+from hoshino import sucmd, Bot
+from hoshino.poller import get_sources, start, stop
+pollstat = sucmd('轮询状态', True, {'pollstat'})
+
+
+@pollstat.handle()
+async def _(bot: Bot):
+    sources = get_sources()
+    if not sources:
+        await pollstat.finish('暂无已注册的轮询源')
+    now = time.time()
+    msg = ['轮询源状态:']
+    for name, src in sources.items():
+        st = src.stats
+        if src.paused:
+            state = '已暂停'
+        elif src.running:
+            state = '轮询中'
+        else:
+            state = f'{max(0, src.next_run - now):.0f}s后'
+        msg.append(f'[{name}] 间隔{src.interval:.0f}s 下次{state} 耗时{src.last_cost:.2f}s\n'
+                   f'轮询{st["poll"]} 变化{st["change"]} 推送{st["push"]} 出错{st["error"]}')
+    await pollstat.finish('\n'.join(msg))
+
+
+nonebot.get_driver().on_startup(start)
+nonebot.get_driver().on_shutdown(stop)
@@ -1,7 +1,9 @@
+import nonebot
 from loguru import logger
 from hoshino import sucmd, Bot, Event
 from hoshino.typing import T_State, FinishedException
-from hoshino.schedule import scheduler
+from hoshino.schedule import scheduler, get_job_stats, shutdown_executors
+from hoshino.poller import get_sources
 from datetime import datetime
 showjob = sucmd('定时任务', True, {'显示定时任务', 'showjobs'})
 
@@ -14,7 +16,14 @@ async def _(bot: Bot):
         id = job.id
         trigger = job.trigger
         state = 'running' if job.next_run_time else 'pausing'
-        msg.append(f'ID: {id}\nTrigger: {trigger}\nstate: {state}\n======')
+        st = get_job_stats(id)
+        cost = f'last {st.last:.2f}s, avg {st.hist.avg / 1000:.2f}s' if st.last is not None else 'never run'
+        next_run = job.next_run_time.strftime('%m-%d %H:%M:%S') if job.next_run_time else '-'
+        counts = f'err {st.errors} overlap {st.overlaps} skip {st.skips} misfire {st.misfires}'
+        msg.append(f'ID: {id}\nTrigger: {trigger}\nstate: {state}\nnext: {next_run}\ncost: {cost}\n{counts}\n======')
+    for name, src in get_sources().items():
+        state = 'pausing' if src.paused else 'running'
+        msg.append(f'ID: {name}\nTrigger: poll[{src.min_interval:.0f}s-{src.max_interval:.0f}s, now {src.interval:.0f}s]\nstate: {state}\ncost: last {src.last_cost:.2f}s\n======')
     await showjob.send('\n'.join(msg), at_sender=True)
 
 pausejob = sucmd('暂停定时任务', True, {'暂停任务', 'pausejob'}, state={'action': '暂停'})
@@ -39,10 +48,15 @@ async def _(bot: Bot, event: Event, state: T_State):
     jobs = state['jobs']
     msg = []
     fail = []
+    sources = get_sources()
     for job in jobs:
         try:
-            scheduler.pause_job(
-                job) if flag == '暂停' else scheduler.resume_job(job)
+            # 轮询源不是apscheduler的任务，同样可以按名字暂停和恢复
+            if job in sources:
+                sources[job].paused = flag == '暂停'
+            else:
+                scheduler.pause_job(
+                    job) if flag == '暂停' else scheduler.resume_job(job)
             msg.append(job)
         except Exception as e:
             logger.exception(e)
@@ -50,3 +64,6 @@ async def _(bot: Bot, event: Event, state: T_State):
     if fail:
         await bot.send(event, '定时任务'+'|'.join(fail)+f'{flag}失败')
     await bot.send(event, f'已{flag}定时任务:\n'+'|'.join(msg))
+
+
+nonebot.get_driver().on_shutdown(shutdown_executors)
@@ -0,0 +1,57 @@
+import os
+import json
+from loguru import logger
+from hoshino import sucmd, scheduled_job, Bot, Event, hsn_config
+from hoshino.util import run_sync
+from hoshino.util.aiohttpx import get_stats, dump_stats, reset_stats, HttpStats
+metrics_dir = os.path.join(hsn_config.data, 'metrics/')
+os.makedirs(metrics_dir, exist_ok=True)
+netstat = sucmd('网络统计', aliases={'netstat', 'http统计'})
+resetstat = sucmd('重置网络统计', aliases={'resetnetstat'})
+
+
+def format_stats(name: str, st: HttpStats) -> str:
+    status = ' '.join(f'{k}×{v}' for k, v in sorted(st.status.items()))
+    return '\n'.join([
+        f'[{name}] 请求{st.requests}次 失败{st.errors}次',
+        f'状态码: {status or "无"}',
+        f'流量: 下行{st.bytes_in/1024:.1f}KB 上行{st.bytes_out/1024:.1f}KB',
+        f'连接: avg {st.connect.avg:.0f}ms p95≤{st.connect.percentile(0.95):.0f}ms',
+        f'首字节: avg {st.ttfb.avg:.0f}ms p95≤{st.ttfb.percentile(0.95):.0f}ms',
+        f'总耗时: avg {st.latency.avg:.0f}ms p95≤{st.latency.percentile(0.95):.0f}ms',
+    ])
+
+
+@netstat.handle()
+async def _(bot: Bot, event: Event):
+    by = 'service' if event.get_plaintext().strip() in ('service', '服务') else 'host'
+    stats = get_stats(by)
+    if not stats:
+        await netstat.finish('暂无网络请求记录')
+    items = sorted(stats.items(), key=lambda x: x[1].latency.total, reverse=True)
+    msg = [f'网络请求统计(按{"服务" if by == "service" else "域名"}，总耗时降序):']
+    msg.extend(format_stats(k, v) for k, v in items)
+    await netstat.finish('\n======\n'.join(msg))
+
+
+@resetstat.handle()
+async def _(bot: Bot):
+    reset_stats()
+    await resetstat.finish('网络统计已重置')
+
+
+def _write(path: str, data: dict):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+@scheduled_job('interval', minutes=30, id='网络统计转储')
+async def dump_netstat():
+    # 统计在事件循环里复制成普通字典，写盘放到线程里
+    data = dump_stats()
+    await run_sync(_write)(os.path.join(metrics_dir, 'http.json'), data)
+    for host, st in get_stats('host').items():
+        logger.info(
+            f'[netstat] {host}: {st.requests} req, avg {st.latency.avg:.0f}ms, ttfb avg {st.ttfb.avg:.0f}ms, {st.errors} err')
@@ -7,12 +7,16 @@ Description:
 Github: http://github.com/AkiraXie/
 '''
 import asyncio
-from hoshino.typing import List, T_State
-from hoshino import Service, aiohttpx, Bot, Event, scheduled_job, Message, sucmd
-from hoshino.util import text2Seg
+from collections import defaultdict
+from typing import Tuple
+from hoshino.typing import Any, Dict, List, Optional, T_State
+from hoshino import Service, aiohttpx, Bot, Event, Message, sucmd, poll_source, Push
+from hoshino.poller import Source
+from hoshino.util import text2Seg, run_sync
 from hoshino.rule import ArgumentParser
 from .data import Rss, Rssdata, BASE_URL, pw,timezone
 sv = Service('rss', enable_on_default=False)
+FETCH_LIMIT = 4
 parser = ArgumentParser()
 parser.add_argument('name')
 parser.add_argument('-u', '--url', type=str)
@@ -133,37 +137,71 @@ async def _(bot: Bot, event: Event, state: T_State):
     await queryrss.finish(Message('\n'.join(msg)))
 
 
-@scheduled_job('interval', minutes=2, jitter=20, id='推送rss')
-async def push_rss():
+def format_info(name: str, url: str, newinfo: dict) -> list:
+    msg = [f'{name} 更新啦！']
+    if not r'/twitter/' in url.lower():
+        msg.append(info2pic(newinfo))
+    else:
+        infostr = f"正文:\n{newinfo['正文']}\n时间: {newinfo['时间']}"
+        msg.append(infostr)
+    msg.extend(newinfo['图片'])
+    msg.append(f'链接: {newinfo["链接"]}')
+    return [Message('\n'.join(msg))] + list(newinfo['视频'])
+
+
+@poll_source('推送rss', min_interval=60, max_interval=600)
+async def push_rss(src: Source):
+    '''
+    每个链接每轮只请求和解析一次，新条目再分发给所有订阅了它的群
+    '''
     glist = await sv.get_enable_groups()
-    for gid in glist.keys():
-        for bot in glist[gid]:
-            res = Rssdata.select(Rssdata.url, Rssdata.name,
-                                 Rssdata.date).where(Rssdata.group == gid)
-            for r in res:
-                flag = r'/twitter/' in r.url.lower()
-                rss = await Rss.new(r.url)
-                if not (rss.has_entries):
-                    continue
-                await asyncio.sleep(0.5)
-                newinfos = await rss.get_interval_entry_info(r.date)
-                if not newinfos:
-                    continue
-                for newinfo in newinfos:
-                    msg = [f'{r.name} 更新啦！']
-                    if not flag:
-                        msg.append(info2pic(newinfo))
-                    else:
-                        infostr = f"正文:\n{newinfo['正文']}\n时间: {newinfo['时间']}"
-                        msg.append(infostr)
-                    msg.extend(newinfo['图片'])
-                    msg.append(f'链接: {newinfo["链接"]}')
-                    Rssdata.update(date=rss.last_update).where(
-                        Rssdata.group == gid, Rssdata.name == r.name, Rssdata.url == r.url).execute()
-                    await bot.send_group_msg(message=Message('\n'.join(msg)), group_id=gid)
-                    if videos := newinfo['视频']:
-                        for v in videos:
-                            await bot.send_group_msg(message=v, group_id=gid)
+    subs: Dict[str, List[Tuple[int, str, Any]]] = defaultdict(list)
+    for r in Rssdata.select(Rssdata.url, Rssdata.name, Rssdata.date, Rssdata.group).where(
+            Rssdata.group.in_(list(glist.keys()))):
+        subs[r.url].append((r.group, r.name, r.date))
+    sem = asyncio.Semaphore(FETCH_LIMIT)
+
+    async def fetch(url: str) -> Optional[Rss]:
+        async with sem:
+            try:
+                return await Rss.new(url)
+            except Exception as e:
+                sv.logger.exception(e)
+                sv.logger.error(f'获取订阅{url}失败')
+    feeds = await asyncio.gather(*[fetch(url) for url in subs])
+    pushes = []
+    for (url, readers), rss in zip(subs.items(), feeds):
+        if rss is None or not rss.has_entries:
+            continue
+        # 条目的下载和渲染按条目缓存，同名订阅的群合并成一次推送
+        infos: Dict[int, Optional[dict]] = {}
+        targets: Dict[Tuple[str, int], List[int]] = defaultdict(list)
+        updated = []
+        for gid, name, date in readers:
+            try:
+                entries = rss.entries_after(date)
+            except Exception as e:
+                sv.logger.exception(e)
+                continue
+            if not entries:
+                continue
+            updated.append((gid, name))
+            for entry in entries:
+                key = id(entry)
+                if key not in infos:
+                    infos[key] = await rss.entry_info(entry)
+                if infos[key] is not None:
+                    targets[(name, key)].append(gid)
+        if not updated:
+            continue
+        last_update = rss.last_update
+        for gid, name in updated:
+            Rssdata.update(date=last_update).where(
+                Rssdata.group == gid, Rssdata.name == name, Rssdata.url == url).execute()
+        for (name, key), gids in targets.items():
+            msgs = await run_sync(format_info)(name, url, infos[key])
+            pushes.append(Push(sv, msgs, gids, name))
+    return pushes
 
 querynewrss = sv.on_command('看最新订阅', aliases=('查最新订阅', '查看最新订阅'))
 
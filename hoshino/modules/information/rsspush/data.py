@@ -8,7 +8,7 @@ Github: http://github.com/AkiraXie/
 '''
 from loguru import logger
 from pytz import timezone
-from hoshino.util import pic2b64
+from hoshino.util import pic2b64, run_sync
 from io import BytesIO
 from hoshino import aiohttpx, db_dir, MessageSegment
 from PIL import Image
@@ -37,7 +37,7 @@ class Rss:
         '''
         self = cls(url, limit)
         ret = await aiohttpx.get(self.url, params={'limit': self.limit, 'timeout': 5})
-        self.feed = feedparser.parse(ret.content)
+        self.feed = await run_sync(feedparser.parse)(ret.content)
         self.link = self.feed.feed.link
         return self
 
@@ -88,6 +88,12 @@ class Rss:
 
         return ret
 
+    async def entry_info(self, entry: FeedParserDict) -> Optional[Dict]:
+        try:
+            return await Rss._get_rssdic(entry, True)
+        except Exception as e:
+            logger.exception(e)
+
     async def get_new_entry_info(self) -> Optional[Dict]:
         try:
             entries = self.feed_entries
@@ -107,19 +113,26 @@ class Rss:
         except Exception as e:
             logger.exception(e)
 
+    def entries_after(self, otherdt: Union[str,datetime]) -> List[FeedParserDict]:
+        '''
+        比`otherdt`新的条目，新的在前
+        '''
+        if isinstance(otherdt,str):
+            otherdt=datetime.strptime(otherdt,DATE_FORMAT+'%z')
+        otherdt=otherdt.replace(tzinfo=timezone('UTC')).astimezone(timezone('Asia/Shanghai'))
+        entries = []
+        for entry in self.feed_entries:
+            dt = Rss.format_time(entry)
+            if dt > otherdt:
+                entries.append(entry)
+            else:
+                break
+        return entries
+
     async def get_interval_entry_info(self, otherdt: Union[str,datetime]) -> Optional[List[Dict]]:
         try:
-            if isinstance(otherdt,str):
-                otherdt=datetime.strptime(otherdt,DATE_FORMAT+'%z')
-            otherdt=otherdt.replace(tzinfo=timezone('UTC')).astimezone(timezone('Asia/Shanghai'))
             ret = []
-            entries = []
-            for entry in self.feed_entries:
-                dt = Rss.format_time(entry)
-                if dt > otherdt:
-                    entries.append(entry)
-                else:
-                    break
+            entries = self.entries_after(otherdt)
             if not entries:
                 return None
             for entry in entries:
@@ -1,11 +1,10 @@
-from typing import Iterable
 from loguru import logger
 from lxml import etree
 import json
 import os
-from hoshino import scheduled_job, Bot, Event, Service
-from asyncio import sleep
-from hoshino.util import get_bot_list, aiohttpx
+from hoshino import Bot, Event, Service, poll_source, Push
+from hoshino.poller import Source
+from hoshino.util import aiohttpx
 
 sv = Service("steam", enable_on_default=False, visible=False)
 
@@ -146,27 +145,24 @@ async def del_steam_ids(steam_id, group):
     await update_game_status()
 
 
-@scheduled_job('cron', minute='*/2', id='推送steam',jitter=20)
-async def check_steam_status():
-    if not playing_state:
-        await update_game_status()
-        return
-    old_state = playing_state.copy()
+@poll_source('推送steam', host='api.steampowered.com', min_interval=60, max_interval=600)
+async def check_steam_status(src: Source):
+    '''
+    上次的游戏状态保存在轮询源的`state`里，重启后第一次轮询不会把所有人都当成刚开始玩
+    '''
+    if not sub["subscribes"]:
+        return []
     await update_game_status()
-    await sleep(0.5)
-    for key, val in playing_state.items():
-        if val["gameextrainfo"] != old_state[key]["gameextrainfo"]:
-            glist = set(sub["subscribes"][key]) & set((await sv.get_enable_groups()).keys())
-            if val["gameextrainfo"] == "":
-                await broadcast(glist,
-                                "%s 不玩 %s 了！" % (val["personaname"], old_state[key]["gameextrainfo"]))
-            else:
-                await broadcast(glist,
-                                "%s 开始游玩 %s ！" % (val["personaname"], val["gameextrainfo"]))
-
-
-async def broadcast(group_list: Iterable, msg):
-    for group in group_list:
-        for bot in get_bot_list():
-            await bot.send_group_msg(group_id=group, message=msg)
-            await sleep(0.5)
+    changes = src.diff('playing', {key: val["gameextrainfo"]
+                                   for key, val in playing_state.items()})
+    pushes = []
+    for key, (old, new) in changes.items():
+        if old is None:
+            continue
+        name = playing_state[key]["personaname"]
+        if new == "":
+            msg = "%s 不玩 %s 了！" % (name, old)
+        else:
+            msg = "%s 开始游玩 %s ！" % (name, new)
+        pushes.append(Push(sv, msg, sub["subscribes"].get(key, []), 'steam'))
+    return pushes
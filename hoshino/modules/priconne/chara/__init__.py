@@ -7,23 +7,39 @@ Description:
 Github: http://github.com/AkiraXie/
 '''
 import os
-import pygtrie
-import zhconv
-import importlib
+import asyncio
+import threading
+import numpy as np
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
 from PIL import Image, ImageFont
 import nonebot
 from loguru import logger
 from hoshino import Bot, Event, R, rhelper, scheduled_job
 from hoshino.util import sucmd, get_text_size, text2pic, run_sync
-from .util import download_card, download_chara_icon, download_config, download_pcrdata
-from hoshino.modules.priconne import _pcr_data
+from .util import download_many, download_config, download_pcrdata, queue_download, sync_assets
+from .manifest import manifest
+from .atlas import get_icon_array, icon_keys, rebuild_atlases, update_atlases
+from .nameindex import NameIndex, normname, strict_max_dist
+from .roster import Roster, load_roster, save_roster
 dlicon = sucmd('下载头像')
 dlcard = sucmd('下载卡面')
 dldata = sucmd('更新卡池', aliases={'更新数据'})
+syncres = sucmd('同步资源', aliases={'同步头像', '同步卡面'})
+rebuildatlas = sucmd('重建图集', aliases={'重建头像图集'})
 STARS = [1, 3, 6]
-TFONT = ImageFont.truetype(
-    R.img('priconne/gadget/SourceHanSerif-Light.ttc'), 40)
 UNKNOWN = 1000
+# FreeType字体对象包着同一个FT_Face，不能被多个线程同时使用，每个线程各加载一份
+_tfonts = threading.local()
+
+
+def team_font() -> ImageFont.FreeTypeFont:
+    if (font := getattr(_tfonts, 'font', None)) is None:
+        font = _tfonts.font = ImageFont.truetype(
+            R.img('priconne/gadget/SourceHanSerif-Light.ttc'), 40)
+    return font
+
+
 try:
     gadget_equip = R.img('priconne/gadget/equip.png').open()
     gadget_star = R.img('priconne/gadget/star.png').open()
@@ -32,86 +48,193 @@ try:
     unknown_chara_icon = R.img('priconne/unit/icon_unit_100031.png').open()
     like = R.img('priconne/gadget/like.png').open()
     dislike = R.img('priconne/gadget/dislike.png').open()
+    like.thumbnail((40, 40))
+    dislike.thumbnail((40, 40))
+    # 先解码好，之后各线程只读不会并发触发懒加载
+    for im in (gadget_equip, gadget_star, gadget_star_dis, gadget_star_pink, unknown_chara_icon):
+        im.load()
 except Exception as e:
     logger.exception(e)
 os.makedirs(R.img(f'priconne/gadget/').path, exist_ok=True)
 os.makedirs(R.img(f'priconne/card/').path, exist_ok=True)
 os.makedirs(R.img(f'priconne/unit/').path, exist_ok=True)
-NAME2ID = pygtrie.CharTrie()
+ROSTER = load_roster()
+NAME_INDEX = NameIndex(ROSTER.chara_name)
+# 变动的名字不超过这个数时直接在现有索引上增删，否则在线程里重建索引再替换
+DIFF_LIMIT = 200
 
 
-@dlicon.handle()
-async def _(bot: Bot, event: Event):
+@lru_cache(maxsize=64)
+def gadget(name: str, size: int) -> Image.Image:
+    '''
+    缩放好的星星和专武图标，同一尺寸只缩放一次
+    '''
+    return globals()[f'gadget_{name}'].resize((size, size), Image.LANCZOS)
+
+
+async def download_handler(matcher, event: Event, card: bool):
+    kind = '卡面' if card else '头像'
     msgs = event.get_plaintext().strip().split()
     charas = list(map(lambda x: Chara.fromid(int(x))
                       if x.isdigit() else Chara.fromname(x), msgs))
-    replys = ["本次下载头像情况:"]
-    for c in charas:
-        for star in STARS:
-            code, s = await run_sync(download_chara_icon)(c.id, star)
-            status = '成功' if code == 0 else '失败: '
-            replys.append(f'name:{c.name},id:{c.id},star:{s},下载头像{status}')
-            if code != 0:
-                replys.append(code)
-    await dlicon.finish('\n'.join(replys))
+    res = await download_many([c.id for c in charas], STARS, card)
+    replys = [f"本次下载{kind}情况:"]
+    for id_, code, s in res:
+        c = Chara.fromid(id_)
+        status = '成功' if code == 0 else '失败: '
+        replys.append(f'name:{c.name},id:{c.id},star:{s},下载{kind}{status}')
+        if code != 0:
+            replys.append(code)
+    await matcher.finish('\n'.join(replys))
+
+
+@dlicon.handle()
+async def _(bot: Bot, event: Event):
+    await download_handler(dlicon, event, False)
 
 
 @dlcard.handle()
 async def _(bot: Bot, event: Event):
-    msgs = event.get_plaintext().strip().split()
-    charas = list(map(lambda x: Chara.fromid(int(x))
-                      if x.isdigit() else Chara.fromname(x), msgs))
-    replys = ["本次下载卡面情况:"]
-    for c in charas:
-        for star in STARS:
-            code, s = await run_sync(download_card)(c.id, star)
-            status = '成功' if code == 0 else '失败'
-            replys.append(f'name:{c.name},id:{c.id},star:{s},下载卡面{status}')
-            if code != 0:
-                replys.append(code)
-    await dlcard.finish('\n'.join(replys))
+    await download_handler(dlcard, event, True)
 
 
-@scheduled_job('cron', hour='0,12', minute='18', jitter=20, id='检查卡池更新')
-async def check_data():
-    code_1 = await download_pcrdata()
-    code_2 = await download_config()
-    if code_1 == 0 and code_2 == 0:
+def sync_ids() -> list:
+    return [i for i in ROSTER.chara_name if i != UNKNOWN]
+
+
+@syncres.handle()
+async def _(bot: Bot, event: Event):
+    ids = sync_ids()
+    await syncres.send(f'开始同步{len(ids)}个角色的头像和卡面，请稍等~')
+    step = 0
+
+    async def progress(done: int, total: int):
+        nonlocal step
+        if done * 4 // total > step:
+            step = done * 4 // total
+            if done != total:
+                await syncres.send(f'资源同步进度: {done}/{total}')
+    stats = await sync_assets(ids, STARS, progress=progress)
+    await syncres.finish('资源同步完成:\n' + '\n'.join(f'{k}: {v}' for k, v in stats.items()))
+
+
+@scheduled_job('cron', hour='4', minute='30', jitter=60, id='同步角色资源')
+async def sync_resource():
+    stats = await sync_assets(sync_ids(), STARS)
+    logger.info(f'角色资源同步完成: {stats}')
+
+
+_atlas_task: Optional[asyncio.Task] = None
+
+
+@nonebot.get_driver().on_startup
+async def build_atlas():
+    '''
+    启动时把图集里还没有的头像补进去，只处理新增或变化过的文件
+    '''
+    async def _build():
         try:
-            importlib.reload(_pcr_data)
-            Chara.gen_name2id()
+            if added := await run_sync(update_atlases)(icon_keys()):
+                logger.info(f'头像图集新增{added}张头像')
         except Exception as e:
             logger.exception(e)
-            logger.error(f'重载花名册失败！{type(e)}')
+            logger.error('构建头像图集失败')
+    # 事件循环只弱引用任务，保存下来防止构建到一半被回收
+    global _atlas_task
+    _atlas_task = asyncio.get_running_loop().create_task(_build())
 
 
-@dldata.handle()
-async def _(bot: Bot, event: Event):
-    code_1 = await download_pcrdata()
+@rebuildatlas.handle()
+async def _(bot: Bot):
+    await rebuildatlas.send('开始重建头像图集，请稍等~')
+    num = await run_sync(rebuild_atlases)(icon_keys())
+    await rebuildatlas.finish(f'头像图集重建完成，共{num}张')
+
+
+async def apply_roster(new: Roster) -> bool:
+    '''
+    切换到新的花名册快照，内容没有变化时什么也不做
+
+    return: 是否有更新
+    '''
+    global ROSTER, NAME_INDEX
+    if new.version == ROSTER.version:
+        logger.info('花名册没有变化')
+        return False
+    added, removed = await run_sync(ROSTER.diff)(new)
+    if len(added) + len(removed) <= DIFF_LIMIT:
+        for n in removed:
+            NAME_INDEX.remove(n)
+        for n, i in added.items():
+            NAME_INDEX.add(n, i)
+        ROSTER = new
+    else:
+        index = await run_sync(NameIndex)(new.chara_name)
+        ROSTER, NAME_INDEX = new, index
+    await run_sync(save_roster)(new)
+    logger.info(
+        f'花名册已更新至{new.version[:8]}, 新增{len(added)}个名字, 删除{len(removed)}个名字')
+    return True
+
+
+async def update_data() -> list:
+    '''
+    下载花名册和卡池配置，返回错误信息列表
+    '''
+    code_1, roster = await download_pcrdata()
     code_2 = await download_config()
-    if code_1 == 0 and code_2 == 0:
+    exc = [c for c in (code_1, code_2) if c != 0]
+    if roster:
         try:
-            importlib.reload(_pcr_data)
-            Chara.gen_name2id()
+            await apply_roster(roster)
         except Exception as e:
             logger.exception(e)
-            logger.error(f'重载花名册失败！{type(e)}')
-            await dldata.finish(f'重载花名册失败！错误如下：\n{type(e)}, {e}')
+            logger.error(exc_ := f'重载花名册失败！{type(e)}, {e}')
+            exc.append(exc_)
+    return exc
 
-        await dldata.finish('更新卡池和数据成功')
-    else:
-        exc = filter(lambda x: x != 0, (code_1, code_2))
+
+@scheduled_job('cron', hour='0,12', minute='18', jitter=20, id='检查卡池更新')
+async def check_data():
+    await update_data()
+
+
+@dldata.handle()
+async def _(bot: Bot, event: Event):
+    exc = await update_data()
+    if exc:
         exc = "\n".join(exc)
         await dldata.finish(f'更新卡池和数据失败，错误如下：\n {exc}')
+    await dldata.finish('更新卡池和数据成功')
+
+
+_interned: Dict[Tuple[int, int, int], "Chara"] = {}
 
 
 class Chara:
+    '''
+    不可变的享元，相同`(id, star, equip)`的`Chara`是同一个对象
+    '''
     UNKNOWN = 1000
+    __slots__ = ('id', 'star', 'equip')
 
-    def __init__(self, id_: int, star: int = 3, equip: int = 0):
-        self.id = id_
-        self.star = star
-        self.equip = equip
+    def __new__(cls, id_: int, star: int = 3, equip: int = 0):
+        key = (id_, star, equip)
+        try:
+            return _interned[key]
+        except KeyError:
+            pass
+        self = object.__new__(cls)
+        object.__setattr__(self, 'id', id_)
+        object.__setattr__(self, 'star', star)
+        object.__setattr__(self, 'equip', equip)
+        return _interned.setdefault(key, self)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Chara is immutable')
+
+    def __repr__(self) -> str:
+        return f'Chara({self.id}, {self.star}, {self.equip})'
 
     @staticmethod
     def fromid(id_, star=3, equip=0):
@@ -126,11 +249,15 @@ class Chara:
 
     @property
     def name(self):
-        return _pcr_data.CHARA_NAME[self.id][0] if self.id in _pcr_data.CHARA_NAME else _pcr_data.CHARA_NAME[Chara.UNKNOWN][0]
+        chara_name = ROSTER.chara_name
+        return chara_name[self.id][0] if self.id in chara_name else chara_name[Chara.UNKNOWN][0]
 
-    @property
-    def icon(self) -> rhelper:
-        res_path = R.img+'priconne/unit/'
+    def icon_star(self) -> Optional[int]:
+        '''
+        `icon`实际使用的头像星级，缺失的头像会在后台排队下载，下载完成之前用已有的其他星级头像
+
+        return: 星级，`None`表示只能用占位头像
+        '''
         if self.star == 6:
             star = 6
         elif 3 <= self.star <= 5:
@@ -139,24 +266,38 @@ class Chara:
             star = 1
         else:
             for i in (6, 3, 1):
-                if r := res_path+f'icon_unit_{self.id}{i}1.png':
-                    return r
+                if manifest.has('icon', self.id, i):
+                    return i
             star = 6
-        res = res_path+f'icon_unit_{self.id}{star}1.png'
-        if not res:
-            download_chara_icon(self.id, 6)
-            download_chara_icon(self.id, 3)
-            download_chara_icon(self.id, 1)
-        if not res:
-            res = R.img(f'priconne/unit/icon_unit_{UNKNOWN}31.png')
-            for i in (6, 3, 1):
-                if r := res_path+f'icon_unit_{self.id}{i}1.png':
-                    res = r
-                    break
-        return res
+        if manifest.has('icon', self.id, star):
+            return star
+        queue_download(self.id, STARS)
+        for i in (6, 3, 1):
+            if manifest.has('icon', self.id, i):
+                return i
+        return None
+
+    @property
+    def icon(self) -> rhelper:
+        '''
+        缺失的头像会在后台排队下载，下载完成之前返回已有的其他星级头像或占位头像
+        '''
+        if (star := self.icon_star()) is None:
+            return R.img(f'priconne/unit/icon_unit_{UNKNOWN}31.png')
+        return R.img+'priconne/unit/'+f'icon_unit_{self.id}{star}1.png'
+
+    @property
+    def has_icon(self) -> bool:
+        '''
+        本地是否已有任意星级的头像，没有时`icon`返回的是占位头像
+        '''
+        return any(manifest.has('icon', self.id, i) for i in (6, 3, 1))
 
     @property
     def card(self) -> str:
+        '''
+        缺失的卡面会在后台排队下载，下载完成之前返回已有的其他星级卡面或占位头像
+        '''
         res_path = R.img+'priconne/card/'
         if self.star == 6:
             star = 6
@@ -166,29 +307,29 @@ class Chara:
             star = 1
         else:
             for i in (6, 3, 1):
-                tip = f"{self.name}{i}星卡面：\n"
-                if r := res_path+f'{self.id}{i}1.png':
-                    return f'{tip}{r.CQcode}'
+                if manifest.has('card', self.id, i):
+                    r = res_path+f'{self.id}{i}1.png'
+                    return f'{self.name}{i}星卡面：\n{r.CQcode}'
             star = 6
-        tip = f"{self.name}{star}星卡面：\n"
-        res = res_path+f'{self.id}{star}1.png'
-        if not res:
-            download_card(self.id, 6)
-            download_card(self.id, 3)
-            download_card(self.id, 1)
-        if not res:
-            tip = f""
-            res = R.img(f'priconne/unit/icon_unit_{UNKNOWN}31.png')
-            for i in (6, 3, 1):
-                if r := res_path+f'{self.id}{i}1.png':
-                    tip = f"{self.name}{i}星卡面：\n"
-                    res = r
-                    break
-        return f'{tip}{res.CQcode}'
+        if manifest.has('card', self.id, star):
+            r = res_path+f'{self.id}{star}1.png'
+            return f'{self.name}{star}星卡面：\n{r.CQcode}'
+        queue_download(self.id, STARS, card=True)
+        for i in (6, 3, 1):
+            if manifest.has('card', self.id, i):
+                r = res_path+f'{self.id}{i}1.png'
+                return f'{self.name}{i}星卡面：\n{r.CQcode}'
+        res = R.img(f'priconne/unit/icon_unit_{UNKNOWN}31.png')
+        return f'{self.name}的卡面正在下载中，请稍后再试~\n{res.CQcode}'
 
     def gen_icon_img(self, size, star_slot_verbose=True) -> Image.Image:
+        star = self.icon_star()
+        arr = get_icon_array(self.id if star else UNKNOWN, star or 3, size)
         try:
-            pic = self.icon.open().convert('RGBA').resize((size, size), Image.LANCZOS)
+            if arr is not None:
+                pic = Image.fromarray(np.array(arr), 'RGBA')
+            else:
+                pic = self.icon.open().convert('RGBA').resize((size, size), Image.LANCZOS)
         except FileNotFoundError:
             logger.error(f'File not found: {self.icon.path}')
             pic = unknown_chara_icon.convert(
@@ -202,20 +343,18 @@ class Chara:
             for i in range(5 if star_slot_verbose else min(self.star, 5)):
                 a = i*(l-star_lap) + margin_x
                 b = size - l - margin_y
-                s = gadget_star if self.star > i else gadget_star_dis
-                s = s.resize((l, l), Image.LANCZOS)
+                s = gadget('star' if self.star > i else 'star_dis', l)
                 pic.paste(s, (a, b, a+l, b+l), s)
             if 6 == self.star:
                 a = 5*(l-star_lap) + margin_x
                 b = size - l - margin_y
-                s = gadget_star_pink
-                s = s.resize((l, l), Image.LANCZOS)
+                s = gadget('star_pink', l)
                 pic.paste(s, (a, b, a+l, b+l), s)
         if self.equip:
             l = round(l * 1.5)
             a = margin_x
             b = margin_x
-            s = gadget_equip.resize((l, l), Image.LANCZOS)
+            s = gadget('equip', l)
             pic.paste(s, (a, b, a+l, b+l), s)
         return pic
 
@@ -224,27 +363,57 @@ class Chara:
         namestr = Chara.normname(namestr.strip())
         team = []
         unknown = []
-        while namestr:
-            item = NAME2ID.longest_prefix(namestr)
-            if not item:
-                unknown.append(namestr[0])
-                namestr = namestr[1:].lstrip()
+        for start, end, id_ in NAME_INDEX.scan(namestr):
+            if id_ is None:
+                unknown.append(namestr[start:end])
             else:
-                team.append(item.value)
-                namestr = namestr[len(item.key):].lstrip()
+                team.append(id_)
         return team, ''.join(unknown)
 
+    @staticmethod
+    def parse_team_fuzzy(namestr: str) -> tuple:
+        '''
+        与`parse_team`相同，但会尝试把未识别的片段纠正为最接近的角色
+
+        return: (队伍id列表, 仍未识别的字符串, [(原片段, 纠正后的名字), ...])
+        '''
+        namestr = Chara.normname(namestr.strip())
+        team = []
+        unknown = []
+        fixed = []
+        for start, end, id_ in NAME_INDEX.scan(namestr):
+            if id_ is None:
+                raw = namestr[start:end]
+                guess = NAME_INDEX.suggest(raw, 1)
+                if guess:
+                    id_ = guess[0][0]
+                    fixed.append((raw, Chara.fromid(id_).name))
+                else:
+                    unknown.append(raw)
+                    continue
+            team.append(id_)
+        return team, ''.join(unknown), fixed
+
+    @staticmethod
+    def guess(name: str, limit: int = 3, strict: bool = False) -> list:
+        '''
+        返回与`name`最接近的若干角色，`[(Chara, 距离), ...]`
+
+        `strict`为真时用更严的阈值，给聊天里随口触发的查询用
+        '''
+        max_dist = strict_max_dist(normname(name)) if strict else None
+        return [(Chara.fromid(id_), d) for id_, _, d in NAME_INDEX.suggest(name, limit, max_dist)]
+
     @staticmethod
     def gen_team_pic(team, size=128, star_slot_verbose=True, text=None):
         num = len(team)
         if isinstance(text, str):
-            tsize = get_text_size(text, TFONT, padding=(0, 20, 12, 36))
+            font = team_font()
+            tsize = get_text_size(text, font, padding=(0, 20, 12, 36))
             des = Image.new(
                 'RGBA', (num*size+tsize[0]+48, size), (255, 255, 255, 255))
-            timg = text2pic(text, TFONT, padding=(0, 20, 12, 36), spacing=10)
+            timg = text2pic(text, font, padding=(0, 20, 12, 36), spacing=10)
             img = Image.new('RGBA', (40, 100), (255, 255, 255, 255))
-            dislike.thumbnail((40, 40))
-            like.thumbnail((40, 40))
             img.paste(like, (0, 0), like)
             img.paste(dislike, (0, 60), dislike)
             des.paste(img, (num*size+8, 23))
@@ -258,28 +427,22 @@ class Chara:
 
     @staticmethod
     def name2id(name):
-        name = Chara.normname(name)
-        if not NAME2ID:
+        if not NAME_INDEX:
             Chara.gen_name2id()
-        return NAME2ID[name] if name in NAME2ID else UNKNOWN
+        return NAME_INDEX.get(name, UNKNOWN)
+
+    @staticmethod
+    def roster_version() -> str:
+        return ROSTER.version
 
     @staticmethod
     def gen_name2id():
-        NAME2ID.clear()
-        for k, v in _pcr_data.CHARA_NAME.items():
-            for s in v:
-                if s not in NAME2ID:
-                    NAME2ID[Chara.normname(s)] = k
-                else:
-                    logger.warning(
-                        f'Chara.gen_name2id: 出现重名{s}于id{k}与id{NAME2ID[s]}')
+        global NAME_INDEX
+        NAME_INDEX = NameIndex(ROSTER.chara_name)
 
     @staticmethod
     def normname(name: str) -> str:
-        name = name.lower().replace('（', '(').replace('）', ')')
-        name = zhconv.convert(name, 'zh-hans')
-        return name
+        return normname(name)
 
 
-Chara.gen_name2id()
 nonebot.export()['Chara'] = Chara
@@ -0,0 +1,162 @@
+import os
+import json
+import threading
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+from PIL import Image
+from loguru import logger
+from hoshino import R
+from .manifest import manifest
+
+SIZES = (64, 128)
+atlas_dir = R.img('priconne/atlas/').path
+unit_dir = R.img('priconne/unit/').path
+os.makedirs(atlas_dir, exist_ok=True)
+
+
+class IconAtlas:
+    '''
+    把同一尺寸的头像拼成一个`(n, size, size, 4)`的`uint8`数组存成裸文件，运行时用`np.memmap`映射
+
+    *`index`: 清单键`{id}{star}1`到`[行号, 源文件mtime_ns]`的映射
+    新头像直接追加到文件末尾，源文件变化时追加新行并让索引指向新行，旧行在`rebuild`时回收
+    '''
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.path = os.path.join(atlas_dir, f'icon_{size}.bin')
+        self.index_path = os.path.join(atlas_dir, f'icon_{size}.json')
+        self.index: Dict[str, List[int]] = {}
+        self.rows = 0
+        self.data: Optional[np.memmap] = None
+        self.lock = threading.Lock()
+
+    @property
+    def row_bytes(self) -> int:
+        return self.size * self.size * 4
+
+    def load(self):
+        try:
+            with open(self.index_path, encoding='utf8') as f:
+                data = json.load(f)
+            rows = data['rows']
+            if os.path.getsize(self.path) < rows * self.row_bytes:
+                raise ValueError('图集文件比索引短')
+            self.index, self.rows = data['index'], rows
+        except FileNotFoundError:
+            self.index, self.rows = {}, 0
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'{self.size}px头像图集损坏，将重建')
+            self.index, self.rows = {}, 0
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        self._map()
+
+    def _map(self):
+        self.data = np.memmap(self.path, dtype=np.uint8, mode='r',
+                              shape=(self.rows, self.size, self.size, 4)) if self.rows else None
+
+    def _save_index(self):
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({'size': self.size, 'rows': self.rows,
+                       'index': self.index}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, id_: int, star: int) -> Optional[np.ndarray]:
+        '''
+        return: 只读的`(size, size, 4)`视图，没有时返回`None`
+        '''
+        entry = self.index.get(manifest.key(id_, star))
+        data = self.data
+        if entry is None or data is None or entry[0] >= len(data):
+            return None
+        return data[entry[0]]
+
+    def _render(self, key: str) -> np.ndarray:
+        path = os.path.join(unit_dir, f'icon_unit_{key}.png')
+        with Image.open(path) as im:
+            pic = im.convert('RGBA').resize(
+                (self.size, self.size), Image.LANCZOS)
+        return np.asarray(pic, dtype=np.uint8)
+
+    def update(self, keys: Iterable[str]) -> int:
+        '''
+        把源文件新增或变化过的头像追加进图集，在线程里调用
+
+        return: 追加的行数
+        '''
+        with self.lock:
+            todo: List[Tuple[str, int]] = []
+            for key in keys:
+                try:
+                    mtime = os.stat(os.path.join(
+                        unit_dir, f'icon_unit_{key}.png')).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                if (entry := self.index.get(key)) is None or entry[1] != mtime:
+                    todo.append((key, mtime))
+            if not todo:
+                return 0
+            index = dict(self.index)
+            rows = self.rows
+            with open(self.path, 'ab') as f:
+                f.truncate(rows * self.row_bytes)
+                for key, mtime in todo:
+                    try:
+                        f.write(self._render(key).tobytes())
+                    except Exception as e:
+                        logger.error(f'头像{key}写入图集失败: {type(e)}, {e}')
+                        continue
+                    index[key] = [rows, mtime]
+                    rows += 1
+            added = rows - self.rows
+            self.index, self.rows = index, rows
+            self._map()
+            self._save_index()
+            return added
+
+    def rebuild(self, keys: Iterable[str]) -> int:
+        '''
+        从头重建，回收被替换掉的旧行
+        '''
+        with self.lock:
+            self.index, self.rows, self.data = {}, 0, None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        return self.update(keys)
+
+
+atlases: Dict[int, IconAtlas] = {s: IconAtlas(s) for s in SIZES}
+
+
+def load_atlases():
+    for a in atlases.values():
+        a.load()
+
+
+def get_icon_array(id_: int, star: int, size: int) -> Optional[np.ndarray]:
+    if (a := atlases.get(size)) is None:
+        return None
+    return a.get(id_, star)
+
+
+def icon_keys() -> List[str]:
+    '''
+    清单里全部头像的键，要在事件循环里取，再交给线程里的`update_atlases`
+    '''
+    return list(manifest.entries['icon'])
+
+
+def update_atlases(keys: Iterable[str]) -> int:
+    keys = list(keys)
+    return sum(a.update(keys) for a in atlases.values())
+
+
+def rebuild_atlases(keys: Iterable[str]) -> int:
+    keys = list(keys)
+    return sum(a.rebuild(keys) for a in atlases.values())
+
+
+load_atlases()
@@ -0,0 +1,158 @@
+import os
+import json
+import asyncio
+import threading
+from loguru import logger
+from typing import Dict, Iterable, Optional, Set
+from hoshino import R
+from hoshino.util import run_sync
+
+manifest_path = R.img('priconne/asset_manifest.json').path
+KINDS = ('icon', 'card')
+_dirs = {'icon': 'priconne/unit/', 'card': 'priconne/card/'}
+_prefix = {'icon': 'icon_unit_', 'card': ''}
+
+
+class AssetManifest:
+    '''
+    记录本地已有的头像和卡面，以及下载时服务器返回的`ETag`
+
+    `Chara.icon`和`Chara.card`通过它判断资源是否存在，不再逐个探测磁盘
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries: Dict[str, Dict[str, dict]] = {k: {} for k in KINDS}
+        self.sync_done: Optional[Set[str]] = None
+        self._dirty = 0
+        self._writer: Optional[asyncio.Task] = None
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def key(id_: int, star: int) -> str:
+        return f'{id_}{star}1'
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf8') as f:
+                data = json.load(f)
+            for k in KINDS:
+                self.entries[k] = data.get(k, {})
+            if (done := data.get('sync')) is not None:
+                self.sync_done = set(done)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+            logger.error('资源清单损坏，将重新扫描资源目录')
+        self.scan()
+
+    def scan(self):
+        '''
+        把清单里没有但磁盘上已有的文件补进清单，清单里有但磁盘上已没有的文件移出清单
+        '''
+        for kind in KINDS:
+            entries = self.entries[kind]
+            prefix = _prefix[kind]
+            found = set()
+            path = R.img(_dirs[kind]).path
+            os.makedirs(path, exist_ok=True)
+            for f in os.scandir(path):
+                name = f.name
+                if name.startswith(prefix) and name.endswith('.png'):
+                    found.add(name[len(prefix):-4])
+            for k in found - entries.keys():
+                entries[k] = {'etag': None}
+            for k in entries.keys() - found:
+                del entries[k]
+
+    def _capture(self) -> dict:
+        data = {k: dict(v) for k, v in self.entries.items()}
+        data['sync'] = sorted(
+            self.sync_done) if self.sync_done is not None else None
+        return data
+
+    def _write(self, data: dict):
+        with self._write_lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def save(self):
+        self._write(self._capture())
+        self._dirty = 0
+
+    async def save_async(self):
+        '''
+        在事件循环里复制数据，写文件放到线程里；写失败时保持待写状态
+        '''
+        data = self._capture()
+        dirty, self._dirty = self._dirty, 0
+        try:
+            await run_sync(self._write)(data)
+        except Exception:
+            self._dirty += dirty or 1
+            raise
+
+    async def _save_async(self, every: int):
+        try:
+            while True:
+                data = self._capture()
+                self._dirty = 0
+                try:
+                    await run_sync(self._write)(data)
+                except Exception as e:
+                    logger.exception(e)
+                    logger.error('保存资源清单失败')
+                    self._dirty += 1
+                    break
+                if self._dirty < every:
+                    break
+        finally:
+            self._writer = None
+
+    def save_later(self, every: int = 20):
+        '''
+        每积累`every`次修改才写一次盘；数据在事件循环里复制，写文件放到线程里
+        '''
+        self._dirty += 1
+        if self._dirty < every or self._writer is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        self._writer = loop.create_task(self._save_async(every))
+
+    def has(self, kind: str, id_: int, star: int) -> bool:
+        return self.key(id_, star) in self.entries[kind]
+
+    def etag(self, kind: str, id_: int, star: int) -> Optional[str]:
+        entry = self.entries[kind].get(self.key(id_, star))
+        return entry['etag'] if entry else None
+
+    def add(self, kind: str, id_: int, star: int, etag: Optional[str] = None):
+        self.entries[kind][self.key(id_, star)] = {'etag': etag}
+        self.save_later()
+
+    def begin_sync(self, resume: bool = True) -> Set[str]:
+        '''
+        开始一次全量同步，返回上次中断时已经完成的条目
+        '''
+        if not resume or self.sync_done is None:
+            self.sync_done = set()
+        return self.sync_done
+
+    def mark_synced(self, kind: str, id_: int, star: int):
+        self.sync_done.add(f'{kind}/{self.key(id_, star)}')
+        self.save_later()
+
+    async def end_sync(self):
+        self.sync_done = None
+        await self.save_async()
+
+
+manifest = AssetManifest(manifest_path)
+manifest.load()
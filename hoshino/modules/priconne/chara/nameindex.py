@@ -0,0 +1,216 @@
+import zhconv
+from functools import lru_cache
+from loguru import logger
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_END = ''
+
+
+@lru_cache(maxsize=8192)
+def normname(name: str) -> str:
+    name = name.lower().replace('（', '(').replace('）', ')')
+    name = zhconv.convert(name, 'zh-hans')
+    return name
+
+
+def edit_distance(a: str, b: str, limit: int = 1 << 30) -> int:
+    '''
+    Levenshtein距离，超过`limit`后提前返回`limit + 1`
+    '''
+    if len(a) < len(b):
+        a, b = b, a
+    if len(a) - len(b) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        best = i
+        for j, cb in enumerate(b, 1):
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            cur.append(v)
+            best = min(best, v)
+        if best > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+MAX_DIST = 2
+
+
+def _deletes(word: str, depth: int) -> set:
+    '''
+    删去`word`中至多`depth`个字符得到的全部字符串，包括`word`本身
+    '''
+    ret = {word}
+    layer = {word}
+    for _ in range(depth):
+        layer = {w[:i] + w[i+1:] for w in layer for i in range(len(w))}
+        ret |= layer
+    return ret
+
+
+class DeleteIndex:
+    '''
+    删除邻域索引：两个编辑距离不超过`d`的字符串，各自删去至多`d`个字符后必有公共结果
+
+    预先把每个名字的删除邻域放进`dict`，查询时只需对输入做同样的删除再校验候选，
+    比遍历整个花名册计算编辑距离快得多
+    '''
+
+    def __init__(self, depth: int = MAX_DIST) -> None:
+        self.depth = depth
+        self.table: Dict[str, List[str]] = {}
+
+    def add(self, word: str):
+        for d in _deletes(word, self.depth):
+            self.table.setdefault(d, []).append(word)
+
+    def search(self, word: str, max_dist: int) -> List[Tuple[int, str]]:
+        max_dist = min(max_dist, self.depth)
+        seen = set()
+        ret = []
+        for d in _deletes(word, max_dist):
+            for w in self.table.get(d, ()):
+                if w in seen:
+                    continue
+                seen.add(w)
+                if (dist := edit_distance(word, w, max_dist)) <= max_dist:
+                    ret.append((dist, w))
+        ret.sort()
+        return ret
+
+
+def default_max_dist(name: str) -> int:
+    '''
+    一个字的名字不做模糊匹配，四个字以内允许错一个字，更长的允许错两个字
+    '''
+    n = len(name)
+    return 0 if n <= 1 else 1 if n <= 4 else 2
+
+
+def strict_max_dist(name: str) -> int:
+    '''
+    聊天里随口触发的查询用这个：三个字以下不做模糊匹配，编辑距离要小于长度的三分之一
+    '''
+    n = len(name)
+    return 0 if n < 3 else (n - 1) // 3
+
+
+class NameIndex:
+    '''
+    预先规范化好的花名册索引
+
+    *`names`: 规范化名字到角色id的映射
+    *`trie`: 由嵌套`dict`构成的字典树，叶子用`''`键存放角色id，供单趟最长匹配分词使用
+    *`fuzzy`: 模糊匹配用的删除邻域索引
+    '''
+
+    def __init__(self, chara_name: Dict[int, Iterable[str]]) -> None:
+        self.names: Dict[str, int] = {}
+        self.trie: dict = {}
+        self.fuzzy = DeleteIndex()
+        for k, v in chara_name.items():
+            for s in v:
+                n = normname(s)
+                if n in self.names:
+                    if self.names[n] != k:
+                        logger.warning(
+                            f'NameIndex: 出现重名{s}于id{k}与id{self.names[n]}')
+                    continue
+                self.add(n, k)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return normname(name) in self.names
+
+    def add(self, name: str, id_: int):
+        '''
+        `name`需已规范化
+        '''
+        self.names[name] = id_
+        node = self.trie
+        for c in name:
+            node = node.setdefault(c, {})
+        node[_END] = id_
+        self.fuzzy.add(name)
+
+    def remove(self, name: str):
+        '''
+        `name`需已规范化，模糊索引里的名字不会删除，查询时会用`names`过滤掉
+        '''
+        if self.names.pop(name, None) is None:
+            return
+        path = [self.trie]
+        for c in name:
+            path.append(path[-1][c])
+        del path[-1][_END]
+        for c, node in zip(reversed(name), reversed(path[:-1])):
+            if node[c]:
+                break
+            del node[c]
+
+    def get(self, name: str, default: Optional[int] = None) -> Optional[int]:
+        return self.names.get(normname(name), default)
+
+    def scan(self, text: str) -> List[Tuple[int, int, Optional[int]]]:
+        '''
+        对规范化后的`text`做一趟最长匹配分词
+
+        return: `[(start, end, id), ...]`，连续未识别的字符合并为一段，`id`为`None`，空白被跳过
+        '''
+        trie = self.trie
+        ret = []
+        n = len(text)
+        i = 0
+        unknown_start = -1
+        while i < n:
+            if text[i].isspace():
+                if unknown_start >= 0:
+                    ret.append((unknown_start, i, None))
+                    unknown_start = -1
+                i += 1
+                continue
+            node = trie
+            j = i
+            match_end, match_id = -1, None
+            while j < n and (node := node.get(text[j])) is not None:
+                j += 1
+                if _END in node:
+                    match_end, match_id = j, node[_END]
+            if match_end < 0:
+                if unknown_start < 0:
+                    unknown_start = i
+                i += 1
+                continue
+            if unknown_start >= 0:
+                ret.append((unknown_start, i, None))
+                unknown_start = -1
+            ret.append((i, match_end, match_id))
+            i = match_end
+        if unknown_start >= 0:
+            ret.append((unknown_start, n, None))
+        return ret
+
+    def suggest(self, name: str, limit: int = 3, max_dist: Optional[int] = None) -> List[Tuple[int, str, int]]:
+        '''
+        返回与`name`编辑距离最近的若干已知名字
+
+        return: `[(id, 规范化名字, 距离), ...]`，按距离升序，同一角色只保留最近的一个名字
+        '''
+        name = normname(name)
+        if max_dist is None:
+            max_dist = default_max_dist(name)
+        ret = []
+        seen = set()
+        for d, w in self.fuzzy.search(name, max_dist):
+            id_ = self.names.get(w)
+            if id_ is None or id_ in seen:
+                continue
+            seen.add(id_)
+            ret.append((id_, w, d))
+            if len(ret) >= limit:
+                break
+        return ret
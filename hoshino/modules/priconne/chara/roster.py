@@ -0,0 +1,93 @@
+import os
+import ast
+import json
+import hashlib
+from types import MappingProxyType
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+from loguru import logger
+from hoshino import hsn_config
+from hoshino.modules.priconne import pcrdatapath
+from .nameindex import normname
+
+roster_path = os.path.join(hsn_config.data, 'roster.json')
+
+
+class Roster:
+    '''
+    花名册的不可变快照，`version`是内容的sha256
+    '''
+    __slots__ = ('chara_name', 'version')
+
+    def __init__(self, chara_name: Mapping[int, Iterable[str]], version: Optional[str] = None) -> None:
+        data = {int(k): tuple(v) for k, v in chara_name.items()}
+        object.__setattr__(self, 'chara_name', MappingProxyType(data))
+        object.__setattr__(self, 'version', version or self.digest(data))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Roster is immutable')
+
+    @staticmethod
+    def digest(data: Mapping[int, Tuple[str, ...]]) -> str:
+        raw = json.dumps({str(k): list(v) for k, v in sorted(data.items())},
+                         ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(raw.encode('utf8')).hexdigest()
+
+    def name_map(self) -> Dict[str, int]:
+        '''
+        规范化名字到id的映射，重名时保留先出现的，与`NameIndex`一致
+        '''
+        ret = {}
+        for k, v in self.chara_name.items():
+            for s in v:
+                ret.setdefault(normname(s), k)
+        return ret
+
+    def diff(self, other: "Roster") -> Tuple[Dict[str, int], Dict[str, int]]:
+        '''
+        return: (`other`中新增或改了id的名字, `self`中被删除或改了id的名字)
+        '''
+        old, new = self.name_map(), other.name_map()
+        added = {n: i for n, i in new.items() if old.get(n) != i}
+        removed = {n: i for n, i in old.items() if new.get(n) != i}
+        return added, removed
+
+    def to_json(self) -> dict:
+        return {'version': self.version,
+                'chara_name': {str(k): list(v) for k, v in self.chara_name.items()}}
+
+
+def parse_pcrdata(source: bytes) -> Dict[int, Tuple[str, ...]]:
+    '''
+    从`_pcr_data.py`的源码里取出`CHARA_NAME`字面量，不执行任何代码
+    '''
+    tree = ast.parse(source)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == 'CHARA_NAME' for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError('CHARA_NAME not found')
+
+
+def save_roster(roster: Roster):
+    tmp_path = f'{roster_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(roster.to_json(), f, ensure_ascii=False)
+    os.replace(tmp_path, roster_path)
+
+
+def load_roster() -> Roster:
+    '''
+    读取本地花名册，没有时用`_pcr_data.py`初始化
+    '''
+    try:
+        with open(roster_path, encoding='utf8') as f:
+            data = json.load(f)
+        return Roster(data['chara_name'])
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.exception(e)
+        logger.error('本地花名册损坏，将从_pcr_data.py重新生成')
+    with open(pcrdatapath, 'rb') as f:
+        roster = Roster(parse_pcrdata(f.read()))
+    save_roster(roster)
+    return roster
@@ -6,57 +6,218 @@ LastEditTime: 2021-03-15 03:09:38
 Description: 
 Github: http://github.com/AkiraXie/
 '''
+import asyncio
+import os
+import json
+import time
 from loguru import logger
-import requests
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 from hoshino import R
-from hoshino.util import Image, BytesIO, aiohttpx
-from hoshino.modules.priconne import pcrdatapath
-import os
+from hoshino.util import Image, BytesIO, aiohttpx, run_sync
+from .manifest import manifest
+from .atlas import update_atlases
+from .roster import Roster, parse_pcrdata
 os.makedirs(R.img('priconne/unit/'), exist_ok=1)
 os.makedirs(R.img('priconne/card/'), exist_ok=1)
 jsonpath = 'hoshino/service_config/gacha.json'
+MAX_CONCURRENCY = 4
+# 后台下载失败(包括404)后，这段时间内不再自动重试
+RETRY_AFTER = 1800
+_sem: Optional[asyncio.Semaphore] = None
+_pending: Set[Tuple[str, int, int]] = set()
+# 事件循环只弱引用任务，这里持有强引用，防止下载到一半被回收
+_tasks: Set[asyncio.Task] = set()
+# 下载失败的资源到可以重试的时间
+_failed: Dict[Tuple[str, int, int], float] = {}
+
+
+def _get_sem() -> asyncio.Semaphore:
+    '''
+    信号量需要在事件循环中创建，所以延迟到第一次下载时再创建
+    '''
+    global _sem
+    if _sem is None:
+        _sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _sem
+
+
+def icon_url(id_: int, star: int) -> str:
+    return f'https://redive.estertion.win/icon/unit/{id_}{star}1.webp'
+
+
+def card_url(id_: int, star: int) -> str:
+    return f'https://redive.estertion.win/card/full/{id_}{star}1.webp' if star != 1 else f'https://redive.estertion.win/card/profile/{id_}11.webp'
 
 
-def download_chara_icon(id_: int, star: int):
-    url = f'https://redive.estertion.win/icon/unit/{id_}{star}1.webp'
-    save_path = R.img(f'priconne/unit/icon_unit_{id_}{star}1.png').path
-    logger.info(f'Downloading chara icon from {url}')
+def icon_path(id_: int, star: int) -> str:
+    return R.img(f'priconne/unit/icon_unit_{id_}{star}1.png').path
+
+
+def card_path(id_: int, star: int) -> str:
+    return R.img(f'priconne/card/{id_}{star}1.png').path
+
+
+def save_image_atomic(content: bytes, save_path: str):
+    '''
+    先写入同目录下的临时文件再替换，读者不会看到写了一半的图片
+    '''
+    tmp_path = f'{save_path}.{os.getpid()}.tmp'
     try:
-        rsp = requests.get(url, timeout=5, stream=True,verify=False)
-    except Exception as e:
-        logger.error(exc := f'Failed to download {url}. {type(e)}')
-        logger.exception(e)
-        return exc, star
-    if 200 == rsp.status_code:
-        img = Image.open(BytesIO(rsp.content))
-        img.save(save_path)
-        logger.info(f'Saved to {save_path}')
-        return 0, star
-    else:
+        with Image.open(BytesIO(content)) as img:
+            img.save(tmp_path, format='PNG')
+        os.replace(tmp_path, save_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _get_etag(headers) -> Optional[str]:
+    return headers.get('ETag') or headers.get('Last-Modified')
+
+
+async def _download(kind: str, id_: int, star: int) -> Tuple[Union[int, str], int]:
+    url = card_url(id_, star) if kind == 'card' else icon_url(id_, star)
+    save_path = card_path(id_, star) if kind == 'card' else icon_path(id_, star)
+    async with _get_sem():
+        logger.info(f'Downloading from {url}')
+        try:
+            rsp = await aiohttpx.get(url, timeout=5)
+        except Exception as e:
+            logger.error(exc := f'Failed to download {url}. {type(e)}')
+            logger.exception(e)
+            return exc, star
+    if 200 != rsp.status_code:
         logger.error(
             exc := f'Failed to download {url}. HTTP {rsp.status_code}')
         return exc, star
-
-
-def download_card(id_: int, star: int):
-    url = f'https://redive.estertion.win/card/full/{id_}{star}1.webp' if star != 1 else f'https://redive.estertion.win/card/profile/{id_}11.webp'
-    save_path = R.img(f'priconne/card/{id_}{star}1.png').path
-    logger.info(f'Downloading card from {url}')
     try:
-        rsp = requests.get(url, timeout=5, stream=True,verify=False)
+        await run_sync(save_image_atomic)(rsp.content, save_path)
     except Exception as e:
-        logger.error(exc := f'Failed to download {url}. {type(e)}')
+        logger.error(exc := f'Failed to save {save_path}. {type(e)}')
         logger.exception(e)
         return exc, star
-    if 200 == rsp.status_code:
-        img = Image.open(BytesIO(rsp.content))
-        img.save(save_path)
-        logger.info(f'Saved to {save_path}')
-        return 0, star
+    manifest.add(kind, id_, star, _get_etag(rsp.headers))
+    logger.info(f'Saved to {save_path}')
+    if kind == 'icon':
+        try:
+            await run_sync(update_atlases)([manifest.key(id_, star)])
+        except Exception as e:
+            logger.error(f'Failed to update icon atlas. {type(e)}:{e}')
+    return 0, star
+
+
+async def download_chara_icon(id_: int, star: int) -> Tuple[Union[int, str], int]:
+    return await _download('icon', id_, star)
+
+
+async def download_card(id_: int, star: int) -> Tuple[Union[int, str], int]:
+    return await _download('card', id_, star)
+
+
+async def download_many(ids: Iterable[int], stars: Iterable[int], card: bool = False) -> List[Tuple[int, Union[int, str], int]]:
+    '''
+    并发下载多个角色的头像或卡面，并发数受`MAX_CONCURRENCY`限制
+
+    return: [(id, code, star), ...], code为0表示成功
+    '''
+    func = download_card if card else download_chara_icon
+    ids = list(ids)
+    stars = list(stars)
+    tasks = [func(i, s) for i in ids for s in stars]
+    res = await asyncio.gather(*tasks)
+    keys = [i for i in ids for _ in stars]
+    return [(k, code, s) for k, (code, s) in zip(keys, res)]
+
+
+def queue_download(id_: int, stars: Iterable[int], card: bool = False):
+    '''
+    在后台排队下载缺失的资源，立即返回，不会阻塞渲染
+    '''
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    kind = 'card' if card else 'icon'
+    func = download_card if card else download_chara_icon
+    now = time.time()
+    for star in stars:
+        key = (kind, id_, star)
+        if key in _pending or _failed.get(key, 0) > now:
+            continue
+        _pending.add(key)
+        task = loop.create_task(func(id_, star))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        task.add_done_callback(lambda t, key=key: _download_done(key, t))
+
+
+def _download_done(key: Tuple[str, int, int], task: asyncio.Task):
+    _pending.discard(key)
+    if not task.cancelled() and task.exception() is None and task.result()[0] == 0:
+        _failed.pop(key, None)
     else:
-        logger.error(
-            exc := f'Failed to download {url}. HTTP {rsp.status_code}')
-        return exc, star
+        _failed[key] = time.time() + RETRY_AFTER
+
+
+async def _sync_one(kind: str, id_: int, star: int) -> str:
+    url = card_url(id_, star) if kind == 'card' else icon_url(id_, star)
+    try:
+        rsp = await aiohttpx.head(url, timeout=5)
+    except Exception as e:
+        logger.error(f'Failed to head {url}. {type(e)}')
+        return 'failed'
+    if rsp.status_code == 404:
+        return 'absent'
+    if rsp.status_code != 200:
+        logger.error(f'Failed to head {url}. HTTP {rsp.status_code}')
+        return 'failed'
+    etag = _get_etag(rsp.headers)
+    if manifest.has(kind, id_, star) and (etag is None or etag == manifest.etag(kind, id_, star)):
+        return 'unchanged'
+    code, _ = await _download(kind, id_, star)
+    return 'updated' if code == 0 else 'failed'
+
+
+async def sync_assets(ids: Iterable[int], stars: Iterable[int] = (1, 3, 6), kinds: Iterable[str] = ('icon', 'card'),
+                      resume: bool = True, progress: Optional[Callable[[int, int], Awaitable[None]]] = None) -> Dict[str, int]:
+    '''
+    全量同步头像和卡面，仅下载缺失或`ETag`变化的资源
+
+    上次同步若被中断，`resume`为真时会跳过已经完成的条目
+
+    *`progress`: 每完成一个条目就会以`(已完成数, 总数)`调用一次的协程函数
+
+    return: 各结果的计数，键为`updated`,`unchanged`,`absent`,`failed`,`skipped`
+    '''
+    done = manifest.begin_sync(resume)
+    todo = [(k, i, s) for k in kinds for i in ids for s in stars]
+    stats = dict.fromkeys(('updated', 'unchanged', 'absent', 'failed'), 0)
+    stats['skipped'] = 0
+    total = len(todo)
+    finished = 0
+    sem = asyncio.Semaphore(MAX_CONCURRENCY * 2)
+
+    async def _run(kind: str, id_: int, star: int):
+        nonlocal finished
+        if f'{kind}/{manifest.key(id_, star)}' in done:
+            stats['skipped'] += 1
+        else:
+            async with sem:
+                ret = await _sync_one(kind, id_, star)
+            stats[ret] += 1
+            if ret != 'failed':
+                manifest.mark_synced(kind, id_, star)
+        finished += 1
+        if progress:
+            await progress(finished, total)
+
+    try:
+        await asyncio.gather(*[_run(*t) for t in todo])
+    finally:
+        await manifest.save_async()
+    if not stats['failed']:
+        await manifest.end_sync()
+    return stats
 
 
 async def download_config():
@@ -70,24 +231,39 @@ async def download_config():
     if 200 != dataget.status_code:
         logger.error(exc := f'连接服务器失败,HTTP {dataget.status_code}')
         return exc
-    with open(jsonpath, 'wb') as f:
+    try:
+        json.loads(datacon)
+    except ValueError as e:
+        logger.error(exc := f'卡池配置不是合法的JSON. {e}')
+        return exc
+    with open(f'{jsonpath}.tmp', 'wb') as f:
         f.write(datacon)
+    os.replace(f'{jsonpath}.tmp', jsonpath)
     logger.info('下载卡池配置成功')
     return 0
 
 
-async def download_pcrdata():
+async def download_pcrdata() -> Tuple[Union[int, str], Optional[Roster]]:
+    '''
+    下载花名册并解析为`Roster`快照，源码只做字面量解析，不会被执行
+
+    return: (0或错误信息, `Roster`或`None`)
+    '''
     try:
         dataget = await aiohttpx.get('http://api.akiraxie.cc/pcr/_pcr_data.py', timeout=5)
         datacon = dataget.content
     except Exception as e:
         logger.error(exc := f'下载角色数据失败. {type(e)}:{e}')
         logger.exception(e)
-        return exc
+        return exc, None
     if 200 != dataget.status_code:
         logger.error(exc := f'连接服务器失败,HTTP {dataget.status_code}')
-        return exc
-    with open(pcrdatapath, 'wb') as f:
-        f.write(datacon)
-    logger.info('下载角色数据成功')
-    return 0
+        return exc, None
+    try:
+        roster = await run_sync(lambda: Roster(parse_pcrdata(datacon)))()
+    except Exception as e:
+        logger.error(exc := f'解析角色数据失败. {type(e)}:{e}')
+        logger.exception(e)
+        return exc, None
+    logger.info(f'下载角色数据成功, version={roster.version[:8]}')
+    return 0, roster
@@ -7,11 +7,12 @@ Description:
 Github: http://github.com/AkiraXie/
 '''
 
-
-
+import time
+import numpy as np
+from typing import Optional
 from hoshino.typing import T_State
 from hoshino.service import matcher_wrapper
-from hoshino.util import DailyNumberLimiter, pic2b64, concat_pic, normalize_str, sucmd,parse_qq
+from hoshino.util import DailyNumberLimiter, pic2b64, concat_pic, normalize_str, sucmd,parse_qq, run_sync
 from hoshino import MessageSegment, Message, Service, permission, Bot, Event
 from hoshino.event import GroupMessageEvent, PrivateMessageEvent
 from hoshino.matcher import Matcher
@@ -19,11 +20,13 @@ from nonebot.exception import FinishedException
 from nonebot.plugin import require
 Chara =require('chara')['Chara']
 sv = Service('gacha')
-from .gacha import Gacha
-from .data import set_collection, set_pool, select_collection, get_pool
+from .gacha import get_gacha
+from .engine import summarize, user_rng
+from .data import set_collection, set_pool, select_collection, get_pool, collection_version
+from .render import get_cached, render_collection
 
-jewel_limit = DailyNumberLimiter(7500)
-tenjo_limit = DailyNumberLimiter(1)
+jewel_limit = DailyNumberLimiter(7500, 'gacha_jewel', persist=True)
+tenjo_limit = DailyNumberLimiter(1, 'gacha_tenjo', persist=True)
 
 
 JEWEL_EXCEED_NOTICE = f'您今天已经抽过{jewel_limit.max}钻了，欢迎明早5点后再来！'
@@ -36,6 +39,9 @@ gacha_1_aliases = {'单抽', '单抽！', '来发单抽', '来个单抽', '来
                    '單抽', '單抽！', '來發單抽', '來個單抽', '來次單抽', '轉蛋單抽', '單抽轉蛋'}
 gacha_300_aliases = {'抽一井', '来一井', '来发井', '抽发井', '天井扭蛋',
                      '扭蛋天井', '天井轉蛋', '轉蛋天井', '抽井'}
+# 模拟天井的默认和最大次数
+SIM_DEFAULT = 10000
+SIM_MAX = 100000
 
 
 gacha1 = sv.on_command('gacha1', aliases=gacha_1_aliases, only_group=False)
@@ -43,6 +49,8 @@ gacha1 = sv.on_command('gacha1', aliases=gacha_1_aliases, only_group=False)
 gacha10 = sv.on_command('gacha10', aliases=gacha_10_aliases, only_group=False)
 gacha300 = sv.on_command(
     'gacha300', aliases=gacha_300_aliases, only_group=False)
+simulate = sv.on_command('模拟天井', aliases={
+    '天井模拟', '模拟抽井'}, only_group=False)
 showcol = sv.on_command('仓库',  aliases={
     '查看仓库', '我的仓库', '看看仓库'}, only_group=False)
 
@@ -66,7 +74,7 @@ async def lookup_handler(bot: Bot, event: Event):
         gid = event.user_id*100
 
     pool = get_pool(gid)
-    gacha = Gacha(pool)
+    gacha = get_gacha(pool)
     up_chara = gacha.up
     up_chara = map(lambda x: str(
         Chara.fromname(x).icon.CQcode) + x, up_chara)
@@ -80,21 +88,25 @@ lookup = sv.on_command("看看卡池", aliases={
     '查看卡池',  '康康卡池', '卡池資訊', '看看up', 'kkup', '看看UP', '卡池资讯'}, only_group=False, handlers=[lookup_handler])
 
 
-async def lookpool_handler(bot: Bot, event: Event, state: T_State):
-    match = state['match']
-    name = match.group(1)
+def pool_from_name(name: str) -> Optional[str]:
     if name in ('b', 'b服', 'bl', 'bilibili', '国', '国服', 'cn'):
-        pool = 'BL'
+        return 'BL'
     elif name in ('台', '台服', 'tw', 'sonet'):
-        pool = 'TW'
+        return 'TW'
     elif name in ('日', '日服', 'jp', 'cy', 'cygames'):
-        pool = 'JP'
+        return 'JP'
     elif name in ('混', '混合', 'mix'):
-        pool = 'MIX'
-    elif name:
+        return 'MIX'
+    return None
+
+
+async def lookpool_handler(bot: Bot, event: Event, state: T_State):
+    match = state['match']
+    name = match.group(1)
+    if not (pool := pool_from_name(name)):
         await bot.send(event, '查看卡池失败,未识别{}'.format(name))
         raise FinishedException
-    gacha = Gacha(pool)
+    gacha = get_gacha(pool)
     up_chara = gacha.up
     up_chara = map(lambda x: str(
         Chara.fromname(x).icon.CQcode) + x, up_chara)
@@ -114,14 +126,8 @@ async def parse_pool(bot: Bot, event: Event, state: T_State):
     elif isinstance(event, PrivateMessageEvent):
         state['gid'] = event.user_id*100
     name = normalize_str(event.get_plaintext().strip())
-    if name in ('b', 'b服', 'bl', 'bilibili', '国', '国服', 'cn'):
-        state['pool'] = 'BL'
-    elif name in ('台', '台服', 'tw', 'sonet'):
-        state['pool'] = 'TW'
-    elif name in ('日', '日服', 'jp', 'cy', 'cygames'):
-        state['pool'] = 'JP'
-    elif name in ('混', '混合', 'mix'):
-        state['pool'] = 'MIX'
+    if pool := pool_from_name(name):
+        state['pool'] = pool
     elif name:
         await bot.send(event, '切换卡池失败,未识别{}'.format(name))
         raise FinishedException
@@ -134,7 +140,7 @@ switchpool = sv.on_command("切换卡池", aliases={
 @switchpool.got('pool', prompt='请输入要切换的卡池:\n> mix\n> jp\n> tw\n> bl', args_parser=parse_pool)
 async def _(bot: Bot, event: Event, state: T_State):
     if state['pool']:
-        set_pool(state['gid'], state['pool'])
+        await set_pool(state['gid'], state['pool'])
         await switchpool.send('卡池已切换为{}池'.format(state['pool']))
         await lookup_handler(bot, event)
 
@@ -149,11 +155,10 @@ async def _(bot: Bot, event: Event):
     elif isinstance(event, PrivateMessageEvent):
         gid = event.user_id*100
     pool = get_pool(gid)
-    gacha = Gacha(pool)
-    chara, _ = gacha.gacha_one(
-        gacha.up_prob, gacha.s3_prob, gacha.s2_prob)
+    gacha = get_gacha(pool)
+    chara, _ = gacha.gacha_single(user_rng(uid))
     if chara.star == 3:
-        set_collection(uid, chara.id)
+        await set_collection(uid, [chara.id])
     res = f'{chara.icon.CQcode}\n{chara.name} {"★"*chara.star}'
     await gacha1.finish(Message(f'素敵な仲間が増えますよ！\n{res}'), call_header=True)
 
@@ -169,11 +174,9 @@ async def _(bot: Bot, event: Event):
     elif isinstance(event, PrivateMessageEvent):
         gid = event.user_id*100
     pool = get_pool(gid)
-    gacha = Gacha(pool)
-    result, hiishi = gacha.gacha_ten()
-    for c in result:
-        if 3 == c.star:
-            set_collection(uid, c.id)
+    gacha = get_gacha(pool)
+    result, hiishi = gacha.gacha_ten(user_rng(uid))
+    await set_collection(uid, [c.id for c in result if 3 == c.star])
     res1 = Chara.gen_team_pic(result[:5], star_slot_verbose=False)
     res2 = Chara.gen_team_pic(result[5:], star_slot_verbose=False)
     res = concat_pic([res1, res2])
@@ -198,14 +201,13 @@ async def _(bot: Bot, event: Event):
     elif isinstance(event, PrivateMessageEvent):
         gid = event.user_id*100
     pool = get_pool(gid)
-    gacha = Gacha(pool)
-    result, up = gacha.gacha_tenjou()
+    gacha = get_gacha(pool)
+    result, up = gacha.gacha_tenjou(user_rng(uid))
     s3 = len(result['s3'])
     s2 = len(result['s2'])
     s1 = len(result['s1'])
     res = result['s3']
-    for c in res:
-        set_collection(uid, c.id)
+    await set_collection(uid, [c.id for c in res])
     lenth = len(res)
     if lenth == 0:
         res = "竟...竟然没有3★？！"
@@ -249,22 +251,48 @@ async def _(bot: Bot, event: Event):
     await gacha300.finish(Message('\n'.join(msg)), call_header=True)
 
 
+@simulate.handle()
+async def _(bot: Bot, event: Event):
+    '''
+    模拟天井 [次数] [卡池]，默认模拟本群卡池10000次
+    '''
+    if isinstance(event, GroupMessageEvent):
+        gid = event.group_id
+    elif isinstance(event, PrivateMessageEvent):
+        gid = event.user_id*100
+    pool = get_pool(gid)
+    n = SIM_DEFAULT
+    for arg in normalize_str(event.get_plaintext().strip()).split():
+        if arg.isdigit():
+            n = min(max(int(arg), 1), SIM_MAX)
+        elif p := pool_from_name(arg):
+            pool = p
+        else:
+            await simulate.finish(f'模拟天井失败,未识别{arg}')
+    gacha = get_gacha(pool)
+    start = time.perf_counter()
+    res = await run_sync(lambda: summarize(gacha.engine.simulate(n, np.random.default_rng())))()
+    msg = [f'{pool}池模拟{n}次天井完成，用时{time.perf_counter() - start:.2f}s', 'UP角色数分布:']
+    msg.extend(f'{k}个: {v:.2%}' for k, v in res['up_dist'].items())
+    if res['first_up']:
+        msg.append('首次获得UP的抽数: ' +
+                   ' '.join(f'P{p}={v}' for p, v in res['first_up'].items()))
+    msg.append(f'平均3★数: {res["avg_s3"]:.2f}')
+    await simulate.finish('\n'.join(msg))
+
+
 @showcol.handle()
 async def _(bot: Bot, event: Event):
     uid = int(event.get_user_id())
-    col = select_collection(uid)
-    length = len(col)
-    if length <= 0:
-        await showcol.finish('您的仓库为空,请多多抽卡哦~', call_header=True)
-    result = list(map(lambda x: Chara.fromid(x), col))
-    step = 6
-    pics = []
-    for i in range(0, length, step):
-        j = min(length, i + step)
-        pics.append(Chara.gen_team_pic(
-            result[i:j], star_slot_verbose=False))
-    res = concat_pic(pics)
-    res = pic2b64(res)
+    version = collection_version(uid)
+    if cached := get_cached(uid, version):
+        res, length = cached
+    else:
+        col = await select_collection(uid)
+        length = len(col)
+        if length <= 0:
+            await showcol.finish('您的仓库为空,请多多抽卡哦~', call_header=True)
+        res = await render_collection(uid, version, col)
     res = MessageSegment.image(res)
     msg = [
         f'仅展示三星角色~',
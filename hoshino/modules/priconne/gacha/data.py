@@ -6,13 +6,26 @@ LastEditTime: 2021-01-31 02:50:06
 Description: 
 Github: http://github.com/AkiraXie/
 '''
+import asyncio
 import peewee as pw
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, TypeVar
 from hoshino import db_dir
 
-
+T = TypeVar('T')
 db_path = os.path.join(db_dir, 'gacha.db')
-db = pw.SqliteDatabase(db_path)
+# WAL下读写互不阻塞，synchronous=normal只在checkpoint时fsync
+db = pw.SqliteDatabase(db_path, pragmas={
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -4096,
+    'temp_store': 'memory',
+    'busy_timeout': 5000,
+})
+# 所有读写都在这一个线程里进行，不阻塞事件循环，也不会有写锁竞争
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gacha_db')
+_versions: Dict[int, int] = {}
 
 
 class usercollection(pw.Model):
@@ -33,29 +46,67 @@ class grouppool(pw.Model):
         primary_key = pw.CompositeKey('id')
 
 
+async def run_db(func: Callable[..., T], *args) -> T:
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
 def get_pool(gid: int) -> str:
-    ret,_= grouppool.get_or_create(id=gid, defaults={'pool': 'MIX'})
-    return ret.pool
+    '''
+    群卡池只在内存里查，没有设置过的群是`MIX`
+    '''
+    return _pools.get(gid, 'MIX')
 
 
-def set_pool(gid: int, pool: str):
-    grouppool.replace(id=gid, pool=pool).execute()
+async def set_pool(gid: int, pool: str):
+    _pools[gid] = pool
+    await run_db(lambda: grouppool.replace(id=gid, pool=pool).execute())
 
 
-def select_collection(uid: int) -> list:
+def _select_collection(uid: int) -> List[int]:
+    '''
+    按获得顺序返回，新角色总在最后，仓库图只有末尾几行会变
+    '''
     ret = usercollection.select(usercollection.chara).where(
-        usercollection.id == uid)
-    retl = []
-    for r in ret:
-        retl.append(r.chara)
-    return retl
+        usercollection.id == uid).order_by(pw.SQL('rowid'))
+    return [r.chara for r in ret]
+
+
+async def select_collection(uid: int) -> List[int]:
+    return await run_db(_select_collection, uid)
+
+
+def _set_collection(uid: int, charas: List[int]) -> int:
+    '''
+    return: 新增的角色数
+    '''
+    conn = db.connection()
+    with db.atomic():
+        before = conn.total_changes
+        usercollection.insert_many(
+            [(uid, c) for c in charas],
+            fields=[usercollection.id, usercollection.chara]).on_conflict_ignore().execute()
+        return conn.total_changes - before
+
+
+def collection_version(uid: int) -> int:
+    '''
+    用户仓库的版本号，每次有新角色入库时加一，只保存在内存里
+    '''
+    return _versions.get(uid, 0)
 
 
-def set_collection(uid: int, chara: int):
-    usercollection.replace(id=uid, chara=chara).execute()
+async def set_collection(uid: int, charas: Iterable[int]):
+    '''
+    一次抽卡的结果在一个事务里写入
+    '''
+    if charas := list(dict.fromkeys(charas)):
+        if await run_db(_set_collection, uid, charas):
+            _versions[uid] = _versions.get(uid, 0) + 1
 
 
 if not os.path.exists(db_path):
     db.connect()
     db.create_tables([usercollection, grouppool])
     db.close()
+with db.connection_context():
+    _pools: Dict[int, str] = {r.id: r.pool for r in grouppool.select()}
@@ -0,0 +1,145 @@
+import numpy as np
+from typing import Dict, Sequence, Tuple
+from hoshino import hsn_config
+
+UP, S3, S2, S1 = range(4)
+# 每档对应的秘石数，UP角色和普通3星一样算50
+HIISHI = np.array([50, 50, 10, 1])
+TENJOU = 300
+# 模拟时每批的天井数，限制单批内存占用
+SIM_BATCH = 10000
+
+
+def build_alias(weights: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    用Vose算法构建Walker别名表
+
+    return: (`prob`, `alias`)，抽样时均匀取下标`k`，以`prob[k]`的概率取`k`，否则取`alias[k]`
+    '''
+    n = len(weights)
+    total = float(sum(weights))
+    scaled = [w * n / total for w in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] -= 1 - scaled[s]
+        (small if scaled[l] < 1 else large).append(l)
+    # 剩下的只差浮点误差，概率按1处理
+    return np.array(prob), np.array(alias)
+
+
+class AliasTable:
+    def __init__(self, weights: Sequence[float]) -> None:
+        self.n = len(weights)
+        self.prob, self.alias = build_alias(weights)
+
+    def sample(self, rng: np.random.Generator, shape) -> np.ndarray:
+        k = rng.integers(0, self.n, size=shape)
+        return np.where(rng.random(shape) < self.prob[k], k, self.alias[k])
+
+
+class GachaEngine:
+    '''
+    向量化抽卡引擎，每次抽卡都是别名表上的O(1)采样，一批抽卡只做几次NumPy运算
+
+    每一行的第10、20...抽为保底抽，1★概率并入2★，其余与普通抽相同
+
+    *`units`/`units_guarantee`: 以单个角色为粒度的别名表，结果是角色在整个卡池列表中的下标
+    *`tier_of`: 下标到档位的映射
+    *`tiers`/`tiers_guarantee`: 以档位为粒度的别名表，只用于模拟
+    '''
+
+    def __init__(self, up_prob: int, s3_prob: int, s2_prob: int, sizes: Sequence[int]) -> None:
+        probs = (up_prob, s3_prob - up_prob, s2_prob, 1000 - s3_prob - s2_prob)
+        if not all(isinstance(p, int) and p >= 0 for p in probs):
+            raise ValueError(f'非法的卡池概率: {probs}')
+        for p, n in zip(probs, sizes):
+            if p > 0 and n == 0:
+                raise ValueError(f'卡池中概率为{p/10:.1f}%的一档没有角色')
+        guarantee = (probs[0], probs[1], probs[2] + probs[3], 0)
+        self.probs = probs
+        self.tier_of = np.repeat(np.arange(4, dtype=np.int8), sizes)
+        self.units = AliasTable(
+            [p / n for p, n in zip(probs, sizes) for _ in range(n)])
+        self.units_guarantee = AliasTable(
+            [p / n for p, n in zip(guarantee, sizes) for _ in range(n)])
+        self.tiers = AliasTable(probs)
+        self.tiers_guarantee = AliasTable(guarantee)
+
+    def sample_tiers(self, rng: np.random.Generator, rows: int, pulls: int) -> np.ndarray:
+        '''
+        return: 形状为`(rows, pulls)`的档位数组
+        '''
+        tier = self.tiers.sample(rng, (rows, pulls))
+        tier[:, 9::10] = self.tiers_guarantee.sample(rng, (rows, pulls // 10))
+        return tier
+
+    def draw(self, rng: np.random.Generator, rows: int, pulls: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        return: (档位, 角色在整个卡池列表中的下标)，形状均为`(rows, pulls)`
+        '''
+        pos = self.units.sample(rng, (rows, pulls))
+        pos[:, 9::10] = self.units_guarantee.sample(rng, (rows, pulls // 10))
+        return self.tier_of[pos], pos
+
+    def one(self, rng: np.random.Generator) -> Tuple[int, int]:
+        tier, pos = self.draw(rng, 1, 1)
+        return int(tier[0, 0]), int(pos[0, 0])
+
+    def ten(self, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        tier, pos = self.draw(rng, 1, 10)
+        return tier[0], pos[0]
+
+    def tenjou(self, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        tier, pos = self.draw(rng, 1, TENJOU)
+        return tier[0], pos[0]
+
+    def simulate(self, n: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+        '''
+        模拟`n`次天井，只采样档位
+
+        return: 每次天井的UP数`up`、3★数`s3`和首次出UP的抽数`first_up`(没有UP为0)
+        '''
+        up, s3, first = [], [], []
+        for start in range(0, n, SIM_BATCH):
+            tier = self.sample_tiers(rng, min(SIM_BATCH, n - start), TENJOU)
+            is_up = tier == UP
+            up.append(is_up.sum(1))
+            s3.append((tier <= S3).sum(1))
+            first.append(np.where(is_up.any(1), is_up.argmax(1) + 1, 0))
+        return {'up': np.concatenate(up), 's3': np.concatenate(s3), 'first_up': np.concatenate(first)}
+
+
+def summarize(sim: Dict[str, np.ndarray]) -> Dict[str, object]:
+    '''
+    把`simulate`的结果整理成UP数分布和首次出UP位置的分位数
+    '''
+    n = len(sim['up'])
+    first = sim['first_up'][sim['first_up'] > 0]
+    return {
+        'n': n,
+        'up_dist': {i: float(c / n) for i, c in enumerate(np.bincount(sim['up'])) if c},
+        'first_up': {p: int(np.percentile(first, p)) for p in (10, 25, 50, 75, 90)} if len(first) else {},
+        'no_up': 1 - len(first) / n,
+        'avg_s3': float(sim['s3'].mean()),
+    }
+
+
+# 配置了`gacha_seed`时，同一用户重启后的抽卡序列可以复现
+_seed = hsn_config.dict().get('gacha_seed')
+_root = np.random.SeedSequence(None if _seed is None else int(_seed))
+_rngs: Dict[int, np.random.Generator] = {}
+
+
+def user_rng(uid: int) -> np.random.Generator:
+    '''
+    每个用户一个独立的随机数流，由根种子和`uid`派生
+    '''
+    if (rng := _rngs.get(uid)) is None:
+        rng = _rngs[uid] = np.random.default_rng(
+            np.random.SeedSequence(_root.entropy, spawn_key=(uid,)))
+    return rng
@@ -6,20 +6,28 @@ LastEditTime: 2021-02-02 23:34:36
 Description: 
 Github: http://github.com/AkiraXie/
 '''
-import random
-from typing import List, Tuple
+import os
+import numpy as np
+from typing import Dict, List, Optional, Tuple
 from . import Chara, sv
+from .engine import GachaEngine, HIISHI, UP
+
+_rng = np.random.default_rng()
 
 
 class Gacha(object):
+    '''
+    编译好的卡池，同一版本的配置只构建一次，请通过`get_gacha`获取
+    '''
 
-    def __init__(self, pool_name: str = "MIX"):
+    def __init__(self, pool_name: str = "MIX", config: Optional[dict] = None):
         super().__init__()
-        self.load_pool(pool_name)
+        self.load_pool(pool_name, config)
 
-    def load_pool(self, pool_name: str):
-        config = sv.config
+    def load_pool(self, pool_name: str, config: Optional[dict] = None):
+        config = config or sv.config
         pool = config[pool_name]
+        self.name = pool_name
         self.up_prob = pool["up_prob"]
         self.s3_prob = pool["s3_prob"]
         self.s2_prob = pool["s2_prob"]
@@ -28,84 +36,85 @@ class Gacha(object):
         self.star3 = pool["star3"]
         self.star2 = pool["star2"]
         self.star1 = pool["star1"]
+        # 名字只用于展示，抽卡时直接从解析好的角色里选，不再做名字规范化
+        self.up_charas = self.resolve(self.up, 3)
+        self.star3_charas = self.resolve(self.star3, 3)
+        self.star2_charas = self.resolve(self.star2, 2)
+        self.star1_charas = self.resolve(self.star1, 1)
+        # 按档位顺序拼起来，引擎返回的是在这个列表里的下标
+        tiers = (self.up_charas, self.star3_charas,
+                 self.star2_charas, self.star1_charas)
+        self.charas = [c for t in tiers for c in t]
+        self.engine = GachaEngine(self.up_prob, self.s3_prob, self.s2_prob,
+                                  [len(t) for t in tiers])
+        if unknown := [n for n, c in zip(self.up + self.star3 + self.star2 + self.star1, self.charas)
+                       if c.id == Chara.UNKNOWN]:
+            sv.logger.warning(f'{pool_name}卡池中有未识别的角色: {unknown}')
+
+    @staticmethod
+    def resolve(names: List[str], star: int) -> List[Chara]:
+        return [Chara(Chara.name2id(n), star) for n in names]
 
-    def gacha_one(self, up_prob: int, s3_prob: int, s2_prob: int, s1_prob: int = None) -> Tuple[Chara, int]:
+    def gacha_single(self, rng: Optional[np.random.Generator] = None) -> Tuple[Chara, int]:
         '''
-        sx_prob: x星概率，要求和为1000
-        up_prob: UP角色概率（从3星划出）
-        up_chara: UP角色名列表
+        单抽，使用卡池自身的概率和给定的随机数流
 
         return: (单抽结果:Chara, 秘石数:int)
-        ---------------------------
-        |up|      |  20  |   78   |
-        |   ***   |  **  |    *   |
-        ---------------------------
         '''
-        if s1_prob is None:
-            s1_prob = 1000 - s3_prob - s2_prob
-        total_ = s3_prob + s2_prob + s1_prob
-        pick = random.randint(1, total_)
-        if pick <= up_prob:
-            return Chara.fromname(random.choice(self.up), 3), 100
-        elif pick <= s3_prob:
-            return Chara.fromname(random.choice(self.star3), 3), 50
-        elif pick <= s2_prob + s3_prob:
-            return Chara.fromname(random.choice(self.star2), 2), 10
-        else:
-            return Chara.fromname(random.choice(self.star1), 1), 1
-
-    def gacha_ten(self) -> Tuple[List[Chara], int]:
-        result = []
-        hiishi = 0
-        up = self.up_prob
-        s3 = self.s3_prob
-        s2 = self.s2_prob
-        s1 = 1000 - s3 - s2
-        for _ in range(9):    # 前9连
-            c, y = self.gacha_one(up, s3, s2, s1)
-            result.append(c)
-            hiishi += y if y != 100 else 50
-        c, y = self.gacha_one(up, s3, s2 + s1, 0)    # 保底第10抽
-        result.append(c)
-        hiishi += y if y != 100 else 50
-
-        return result, hiishi
-
-    def gacha_tenjou(self) -> Tuple:
+        tier, pos = self.engine.one(rng or _rng)
+        return self.charas[pos], 100 if tier == UP else int(HIISHI[tier])
+
+    def gacha_ten(self, rng: Optional[np.random.Generator] = None) -> Tuple[List[Chara], int]:
+        tier, pos = self.engine.ten(rng or _rng)
+        return [self.charas[p] for p in pos.tolist()], int(HIISHI[tier].sum())
+
+    def gacha_tenjou(self, rng: Optional[np.random.Generator] = None) -> Tuple:
+        tier, pos = self.engine.tenjou(rng or _rng)
         result = {'s3': [], 's2': [], 's1': []}
-        first_up_pos = 999
-        upnum = 0
-        up = self.up_prob
-        s3 = self.s3_prob
-        s2 = self.s2_prob
-        s1 = 1000 - s3 - s2
-        for i in range(30):  # 三十个十连
-            for j in range(1, 10):    # 前9连
-                c, y = self.gacha_one(up, s3, s2, s1)
-                if 100 == y:
-                    result['s3'].append(c)
-                    first_up_pos = min(i*10+j, first_up_pos)
-                    upnum += 1
-                elif 50 == y:
-                    result['s3'].append(c)
-                elif 10 == y:
-                    result['s2'].append(c)
-                elif 1 == y:
-                    result['s1'].append(c)
-                else:
-                    pass    # should never reach here
-            c, y = self.gacha_one(up, s3, s2 + s1, 0)    # 保底第10抽
-            if 100 == y:
-                result['s3'].append(c)
-                first_up_pos = min((i+1)*10, first_up_pos)
-                upnum += 1
-            elif 50 == y:
-                result['s3'].append(c)
-            elif 10 == y:
-                result['s2'].append(c)
-            elif 1 == y:
-                result['s1'].append(c)
-            else:
-                pass  # should never reach here
-        result['first_up_pos'] = first_up_pos
+        keys = ('s3', 's3', 's2', 's1')
+        for t, p in zip(tier.tolist(), pos.tolist()):
+            result[keys[t]].append(self.charas[p])
+        is_up = tier == UP
+        upnum = int(is_up.sum())
+        result['first_up_pos'] = int(is_up.argmax()) + 1 if upnum else 999
         return result, upnum
+
+
+_compiled: Dict[str, Gacha] = {}
+_previous: Dict[str, Gacha] = {}
+_version: Optional[tuple] = None
+
+
+def config_version() -> tuple:
+    '''
+    卡池配置文件和花名册的版本，`更新卡池`会替换配置文件，也会让这个值改变
+    '''
+    try:
+        st = os.stat(sv.config_path)
+        file = (st.st_mtime_ns, st.st_size, st.st_ino)
+    except FileNotFoundError:
+        file = None
+    return file, Chara.roster_version()
+
+
+def get_gacha(pool_name: str) -> Gacha:
+    '''
+    获取编译好的卡池，配置变化后第一次获取时重新编译
+
+    新配置编译失败时，沿用之前最后一次编译成功的卡池，并在这个版本内缓存下来，不再重复编译
+    '''
+    global _version, _compiled, _previous
+    if (version := config_version()) != _version:
+        # 合并而不是替换，上个版本没抽过的卡池也保留更早的编译结果
+        _previous = {**_previous, **_compiled}
+        _compiled = {}
+        _version = version
+    if (gacha := _compiled.get(pool_name)) is None:
+        try:
+            gacha = _compiled[pool_name] = Gacha(pool_name)
+        except Exception as e:
+            if pool_name not in _previous:
+                raise
+            sv.logger.error(f'编译{pool_name}卡池失败，继续使用旧的卡池: {type(e)}, {e}')
+            gacha = _compiled[pool_name] = _previous[pool_name]
+    return gacha
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from PIL import Image
+from hoshino.util import concat_pic, pic2b64, run_sync
+from . import Chara
+
+ROW_SIZE = 6
+# 一行6个128px头像约400KB，按条数限制内存
+ROW_CACHE = 64
+IMAGE_CACHE = 32
+_rows: "OrderedDict[Tuple[int, ...], Image.Image]" = OrderedDict()
+# uid -> (version, base64, 角色数)，只保留每个用户最新版本的图
+_images: "OrderedDict[int, Tuple[int, str, int]]" = OrderedDict()
+
+
+def _lru_get(cache: OrderedDict, key):
+    if (value := cache.get(key)) is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache: OrderedDict, key, value, limit: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+
+def _ready(charas: List[Chara]) -> bool:
+    '''
+    在事件循环里调用，顺便为缺失的头像排队下载
+    '''
+    ready = True
+    for c in charas:
+        c.icon_star()
+        ready = ready and c.has_icon
+    return ready
+
+
+def draw_row(charas: List[Chara]) -> Image.Image:
+    return Chara.gen_team_pic(charas, star_slot_verbose=False)
+
+
+def get_cached(uid: int, version: int) -> Optional[Tuple[str, int]]:
+    '''
+    return: `(base64, 角色数)`，`version`对不上时返回`None`
+    '''
+    if (entry := _lru_get(_images, uid)) is not None and entry[0] == version:
+        return entry[1:]
+    return None
+
+
+async def render_collection(uid: int, version: int, col: List[int]) -> str:
+    '''
+    只重画内容变了的行，结果按`(uid, version)`缓存；头像还没下载好的行不缓存，下次再画
+
+    缓存只在事件循环里读写，线程里只画图
+
+    return: 仓库图的base64
+    '''
+    keys = [tuple(col[i:i + ROW_SIZE]) for i in range(0, len(col), ROW_SIZE)]
+    charas = {key: [Chara.fromid(i) for i in key] for key in keys}
+    ready = {key: _ready(charas[key]) for key in charas}
+    rows = {key: pic for key in charas if (pic := _lru_get(_rows, key)) is not None}
+    todo = [key for key in charas if key not in rows]
+
+    def _draw() -> Tuple[dict, str]:
+        pics = {key: draw_row(charas[key]) for key in todo}
+        return pics, pic2b64(concat_pic([rows.get(key) or pics[key] for key in keys]))
+    pics, res = await run_sync(_draw)()
+    for key, pic in pics.items():
+        if ready[key]:
+            _lru_put(_rows, key, pic, ROW_CACHE)
+    if all(ready.values()):
+        _lru_put(_images, uid, (version, res, len(col)), IMAGE_CACHE)
+    return res
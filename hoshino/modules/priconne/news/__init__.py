@@ -6,9 +6,10 @@ LastEditTime: 2021-03-12 00:42:43
 Description: 
 Github: http://github.com/AkiraXie/
 '''
-from typing import Type
+from typing import List, Type
 from hoshino.matcher import Matcher
-from hoshino import Service, Bot,scheduled_job
+from hoshino import Service, Bot, poll_source, Push
+from hoshino.poller import Source
 from loguru import logger
 from .spider import BaseSpider, BiliSpider, SonetSpider
 
@@ -16,23 +17,27 @@ svtw = Service('pcr-news-tw', enable_on_default=False)
 svbl = Service('pcr-news-bili', enable_on_default=False)
 
 
-async def news_poller(spider: BaseSpider, sv: Service, TAG):
+async def news_poller(spider: BaseSpider, sv: Service, TAG) -> List[Push]:
     if not spider.item_cache:
         await spider.get_update()
         logger.info(f'{TAG}新闻缓存为空，已加载至最新')
-        return
+        return []
     news = await spider.get_update()
     if not news:
         logger.info(f'未检索到{TAG}新闻更新')
-        return
+        return []
     logger.info(f'检索到{len(news)}条{TAG}新闻更新！')
-    await sv.broadcast(spider.format_items(news), TAG, interval_time=0.5)
+    return [Push(sv, spider.format_items(news), tag=TAG)]
 
 
-@scheduled_job('interval', id='推送新闻',minutes=5, jitter=20)
-async def biso_news_poller():
-    await news_poller(SonetSpider, svtw, '台服官网')
-    await news_poller(BiliSpider, svbl, 'B服官网')
+@poll_source('推送台服新闻', host='www.princessconnect.so-net.tw', min_interval=150, max_interval=1200)
+async def sonet_news_poller(src: Source):
+    return await news_poller(SonetSpider, svtw, '台服官网')
+
+
+@poll_source('推送B服新闻', host='api.biligame.com', min_interval=150, max_interval=1200)
+async def bili_news_poller(src: Source):
+    return await news_poller(BiliSpider, svbl, 'B服官网')
 
 
 async def send_news(matcher: Type[Matcher], spider: BaseSpider, max_num=5):
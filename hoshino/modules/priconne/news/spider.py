@@ -6,11 +6,18 @@ LastEditTime: 2021-03-12 00:40:42
 Description: 
 Github: http://github.com/AkiraXie/
 '''
+import os
 import abc
-from bs4 import BeautifulSoup
-from dataclasses import dataclass
+import json
+from dataclasses import asdict, dataclass
 from typing import List, Union
-from hoshino.util import aiohttpx
+from lxml import html
+from loguru import logger
+from hoshino import hsn_config
+from hoshino.util import aiohttpx, run_sync
+
+news_dir = os.path.join(hsn_config.data, 'news/')
+os.makedirs(news_dir, exist_ok=True)
 
 
 @dataclass
@@ -25,11 +32,51 @@ class Item:
 
 
 class BaseSpider(abc.ABC):
+    '''
+    每个子类有自己的`idx_cache`和`item_cache`，并持久化到`data/news/{name}.json`，重启后从上次看到的地方继续
+
+    *`idx_cache`: 见过的新闻`idx`，按时间顺序保留最近`SEEN_LIMIT`条，已经滚出列表又回来的新闻不会重复推送
+    *`item_cache`: 最近一次拉到的新闻列表
+    '''
     url = None
     src_name = None
-    idx_cache = set()
+    name = None
+    SEEN_LIMIT = 200
+    idx_cache = []
     item_cache = []
 
+    def __init_subclass__(cls) -> None:
+        super().__init_subclass__()
+        cls.idx_cache = []
+        cls.item_cache = []
+        if cls.name:
+            cls.load()
+
+    @classmethod
+    def path(cls) -> str:
+        return os.path.join(news_dir, f'{cls.name}.json')
+
+    @classmethod
+    def load(cls):
+        try:
+            with open(cls.path(), encoding='utf8') as f:
+                data = json.load(f)
+            cls.idx_cache = data['idx']
+            cls.item_cache = [Item(**i) for i in data['items']]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'{cls.src_name}新闻缓存损坏，已忽略')
+
+    @classmethod
+    def save(cls):
+        tmp_path = f'{cls.path()}.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({'idx': cls.idx_cache, 'items': [asdict(i) for i in cls.item_cache]},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, cls.path())
+
     @classmethod
     async def get_response(cls) -> aiohttpx.Response:
         resp = await aiohttpx.get(cls.url)
@@ -37,17 +84,26 @@ class BaseSpider(abc.ABC):
 
     @staticmethod
     @abc.abstractmethod
-    async def get_items(resp: aiohttpx.Response) -> List[Item]:
+    def parse(content: bytes) -> List[Item]:
+        '''
+        解析响应内容，在线程里调用
+        '''
         raise NotImplementedError
 
+    @classmethod
+    async def get_items(cls, resp: aiohttpx.Response) -> List[Item]:
+        return await run_sync(cls.parse)(resp.content)
+
     @classmethod
     async def get_update(cls) -> List[Item]:
         resp = await cls.get_response()
         items = await cls.get_items(resp)
-        updates = [i for i in items if i.idx not in cls.idx_cache]
-        if updates:
-            cls.idx_cache = set(i.idx for i in items)
+        seen = set(cls.idx_cache)
+        updates = [i for i in items if i.idx not in seen]
+        if updates or items != cls.item_cache:
+            cls.idx_cache = (cls.idx_cache + [i.idx for i in updates])[-cls.SEEN_LIMIT:]
             cls.item_cache = items
+            await run_sync(cls.save)()
         return updates
 
     @classmethod
@@ -64,27 +120,30 @@ class BaseSpider(abc.ABC):
 class SonetSpider(BaseSpider):
     url = "http://www.princessconnect.so-net.tw/news/"
     src_name = "台服官网"
+    name = 'sonet'
 
     @staticmethod
-    async def get_items(resp: aiohttpx.Response):
-        soup = BeautifulSoup(resp.content, 'lxml')
-        return [
-            Item(idx=dd.a["href"],
-                 content=f"{dd.text}",
-                 link=f"www.princessconnect.so-net.tw{dd.a['href']}",
-                 time=str(dd.previous_sibling.previous_sibling.get_text()).strip()[
-                :10].replace('.', '-')
-            ) for dd in soup.find_all("dd")
-        ]
+    def parse(content: bytes) -> List[Item]:
+        items = []
+        for dd in html.fromstring(content).iterfind('.//dd'):
+            href = dd.xpath('string(.//a/@href)')
+            if not href or (dt := dd.getprevious()) is None:
+                continue
+            items.append(Item(idx=href,
+                              content=dd.text_content(),
+                              link=f"www.princessconnect.so-net.tw{href}",
+                              time=dt.text_content().strip()[:10].replace('.', '-')))
+        return items
 
 
 class BiliSpider(BaseSpider):
     url = "https://api.biligame.com/news/list?gameExtensionId=267&positionId=2&typeId=&pageNum=1&pageSize=5"
     src_name = "B服官网"
+    name = 'bili'
 
     @staticmethod
-    async def get_items(resp: aiohttpx.Response):
-        content = resp.json
+    def parse(content: bytes) -> List[Item]:
+        content = json.loads(content)
         items = [
             Item(idx=n["id"],
                  content=f"{n['title']}",
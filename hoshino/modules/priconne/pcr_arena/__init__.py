@@ -6,19 +6,23 @@ LastEditTime: 2021-02-11 02:38:24
 Description: 
 Github: http://github.com/AkiraXie/
 '''
+import nonebot
 from nonebot.exception import FinishedException
 from loguru import logger
 from nonebot.plugin import require
 from hoshino.typing import T_State
-from hoshino import Event, Bot, Message, MessageSegment
-from hoshino.util import concat_pic, pic2b64, FreqLimiter
+from hoshino import Event, Bot, Message, MessageSegment, scheduled_job
+from hoshino.util import FreqLimiter, sucmd, run_sync
 from hoshino.service import Service
 import re
 Chara = require('chara').Chara
 sv = Service('pcr-arena')
-from .arena import do_query
+from .arena import do_query, similar_query
+from . import store
+from .cache import query_cache
+from .render import render_result
 
-lmt = FreqLimiter(5)
+lmt = FreqLimiter(5, 'arena')
 
 aliases = {'怎么拆', '怎么解', '怎么打', '如何拆', '如何解', '如何打',
            '怎麼拆', '怎麼解', '怎麼打', 'jjc查询', 'jjc查詢', '拆'}
@@ -35,7 +39,10 @@ async def parse_query(bot: Bot, event: Event, state: T_State):
     if not argv:
         return
     argv = re.sub(r'[?？，,_]', '', argv)
-    defen, unknown = Chara.parse_team(argv)
+    defen, unknown, fixed = Chara.parse_team_fuzzy(argv)
+    if fixed:
+        fixed = '\n'.join(f'"{raw}"→{name}' for raw, name in fixed)
+        await bot.send(event, f'已自动纠正:\n{fixed}')
     if unknown:
         await bot.send(event, f'无法识别"{unknown}",请仅输入角色名规范查询')
     if 5 != len(defen) and 0 != len(defen):
@@ -67,13 +74,15 @@ async def query(bot: Bot, event: Event, state: T_State):
     if not state['defen']:
         raise FinishedException
     logger.info('Doing query...')
+    res = None
     try:
         res = await do_query(state['defen'], state['region'])
-
     except Exception as e:
         logger.exception(e)
 
     logger.info('Got response!')
+    if not res and (similar := similar_query(state['defen'], state['region'])):
+        await send_similar(bot, event, similar)
     if res is None:
         await bot.send(event,
                        '查询出错，请再次查询\n如果多次查询失败，请先移步pcrdfans.com进行查询，并可联系维护组', at_sender=True)
@@ -84,12 +93,7 @@ async def query(bot: Bot, event: Event, state: T_State):
         raise FinishedException
     res = res[:min(6, len(res))]
     logger.info('Arena generating picture...')
-    atk_team = [Chara.gen_team_pic(team=entry['atk'], text="\n".join([
-        f" {entry['up']} ",
-        f" {entry['down']} ",
-    ])) for entry in res]
-    atk_team = concat_pic(atk_team)
-    atk_team = pic2b64(atk_team)
+    atk_team = await render_result(res)
     atk_team = MessageSegment.image(atk_team)
     logger.info('Arena picture ready!')
     defen = state['defen']
@@ -104,3 +108,49 @@ async def query(bot: Bot, event: Event, state: T_State):
     logger.debug('Arena sending result...')
     await bot.send(event, Message('\n'.join(msg)), at_sender=1)
     raise FinishedException
+
+
+async def send_similar(bot: Bot, event: Event, similar):
+    '''
+    pcrdfans上查不到时，发送本地作业库里4个角色相同的防守队伍的作业
+    '''
+    msg = ['没有完全一致的作业，以下是本地作业库中4个角色相同的队伍:']
+    rows = []
+    for team, res in similar:
+        msg.append(f"防守方[{' '.join(c.name for c in team)}] {len(res)}条")
+        rows.extend(res)
+    msg.append(str(MessageSegment.image(await render_result(rows))))
+    await bot.send(event, Message('\n'.join(msg)), at_sender=True)
+    raise FinishedException
+
+
+cachestat = sucmd('竞技场缓存', True, {'arenacache'})
+importsol = sucmd('导入作业', True, {'importarena'})
+
+
+@cachestat.handle()
+async def _(bot: Bot):
+    await cachestat.finish(query_cache.report())
+
+
+@importsol.handle()
+async def _(bot: Bot, event: Event):
+    path = event.get_plaintext().strip()
+    if not path:
+        await importsol.finish('请在命令后附上作业JSON文件的路径')
+    try:
+        items = await run_sync(store.load_json)(path)
+        num = await store.save(items)
+    except Exception as e:
+        logger.exception(e)
+        await importsol.finish(f'导入失败: {type(e).__name__}: {e}')
+    await importsol.finish(f'导入完成，共{num}支防守队伍，本地作业库现有{len(store.index)}支')
+
+
+# 缓存在事件循环里被修改，不能整个放到线程里，`save`只把写文件交给线程
+@scheduled_job('interval', minutes=10, id='竞技场缓存快照')
+async def snapshot_cache():
+    await query_cache.save()
+
+
+nonebot.get_driver().on_shutdown(query_cache.snapshot)
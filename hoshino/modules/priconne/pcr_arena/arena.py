@@ -10,6 +10,10 @@ import time
 from hoshino.util import  aiohttpx
 from loguru import logger
 from . import sv,Chara
+from .cache import make_key, query_cache
+from . import store
+# 本地作业超过一天时在后台向pcrdfans刷新
+REFRESH_AGE = 86400
 
 
 def __get_auth_key():
@@ -17,7 +21,10 @@ def __get_auth_key():
     return config["AUTH_KEY"]
 
 
-async def do_query(id_list, region=1):
+async def _search(id_list, region):
+    '''
+    return: 接口的原始结果，角色为`[id, star, equip]`，出错时返回`None`
+    '''
     id_list = [x * 100 + 1 for x in id_list]
     header = {
         'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.87 Safari/537.36',
@@ -38,11 +45,63 @@ async def do_query(id_list, region=1):
         return None
 
     res = res['data']['result']
-    res = [
+    return [
         {
-            'atk': [Chara(c['id'] // 100, c['star'], c['equip']) for c in entry['atk']],
+            'atk': [[c['id'] // 100, c['star'], c['equip']] for c in entry['atk']],
             'up': entry['up'],
             'down': entry['down'],
         } for entry in res
     ]
+
+
+async def _search_and_save(id_list, region):
+    res = await _search(id_list, region)
+    if res:
+        await store.save([(id_list, region, res)])
     return res
+
+
+def _to_chara(res):
+    return [
+        {
+            'atk': [Chara(*c) for c in entry['atk']],
+            'up': entry['up'],
+            'down': entry['down'],
+        } for entry in res
+    ]
+
+
+async def do_query(id_list, region=1):
+    '''
+    先查本地作业库，没有时才请求pcrdfans；本地作业超过`REFRESH_AGE`时返回后在后台刷新
+    '''
+    key = make_key(id_list, region)
+
+    def fetch():
+        return _search_and_save(id_list, region)
+    if (local := store.index.get(id_list, region)) is not None:
+        updated, res = local
+        query_cache.stats['local'] += 1
+        if time.time() - updated > REFRESH_AGE:
+            query_cache.refresh(key, fetch)
+    else:
+        res = await query_cache.get(key, fetch)
+    if res is None:
+        return None
+    return _to_chara(res)
+
+
+def similar_query(id_list, region=1, limit=6, per_team=3):
+    '''
+    在本地作业库里找有4个角色相同的防守队伍
+
+    return: `[(防守队伍, 作业)]`，作业总数不超过`limit`
+    '''
+    ret = []
+    for team, res in store.index.similar(id_list, region):
+        if limit <= 0:
+            break
+        res = sorted(res, key=lambda e: e['down'] - e['up'])[:min(per_team, limit)]
+        limit -= len(res)
+        ret.append(([Chara.fromid(c) for c in team], _to_chara(res)))
+    return ret
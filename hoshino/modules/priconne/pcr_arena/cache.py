@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import asyncio
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from loguru import logger
+from hoshino import hsn_config
+from hoshino.util import run_sync
+
+Key = Tuple[Tuple[int, ...], int]
+arena_dir = os.path.join(hsn_config.data, 'arena/')
+os.makedirs(arena_dir, exist_ok=True)
+
+
+def make_key(defen: List[int], region: int) -> Key:
+    '''
+    防守队伍与顺序无关，排序后和服务器一起作为键
+    '''
+    return tuple(sorted(defen)), region
+
+
+class QueryCache:
+    '''
+    竞技场查询结果缓存，缓存的是接口返回的原始结果，不含`Chara`
+
+    *`ttl`: 新鲜期，期内直接返回
+    *`stale_ttl`: 过了新鲜期但没过`stale_ttl`时先返回旧结果，同时在后台刷新
+    *`empty_ttl`: 查不到解法的结果的新鲜期，作业上传后要尽快能查到
+    同一个键的并发查询只会请求一次接口，其余的等待同一个任务
+    '''
+
+    def __init__(self, path: str, ttl: float, stale_ttl: float, empty_ttl: float, maxsize: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.empty_ttl = empty_ttl
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Key, Tuple[float, list]]" = OrderedDict()
+        self.inflight: Dict[Key, asyncio.Task] = {}
+        self.stats = Counter()
+        self.dirty = False
+
+    def _fresh_ttl(self, res: list) -> float:
+        return self.ttl if res else min(self.empty_ttl, self.ttl)
+
+    def put(self, key: Key, res: list, t: Optional[float] = None):
+        self.entries[key] = (t or time.time(), res)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def peek(self, key: Key) -> Optional[list]:
+        '''
+        只查缓存，不计入统计也不触发刷新，过了`stale_ttl`的不算
+        '''
+        if (entry := self.entries.get(key)) is None or time.time() - entry[0] >= self.stale_ttl:
+            return None
+        return entry[1]
+
+    async def _fetch(self, key: Key, fetch: Callable[[], Awaitable[Optional[list]]]) -> Optional[list]:
+        try:
+            res = await fetch()
+            if res is None:
+                self.stats['error'] += 1
+            else:
+                self.put(key, res)
+            return res
+        finally:
+            self.inflight.pop(key, None)
+
+    def _start(self, key: Key, fetch: Callable[[], Awaitable[Optional[list]]]) -> asyncio.Task:
+        if (task := self.inflight.get(key)) is None:
+            task = self.inflight[key] = asyncio.get_running_loop().create_task(
+                self._fetch(key, fetch))
+        return task
+
+    def refresh(self, key: Key, fetch: Callable[[], Awaitable[Optional[list]]]):
+        '''
+        在后台刷新，不等待结果，只计入`refresh`；任务由`inflight`持有，完成前不会被回收
+        '''
+        if key not in self.inflight:
+            self.stats['refresh'] += 1
+            self._start(key, fetch)
+
+    async def get(self, key: Key, fetch: Callable[[], Awaitable[Optional[list]]]) -> Optional[list]:
+        '''
+        return: 结果列表，接口出错且没有可用的旧结果时返回`None`
+        '''
+        now = time.time()
+        if (entry := self.entries.get(key)) is not None:
+            t, res = entry
+            age = now - t
+            if age < self._fresh_ttl(res):
+                self.entries.move_to_end(key)
+                self.stats['hit'] += 1
+                return res
+            if age < self.stale_ttl:
+                self.entries.move_to_end(key)
+                self.stats['stale'] += 1
+                if key not in self.inflight:
+                    self.stats['refresh'] += 1
+                    self._start(key, fetch)
+                return res
+        if key in self.inflight:
+            self.stats['dedup'] += 1
+        else:
+            self.stats['miss'] += 1
+        # 被取消的只是这一个等待者，接口请求会继续完成并写入缓存
+        res = await asyncio.shield(self._start(key, fetch))
+        if res is None and (entry := self.entries.get(key)) is not None:
+            # 接口出错时宁可返回过期很久的结果
+            return entry[1]
+        return res
+
+    def purge(self):
+        now = time.time()
+        expired = [k for k, (t, _) in self.entries.items()
+                   if now - t >= self.stale_ttl]
+        for k in expired:
+            del self.entries[k]
+        if expired:
+            self.dirty = True
+
+    def capture(self) -> Optional[list]:
+        '''
+        在事件循环里调用，清掉过期条目并复制出可序列化的数据；没有改动时返回`None`
+        '''
+        if not self.dirty:
+            return None
+        self.purge()
+        return [[list(defen), region, t, res]
+                for (defen, region), (t, res) in self.entries.items()]
+
+    def write(self, data: list):
+        '''
+        只写文件，不碰缓存本身，可以放到线程里
+        '''
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def snapshot(self):
+        if (data := self.capture()) is not None:
+            self.write(data)
+            self.dirty = False
+
+    async def save(self):
+        '''
+        写盘期间又有改动时`dirty`会被重新置位；写失败时保持`dirty`，下次快照重试
+        '''
+        if (data := self.capture()) is None:
+            return
+        self.dirty = False
+        try:
+            await run_sync(self.write)(data)
+        except Exception:
+            self.dirty = True
+            raise
+
+    def restore(self):
+        try:
+            with open(self.path, encoding='utf8') as f:
+                data = json.load(f)
+            for defen, region, t, res in data:
+                self.entries[make_key(defen, region)] = (t, res)
+            self.purge()
+            self.dirty = False
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+            logger.error('竞技场查询缓存损坏，已忽略')
+            self.entries.clear()
+
+    def report(self) -> str:
+        st = self.stats
+        served = st['local'] + st['hit'] + st['stale'] + st['dedup']
+        total = served + st['miss']
+        rate = served / total if total else 0.0
+        return '\n'.join([
+            f'缓存{len(self.entries)}条，正在请求{len(self.inflight)}个',
+            f'查询{total}次，命中率{rate:.1%}',
+            f'本地作业库{st["local"]} 新鲜命中{st["hit"]} 过期命中{st["stale"]} 合并请求{st["dedup"]} 未命中{st["miss"]}',
+            f'后台刷新{st["refresh"]} 接口出错{st["error"]}',
+        ])
+
+
+query_cache = QueryCache(os.path.join(arena_dir, 'query_cache.json'),
+                         ttl=3600, stale_ttl=3 * 86400, empty_ttl=600, maxsize=4096)
+query_cache.restore()
@@ -0,0 +1,73 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from PIL import Image
+from hoshino.util import concat_pic, pic2b64
+from . import Chara
+
+# (进攻队伍, 赞, 踩)
+RowKey = Tuple[Tuple[Chara, ...], int, int]
+ROW_CACHE = 256
+IMAGE_CACHE = 64
+# PIL的缩放、粘贴和PNG编码都会释放GIL，几行可以真正并行地画
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='arena_render')
+_rows: "OrderedDict[RowKey, Image.Image]" = OrderedDict()
+_images: "OrderedDict[Tuple[RowKey, ...], str]" = OrderedDict()
+
+
+def _lru_get(cache: OrderedDict, key):
+    if (value := cache.get(key)) is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache: OrderedDict, key, value, limit: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+
+def row_key(entry: dict) -> RowKey:
+    return tuple(entry['atk']), entry['up'], entry['down']
+
+
+def render_row(key: RowKey) -> Image.Image:
+    team, up, down = key
+    return Chara.gen_team_pic(team=team, text=f' {up} \n {down} ')
+
+
+def _ready(key: RowKey) -> bool:
+    '''
+    在事件循环里调用，顺便为缺失的头像排队下载
+    '''
+    ready = True
+    for c in key[0]:
+        c.icon_star()
+        ready = ready and c.has_icon
+    return ready
+
+
+async def render_result(res: List[dict]) -> str:
+    '''
+    缓存只在事件循环里读写，线程里只画图
+
+    return: 结果图的base64
+    '''
+    keys = tuple(row_key(entry) for entry in res)
+    if (img := _lru_get(_images, keys)) is not None:
+        return img
+    loop = asyncio.get_running_loop()
+    ready = {key: _ready(key) for key in keys}
+    rows = {key: pic for key in keys if (pic := _lru_get(_rows, key)) is not None}
+    todo = [key for key in dict.fromkeys(keys) if key not in rows]
+    pics = await asyncio.gather(*[loop.run_in_executor(_executor, render_row, key) for key in todo])
+    for key, pic in zip(todo, pics):
+        rows[key] = pic
+        if ready[key]:
+            _lru_put(_rows, key, pic, ROW_CACHE)
+    img = await loop.run_in_executor(_executor, lambda: pic2b64(concat_pic([rows[key] for key in keys])))
+    if all(ready.values()):
+        _lru_put(_images, keys, img, IMAGE_CACHE)
+    return img
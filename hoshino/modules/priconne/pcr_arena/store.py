@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import peewee as pw
+from typing import Dict, Iterable, List, Optional, Tuple
+from hoshino import db_dir
+from hoshino.util import run_sync
+
+Team = Tuple[int, ...]
+db_path = os.path.join(db_dir, 'arena.db')
+db = pw.SqliteDatabase(db_path, pragmas={
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+})
+
+
+class solution(pw.Model):
+    # 排好序的防守队伍，逗号分隔
+    defen = pw.TextField()
+    region = pw.IntegerField()
+    result = pw.TextField()
+    updated = pw.FloatField()
+
+    class Meta:
+        database = db
+        primary_key = pw.CompositeKey('defen', 'region')
+
+
+def popcount(x: int) -> int:
+    return bin(x).count('1')
+
+
+class SolutionIndex:
+    '''
+    本地作业索引，防守队伍编码成角色的位集
+
+    *`bits`: 角色id到位的映射，按出现顺序分配，保证位集紧凑
+    *`exact`: `(位集, 服务器)`到作业的映射，完全相同的队伍O(1)查到
+    *`postings`: 倒排索引，`(角色id, 服务器)`到含有该角色的防守位集
+    '''
+
+    def __init__(self) -> None:
+        self.bits: Dict[int, int] = {}
+        self.exact: Dict[Tuple[int, int], Tuple[Team, float, list]] = {}
+        self.postings: Dict[Tuple[int, int], set] = {}
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+    def mask(self, team: Iterable[int], add: bool = False) -> int:
+        '''
+        `add`为假时遇到没见过的角色返回0，这样的队伍不可能完全命中
+        '''
+        m = 0
+        for c in team:
+            if (b := self.bits.get(c)) is None:
+                if not add:
+                    return 0
+                b = self.bits[c] = len(self.bits)
+            m |= 1 << b
+        return m
+
+    def add(self, team: Iterable[int], region: int, result: list, updated: float):
+        team = tuple(sorted(team))
+        m = self.mask(team, True)
+        self.exact[(m, region)] = (team, updated, result)
+        for c in team:
+            self.postings.setdefault((c, region), set()).add(m)
+
+    def get(self, team: Iterable[int], region: int) -> Optional[Tuple[float, list]]:
+        '''
+        return: `(更新时间, 作业)`
+        '''
+        if not (m := self.mask(team)) or (entry := self.exact.get((m, region))) is None:
+            return None
+        return entry[1:]
+
+    def similar(self, team: Iterable[int], region: int, min_match: int = 4) -> List[Tuple[Team, list]]:
+        '''
+        查找至少有`min_match`个角色相同的其他防守队伍，相同的越多越靠前
+
+        只缺一个角色时，候选一定出现在任意两个角色的倒排表的并集里，取最短的两个再用位集验证
+        '''
+        team = tuple(team)
+        lists = sorted((self.postings.get((c, region), set()) for c in team), key=len)
+        cands = set().union(*lists[:len(team) - min_match + 1])
+        q = 0
+        for c in team:
+            if (b := self.bits.get(c)) is not None:
+                q |= 1 << b
+        res = []
+        for m in cands:
+            if (n := popcount(m & q)) >= min_match and m != q:
+                entry = self.exact[(m, region)]
+                res.append((n, entry[0], entry[2]))
+        res.sort(key=lambda x: -x[0])
+        return [(t, r) for _, t, r in res]
+
+
+index = SolutionIndex()
+
+
+def _write(rows: List[dict]):
+    with db.connection_context(), db.atomic():
+        for i in range(0, len(rows), 200):
+            solution.replace_many(rows[i:i + 200]).execute()
+
+
+async def save(items: List[Tuple[Iterable[int], int, list]]) -> int:
+    '''
+    在线程里写数据库，回到事件循环再更新内存索引，索引只在事件循环里读写；结果为空的不保存
+
+    return: 保存的条数
+    '''
+    now = time.time()
+    items = [(sorted(team), region, result)
+             for team, region, result in items if result]
+    if not items:
+        return 0
+    rows = [{'defen': ','.join(map(str, team)), 'region': region,
+             'result': json.dumps(result), 'updated': now}
+            for team, region, result in items]
+    await run_sync(_write)(rows)
+    for team, region, result in items:
+        index.add(team, region, result, now)
+    return len(items)
+
+
+def _unit(c) -> List[int]:
+    '''
+    兼容`id`、`[id, star, equip]`和pcrdfans的`{"id": 100101, ...}`
+    '''
+    if isinstance(c, dict):
+        id_ = c['id']
+        return [id_ // 100 if id_ > 10000 else id_, c.get('star', 3), c.get('equip', 0)]
+    if isinstance(c, int):
+        return [c, 3, 0]
+    return [int(c[0]), int(c[1]), int(c[2])]
+
+
+def load_json(path: str) -> List[Tuple[List[int], int, list]]:
+    '''
+    读取作业导出文件，格式为`[{"def": [防守角色], "region": 1, "result": [{"atk": [...], "up": 0, "down": 0}]}]`
+    '''
+    with open(path, encoding='utf8') as f:
+        data = json.load(f)
+    items = []
+    for d in data:
+        team = [_unit(c)[0] for c in d['def']]
+        if len(team) != 5:
+            continue
+        result = [{'atk': [_unit(c) for c in e['atk']],
+                   'up': int(e.get('up', 0)), 'down': int(e.get('down', 0))}
+                  for e in d['result']]
+        items.append((team, int(d.get('region', 1)), result))
+    return items
+
+
+if not os.path.exists(db_path):
+    db.connect()
+    db.create_tables([solution])
+    db.close()
+with db.connection_context():
+    for r in solution.select():
+        index.add(map(int, r.defen.split(',')), r.region,
+                  json.loads(r.result), r.updated)
@@ -6,10 +6,11 @@ LastEditTime: 2021-03-15 04:18:39
 Description: 
 Github: http://github.com/AkiraXie/
 '''
-from .util import check_ver, db_message
-from hoshino import Service,  sucmd, scheduled_job, rule, Bot, Event
+from .util import check_all, db_image
+from hoshino import Service,  sucmd, scheduled_job, rule, Bot, Event, poll_source
+from hoshino.poller import Source
 from hoshino.typing import T_State
-from hoshino.util import text2Seg
+from loguru import logger
 
 
 svjp = Service('calendar-jp', enable_on_default=False)
@@ -17,18 +18,29 @@ svbl = Service('calendar-bili', enable_on_default=False)
 svtw = Service('calendar-tw', enable_on_default=False)
 
 
-@scheduled_job('cron', hour='*/3', jitter=40, id='检查数据库更新')
-async def db_check_ver():
-    await check_ver('jp')
-    await check_ver('bili')
-    await check_ver('tw')
+@poll_source('检查数据库更新', min_interval=3600, max_interval=6 * 3600)
+async def db_check_ver(src: Source):
+    return 0 in await check_all()
+
+
+@scheduled_job('cron', hour='14', minute='12', id='预渲染日程')
+async def _():
+    '''
+    推送前先把图片生成好，推送时直接取缓存
+    '''
+    for serid in ('jp', 'bili', 'tw'):
+        try:
+            await db_image(serid)
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'预渲染{serid}日程失败')
 
 
 @scheduled_job('cron', hour='14', minute='15', jitter=30, id='推送日程')
 async def _():
-    await svjp.broadcast(text2Seg(await db_message('jp')), 'calendar-jp')
-    await svbl.broadcast(text2Seg(await db_message('bili')), 'calendar-bilibili')
-    await svtw.broadcast(text2Seg(await db_message('tw')), 'calendar-tw')
+    await svjp.broadcast(await db_image('jp'), 'calendar-jp')
+    await svbl.broadcast(await db_image('bili'), 'calendar-bilibili')
+    await svtw.broadcast(await db_image('tw'), 'calendar-tw')
 
 
 updatedb = sucmd('updatedb')
@@ -36,12 +48,9 @@ updatedb = sucmd('updatedb')
 
 @updatedb.handle()
 async def _(bot: Bot):
-    codejp = await check_ver('jp')
-    codebl = await check_ver('bili')
-    codetw = await check_ver('tw')
     successcount = 0
     failcount = 0
-    for i in [codebl, codejp, codetw]:
+    for i in await check_all():
         if i == 0:
             successcount += 1
         elif i == -1:
@@ -58,11 +67,11 @@ async def look_calendar(bot: Bot, event: Event, state: T_State):
     is_future = match.group(1) == '预定'
     is_all = not match.group(1)
     if is_now:
-        await bot.send(event, text2Seg(await db_message(state['region'], 'now')), at_sender=True)
+        await bot.send(event, await db_image(state['region'], 'now'), at_sender=True)
     if is_future:
-        await bot.send(event, text2Seg(await db_message(state['region'], 'future')), at_sender=True)
+        await bot.send(event, await db_image(state['region'], 'future'), at_sender=True)
     if is_all:
-        await bot.send(event, text2Seg(await db_message(state['region'], 'all')), at_sender=True)
+        await bot.send(event, await db_image(state['region'], 'all'), at_sender=True)
 
 
 svtw.on_regex(r'^台服(当前|预定)?日程$', state={
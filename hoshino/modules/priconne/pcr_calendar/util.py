@@ -6,13 +6,19 @@ LastEditTime: 2021-02-13 22:00:53
 Description: 
 Github: http://github.com/AkiraXie/
 '''
-from hoshino import aiohttpx, R
+from hoshino import aiohttpx, R, MessageSegment
+from hoshino.util import run_sync, text2Seg
 from loguru import logger
 import json
 import brotli
+import asyncio
 import time
 import os
 import sqlite3
+from bisect import bisect_right
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
 from .data import parse_campaign
 _resource_path = R+'redivedb/'
@@ -21,60 +27,119 @@ os.makedirs(_resource_path, exist_ok=True)
 # bilibili
 bili_url = 'https://redive.estertion.win/db/redive_cn.db.br'
 bili_verurl = 'https://redive.estertion.win/last_version_cn.json'
-bili_db = _resource_path+'redive_bili.db'
+bili_db = _resource_path + 'calendar_bili.db'
 bili_ver = _resource_path+'bili_ver.json'
 bililist = [bili_url, bili_verurl, bili_db, bili_ver, "b服日程"]
 # jp
 jp_url = 'https://redive.estertion.win/db/redive_jp.db.br'
 jp_verurl = 'https://redive.estertion.win/last_version_jp.json'
-jp_db = _resource_path + 'redive_jp.db'
+jp_db = _resource_path + 'calendar_jp.db'
 jp_ver = _resource_path + 'jp_ver.json'
 jplist = [jp_url, jp_verurl, jp_db, jp_ver, "日服日程"]
 # tw(sonet f**k you!)
 # 台服api由tngsohack提供，感谢！
 tw_url = 'https://api.redive.lolikon.icu/br/redive_tw.db.br'
 tw_verurl = 'https://api.redive.lolikon.icu/json/lastver_tw.json'
-tw_db = _resource_path+'redive_tw.db'
+tw_db = _resource_path + 'calendar_tw.db'
 tw_ver = _resource_path + 'tw_ver.json'
 twlist = [tw_url, tw_verurl, tw_db, tw_ver, "台服日程"]
 
 regiondic = {'bili': bililist, 'tw': twlist, 'jp': jplist}
 
 
-async def updateDB(serid: str):
-    ls = regiondic[serid]
-    ver_res = await aiohttpx.get(ls[1])
-    if ver_res.status_code != 200:
-        logger.warning('连接服务器失败')
-        return
-    ver_get = ver_res.content
-    ver = json.loads(ver_get)
-    ver_path = ls[3]
-    db_res = await aiohttpx.get(ls[0])
-    if db_res.status_code != 200:
-        logger.warning('连接服务器失败')
-        return
-    data_get = db_res.content
-    data = brotli.decompress(data_get)
-    db_path = ls[2]
-    with open(db_path, 'wb') as dbfile:
-        dbfile.write(data)
-        dbfile.close()
-    with open(ver_path, 'w', encoding='utf8') as vfile:
+# 只保留日程用到的表，其余的主数据库内容都丢掉
+TABLES = ('campaign_schedule', 'hatsune_schedule', 'event_story_data')
+INDEXES = (
+    'CREATE INDEX idx_campaign_start ON campaign_schedule(start_time)',
+    'CREATE INDEX idx_campaign_end ON campaign_schedule(end_time)',
+    'CREATE INDEX idx_hatsune_event ON hatsune_schedule(event_id)',
+    'CREATE INDEX idx_event_story_value ON event_story_data(value)',
+)
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _extract(serid: str, data: bytes):
+    '''
+    解压完整的主数据库，把日程相关的表抽到一个小库里，再原子地替换本地数据库，在线程里调用
+    '''
+    db_path = regiondic[serid][2]
+    full_path = f'{db_path}.full.tmp'
+    tmp_path = f'{db_path}.tmp'
+    try:
+        with open(full_path, 'wb') as f:
+            f.write(brotli.decompress(data))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with closing(sqlite3.connect(tmp_path)) as db:
+            db.execute('ATTACH DATABASE ? AS src', (full_path,))
+            for table in TABLES:
+                db.execute(f'CREATE TABLE {table} AS SELECT * FROM src.{table}')
+            for sql in INDEXES:
+                db.execute(sql)
+            db.commit()
+            db.execute('DETACH DATABASE src')
+        os.replace(tmp_path, db_path)
+    finally:
+        for path in (full_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+    # 旧版本保存的完整主数据库
+    legacy = os.path.join(os.path.dirname(db_path), f'redive_{serid}.db')
+    if os.path.exists(legacy):
+        os.remove(legacy)
+
+
+def _save_ver(ver_path: str, ver):
+    tmp_path = f'{ver_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as vfile:
         json.dump(ver, vfile, ensure_ascii=False)
-        vfile.close()
+    os.replace(tmp_path, ver_path)
+
+
+async def updateDB(serid: str, ver=None) -> bool:
+    '''
+    同一服务器的更新串行进行，新库替换完成后才写版本文件
+
+    return: 是否更新成功
+    '''
+    ls = regiondic[serid]
+    if serid not in _locks:
+        _locks[serid] = asyncio.Lock()
+    async with _locks[serid]:
+        if ver is None:
+            ver_res = await aiohttpx.get(ls[1])
+            if ver_res.status_code != 200:
+                logger.warning('连接服务器失败')
+                return False
+            ver = json.loads(ver_res.content)
+        db_res = await aiohttpx.get(ls[0])
+        if db_res.status_code != 200:
+            logger.warning('连接服务器失败')
+            return False
+        try:
+            await run_sync(_extract)(serid, db_res.content)
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'{serid}数据库解压或抽取失败')
+            return False
+        _save_ver(ls[3], ver)
     logger.info(f'{serid}数据库更新成功')
+    return True
 
 
 async def check_ver(serid: str):
+    '''
+    return: 0 有更新且已更新，1 无更新，-1 失败
+    '''
     ls = regiondic[serid]
     try:
         with open(ls[3], encoding='utf8') as vfile:
             local_ver = json.load(vfile)
+        if not os.path.exists(ls[2]):
+            raise FileNotFoundError(ls[2])
     except FileNotFoundError:
         logger.warning(f'未发现{serid}数据库,将会稍后创建')
-        await updateDB(serid)
-        return 0
+        return 0 if await updateDB(serid) else -1
     ver_res = await aiohttpx.get(ls[1])
     if ver_res.status_code != 200:
         logger.warning('连接服务器失败')
@@ -86,8 +151,18 @@ async def check_ver(serid: str):
         return 1
     else:
         logger.info(f'发现{serid}数据库更新,将会稍后更新')
-        await updateDB(serid)
-        return 0
+        return 0 if await updateDB(serid, online_ver) else -1
+
+
+async def check_all() -> List[int]:
+    '''
+    三个服务器同时检查和下载
+    '''
+    res = await asyncio.gather(*[check_ver(serid) for serid in regiondic], return_exceptions=True)
+    for serid, r in zip(regiondic, res):
+        if isinstance(r, Exception):
+            logger.opt(exception=r).error(f'检查{serid}数据库更新失败')
+    return [-1 if isinstance(r, Exception) else r for r in res]
 
 
 def campaign_logout(campaign, value):
@@ -98,66 +173,136 @@ def campaign_logout(campaign, value):
     return name, vlue
 
 
-async def db_message(serid: str, tense='all', lastday=14):
-    database_path = regiondic[serid][2]
-    fmsg = regiondic[serid][4]
-    if not os.path.exists(database_path):
-        await updateDB(serid)
-    db = sqlite3.connect(database_path)
+class Schedule:
+    '''
+    一类日程按开始时间排好序，另存一份按结束时间排序的下标
+
+    *`rows`: `(开始时间戳, 结束时间戳, 显示文本)`，按开始时间排序
+    *`starts`/`ends`: 二分查找用的有序时间戳
+    '''
+
+    def __init__(self, rows: List[Tuple[float, float, str]]) -> None:
+        self.rows = sorted(rows, key=lambda r: r[0])
+        self.starts = [r[0] for r in self.rows]
+        self.by_end = sorted(range(len(self.rows)),
+                             key=lambda i: self.rows[i][1])
+        self.ends = [self.rows[i][1] for i in self.by_end]
+
+    def current(self, now: float) -> List[str]:
+        '''
+        进行中的日程，只需检查结束时间晚于现在的那一小段
+        '''
+        j = bisect_right(self.ends, now)
+        idx = sorted(i for i in self.by_end[j:] if self.rows[i][0] < now)
+        return [self.rows[i][2] for i in idx]
+
+    def future(self, now: float, lastday: int) -> List[str]:
+        i = bisect_right(self.starts, now)
+        k = bisect_right(self.starts, now + 86400 *
+                         lastday) if lastday else len(self.rows)
+        return [r[2] for r in self.rows[i:k]]
+
+    def next_change(self, now: float, lastday: int) -> float:
+        '''
+        下一次`current`或`future`结果会变的时间: 有日程开始、结束，或有日程进入`lastday`天的窗口
+        '''
+        cands = []
+        if (i := bisect_right(self.starts, now)) < len(self.starts):
+            cands.append(self.starts[i])
+        if (j := bisect_right(self.ends, now)) < len(self.ends):
+            cands.append(self.ends[j])
+        if lastday and (k := bisect_right(self.starts, now + 86400 * lastday)) < len(self.starts):
+            cands.append(self.starts[k] - 86400 * lastday)
+        return min(cands, default=float('inf'))
+
+
+class CalendarMessage:
+    '''
+    *`expire`: 下一个日程边界，过了这个时间文本就可能变了
+    *`seg`: 文本转的图片，第一次要发图时才在线程里生成
+    '''
+
+    def __init__(self, version: tuple, expire: float, text: str) -> None:
+        self.version = version
+        self.expire = expire
+        self.text = text
+        self.seg: Optional[MessageSegment] = None
+
+
+class CalendarIndex:
+    def __init__(self, version: tuple, campaign: Schedule, event: Schedule) -> None:
+        self.version = version
+        self.campaign = campaign
+        self.event = event
+
+
+_indexes: Dict[str, CalendarIndex] = {}
+_messages: Dict[Tuple[str, str, int], CalendarMessage] = {}
+
+
+def _timestamp(s: str) -> Tuple[float, str]:
+    '''
+    return: (本地时间戳, 显示用的时间字符串)
+    '''
+    t = datetime.strptime(s, '%Y/%m/%d %H:%M:%S')
+    return t.timestamp(), t.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def db_version(serid: str) -> tuple:
+    st = os.stat(regiondic[serid][2])
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def build_index(serid: str, version: tuple) -> CalendarIndex:
+    '''
+    读一遍数据库，解析好时间和活动名，在线程里调用
+    '''
     selectcampaign = '''
     SELECT campaign_category, value, start_time, end_time
-    FROM campaign_schedule
-    ORDER BY start_time'''
+    FROM campaign_schedule'''
     selectevent = '''
     SELECT a.start_time, a.end_time, b.title
     FROM hatsune_schedule AS a JOIN event_story_data AS b ON a.event_id = b.value '''
-    campaign_data = db.execute(selectcampaign)
-    event_data = db.execute(selectevent)
-    cmsg1 = '当前日程\n|区域|倍率|===开始时间===|===结束时间===|'
-    cmsg2 = '预定日程\n|区域|倍率|===开始时间===|===结束时间===|'
-    for cdata in campaign_data:
-        e_time = time.strptime(cdata[3], '%Y/%m/%d %H:%M:%S')
-        e_time_int = int(time.mktime(e_time))
-        s_time = time.strptime(cdata[2], '%Y/%m/%d %H:%M:%S')
-        s_time_int = int(time.mktime(s_time))
-        localtime_int = int(time.time())
-        now_data = campaign_logout(cdata[0], cdata[1])
-        if now_data is None:
+    # 用uri只读打开，数据库不存在时报错而不是建一个空库
+    with closing(sqlite3.connect(f'file:{regiondic[serid][2]}?mode=ro', uri=True)) as db:
+        db.execute('PRAGMA mmap_size=16777216')
+        campaign_data = db.execute(selectcampaign).fetchall()
+        event_data = db.execute(selectevent).fetchall()
+    campaign = []
+    for category, value, start, end in campaign_data:
+        if (c := campaign_logout(category, value)) is None:
             continue
-        name, value = ','.join(now_data).split(',')
-        stime = time.strftime('%Y-%m-%d %H:%M:%S', s_time)
-        etime = time.strftime('%Y-%m-%d %H:%M:%S', e_time)
-        if localtime_int < e_time_int and localtime_int > s_time_int:
-            cmsg1 += f'\n|{name}|{value}|{stime}|{etime}|'
-        if s_time_int > localtime_int:
-            if lastday != 0:
-                if s_time_int > localtime_int+(86400*lastday):
-                    continue
-            cmsg2 += f'\n|{name}|{value}|{stime}|{etime}|'
-
-    emsg1 = '====当前活动====='
-    emsg2 = '====预定活动====='
-    for edata in event_data:
-        e_time = time.strptime(edata[1], '%Y/%m/%d %H:%M:%S')
-        e_time_int = int(time.mktime(e_time))
-        s_time = time.strptime(edata[0], '%Y/%m/%d %H:%M:%S')
-        s_time_int = int(time.mktime(s_time))
-        localtime_int = int(time.time())
-        title = edata[2]
-        stime = time.strftime('%Y-%m-%d %H:%M:%S', s_time)
-        etime = time.strftime('%Y-%m-%d %H:%M:%S', e_time)
-        if localtime_int < e_time_int and localtime_int > s_time_int:
-            emsg1 += ('\n{}\n开始时间:{}\n结束时间:{}').format(
-                title, stime, etime)
-        if s_time_int > localtime_int:
-            if lastday == 0:
-                pass
-            if lastday != 0:
-                if s_time_int > localtime_int+(84600*lastday):
-                    continue
-            emsg2 += ('\n{}\n开始时间:{}\n结束时间:{}').format(
-                title, stime, etime)
+        name, value = c
+        s, stime = _timestamp(start)
+        e, etime = _timestamp(end)
+        campaign.append((s, e, f'|{name}|{value}|{stime}|{etime}|'))
+    event = []
+    for start, end, title in event_data:
+        s, stime = _timestamp(start)
+        e, etime = _timestamp(end)
+        event.append((s, e, f'{title}\n开始时间:{stime}\n结束时间:{etime}'))
+    return CalendarIndex(version, Schedule(campaign), Schedule(event))
 
+
+async def get_index(serid: str) -> CalendarIndex:
+    '''
+    数据库文件变化后才重新构建
+    '''
+    version = db_version(serid)
+    if (idx := _indexes.get(serid)) is None or idx.version != version:
+        idx = _indexes[serid] = await run_sync(build_index)(serid, version)
+        logger.info(f'{serid}日程索引已重建')
+    return idx
+
+
+def _render(serid: str, idx: CalendarIndex, tense: str, lastday: int, now: float) -> str:
+    fmsg = regiondic[serid][4]
+    cmsg1 = '\n'.join(['当前日程\n|区域|倍率|===开始时间===|===结束时间===|'] +
+                      idx.campaign.current(now))
+    cmsg2 = '\n'.join(['预定日程\n|区域|倍率|===开始时间===|===结束时间===|'] +
+                      idx.campaign.future(now, lastday))
+    emsg1 = '\n'.join(['====当前活动====='] + idx.event.current(now))
+    emsg2 = '\n'.join(['====预定活动====='] + idx.event.future(now, lastday))
     if tense == 'all':
         fmsg += '\n'+cmsg1+'\n'+cmsg2+'\n'+emsg1+'\n'+emsg2
     if tense == 'future':
@@ -165,3 +310,35 @@ async def db_message(serid: str, tense='all', lastday=14):
     if tense == 'now':
         fmsg += '\n'+cmsg1+'\n'+emsg1
     return fmsg
+
+
+async def _get_message(serid: str, tense: str, lastday: int) -> CalendarMessage:
+    '''
+    按`(服务器, 时态, 天数)`缓存，数据库版本变了或到了下一个日程边界才重新生成
+    '''
+    database_path = regiondic[serid][2]
+    if not os.path.exists(database_path):
+        await updateDB(serid)
+    idx = await get_index(serid)
+    now = time.time()
+    key = (serid, tense, lastday)
+    if (msg := _messages.get(key)) is None or msg.version != idx.version or now >= msg.expire:
+        expire = min(idx.campaign.next_change(now, lastday),
+                     idx.event.next_change(now, lastday))
+        msg = _messages[key] = CalendarMessage(
+            idx.version, expire, _render(serid, idx, tense, lastday, now))
+    return msg
+
+
+async def db_message(serid: str, tense='all', lastday=14) -> str:
+    return (await _get_message(serid, tense, lastday)).text
+
+
+async def db_image(serid: str, tense='all', lastday=14) -> MessageSegment:
+    '''
+    日程图片，和文本一起缓存，PNG编码在线程里进行
+    '''
+    msg = await _get_message(serid, tense, lastday)
+    if msg.seg is None:
+        msg.seg = await run_sync(text2Seg)(msg.text)
+    return msg.seg
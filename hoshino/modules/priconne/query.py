@@ -7,7 +7,9 @@ Description:
 Github: http://github.com/AkiraXie/
 '''
 import re
+import nonebot
 from hoshino import R, Service, Bot, Event, Message
+from hoshino.res import prepare_variants
 from hoshino.typing import T_State
 p1 = R.img('priconne/quick/tqian.png')
 p2 = R.img('priconne/quick/tzhong.png')
@@ -20,8 +22,7 @@ p8 = R.img('priconne/quick/rzhong.png')
 p9 = R.img('priconne/quick/rhou.png')
 yukari_pic = R.img('priconne/quick/yukari.jpg')
 byk_pic = R.img('priconne/quick/banyuekan.jpg')
-YUKARI = f'''{yukari_pic.CQcode}
-※大圈是1动充电对象 PvP测试
+YUKARI = '''※大圈是1动充电对象 PvP测试
 ※黄骑四号位例外较多
 ※对面羊驼或中后卫坦 有可能歪
 ※我方羊驼算一号位
@@ -58,10 +59,18 @@ async def _(bot: Bot, event: Event, state: T_State):
 
 @yukari
 async def _(bot: Bot):
-    await yukari.finish(Message(YUKARI))
+    await yukari.finish(Message(f'{yukari_pic.CQcode}\n{YUKARI}'))
 
 
 @byk
 async def _(bot: Bot):
     await byk.send('图片较大，请稍等片刻')
     await byk.send(Message(byk_pic.CQcode))
+
+
+@nonebot.get_driver().on_startup
+async def _():
+    '''
+    rank表和攻略图都很大，启动时就在后台转码
+    '''
+    prepare_variants(*[p.path for p in (*brank, *trank, *rrank, yukari_pic, byk_pic)])
@@ -16,8 +16,8 @@ from hoshino.typing import T_State
 from hoshino.util import FreqLimiter
 Chara = require('chara').Chara
 sv = Service('whois')
-_lmt = FreqLimiter(5)
-_lmt1 = FreqLimiter(5)
+_lmt = FreqLimiter(5, 'whois')
+_lmt1 = FreqLimiter(5, 'lookcard')
 STARDIC = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6}
 
 
@@ -31,7 +31,10 @@ async def handle_whois(bot: Bot, event: Event, state: T_State):
     name = match.group(1)
     chara = Chara.fromname(name, star=0)
     if chara.id == Chara.UNKNOWN:
+        # 聊天里随口一句"xx是谁"也会触发，猜到了也只用文字提示，不直接发角色
         msg = [f'兰德索尔似乎没有叫"{name}"的人']
+        if guess := Chara.guess(name, 1, strict=True):
+            msg.append(f'您要找的可能是{guess[0][0].name}？')
         if not await SUPERUSER(bot, event):
             _lmt.start_cd(uid, 300)
             msg.append('您的下次查询将于5分钟后可用')
@@ -51,7 +54,7 @@ whoisr = sv.on_regex(r'^(.*?)是谁$',  only_group=False,
 
 async def handle_lookcard(bot: Bot, event: Event, state: T_State):
     uid = int(event.get_user_id())
-    if not _lmt.check(uid):
+    if not _lmt1.check(uid):
         await bot.send(event, '您查询得太快了，请稍等一会儿', at_sender=True)
         raise FinishedException
     _lmt1.start_cd(uid)
@@ -61,6 +64,9 @@ async def handle_lookcard(bot: Bot, event: Event, state: T_State):
         1) else match.group(3)[0] if match.group(3) else 0
     star = STARDIC.get(star, star)
     chara = Chara.fromname(name, star=int(star))
+    if chara.id == Chara.UNKNOWN and (guess := Chara.guess(name, 1, strict=True)):
+        chara = Chara.fromid(guess[0][0].id, star=int(star))
+        await bot.send(event, f'兰德索尔似乎没有叫"{name}"的人，将为您查询{chara.name}')
     if chara.id == Chara.UNKNOWN:
         msg = [f'兰德索尔似乎没有叫"{name}"的人']
         if not await SUPERUSER(bot, event):
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import random
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+from loguru import logger
+from nonebot.utils import run_sync
+from hoshino import hsn_config, Message, MessageSegment
+from hoshino.service import Service
+
+'''
+统一的轮询框架，取代各插件自己的`interval`定时任务
+
+*轮询源用`poll_source`注册，间隔在`min_interval`和`max_interval`之间自适应: 有变化时缩短，没变化时拉长，出错时也拉长
+*所有轮询共享全局并发上限，同一`host`的轮询另有单独的并发上限
+*每个轮询源有一个`state`字典，轮询后持久化到`data/poller/{name}.json`，间隔也一起保存
+*轮询函数返回`Push`列表，由框架统一推送到开启了服务的群，每个群只用一个bot发送
+'''
+poller_dir = os.path.join(hsn_config.data, 'poller/')
+os.makedirs(poller_dir, exist_ok=True)
+GLOBAL_LIMIT = 8
+HOST_LIMIT = 2
+PUSH_INTERVAL = 0.5
+
+
+class Push:
+    '''
+    *`msgs`: 一条或多条消息，按顺序发送
+    *`groups`: 要推送的群，`None`为所有开启了`sv`的群，否则再和开启了`sv`的群取交集
+    '''
+
+    def __init__(self, sv: Service, msgs: Union[str, Message, MessageSegment, List], groups: Optional[Iterable[int]] = None, tag: str = '') -> None:
+        self.sv = sv
+        self.msgs = msgs if isinstance(msgs, list) else [msgs]
+        self.groups = None if groups is None else set(groups)
+        self.tag = tag
+
+
+# 轮询函数返回`Push`列表或布尔值，非空即视为内容有变化
+PollResult = Union[bool, List[Push], None]
+
+
+class Source:
+    def __init__(self, name: str, func: Callable[["Source"], Awaitable[PollResult]], host: Optional[str],
+                 min_interval: float, max_interval: float, backoff: float, jitter: float) -> None:
+        self.name = name
+        self.func = func
+        self.host = host
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = min_interval
+        self.next_run = 0.0
+        self.last_run = 0.0
+        self.last_cost = 0.0
+        self.running = False
+        self.paused = False
+        self.state: Dict[str, Any] = {}
+        self.stats = Counter()
+        self.load()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(poller_dir, f'{self.name}.json')
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf8') as f:
+                data = json.load(f)
+            self.state = data['state']
+            self.interval = min(max(data['interval'], self.min_interval), self.max_interval)
+            self.next_run = data['next_run']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'轮询源{self.name}的状态损坏，已忽略')
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump({'interval': self.interval, 'next_run': self.next_run,
+                       'state': self.state}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def diff(self, key: str, current: Dict[str, Any]) -> Dict[str, Tuple[Any, Any]]:
+        '''
+        和`state[key]`中上次的值比较并保存这次的值，键必须是字符串
+
+        return: 变化了的键到`(旧值, 新值)`的映射，新出现的键旧值为`None`
+        '''
+        old = self.state.get(key, {})
+        self.state[key] = current
+        return {k: (old.get(k), v) for k, v in current.items() if old.get(k) != v}
+
+    def reschedule(self, changed: Optional[bool]):
+        '''
+        `changed`为`None`表示出错
+        '''
+        if changed:
+            self.interval = max(self.min_interval, self.interval / self.backoff ** 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        self.next_run = time.time() + self.interval * \
+            random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+_sources: Dict[str, Source] = {}
+_hosts: Dict[str, asyncio.Semaphore] = {}
+_global: Optional[asyncio.Semaphore] = None
+_task: Optional[asyncio.Task] = None
+# 正在进行的轮询，事件循环只弱引用任务，这里持有强引用
+_running: Set[asyncio.Task] = set()
+_wakeup: Optional[asyncio.Event] = None
+
+
+def poll_source(name: str, *, host: Optional[str] = None, min_interval: float = 60, max_interval: float = 600,
+                backoff: float = 1.5, jitter: float = 0.1):
+    '''
+    注册一个轮询源，被装饰的函数接受`Source`实例，返回`Push`列表或表示是否有变化的布尔值
+    '''
+    def deco(func: Callable[[Source], Awaitable[PollResult]]):
+        if name in _sources:
+            logger.warning(f'轮询源{name}重复注册')
+        _sources[name] = Source(name, func, host, min_interval,
+                                max_interval, backoff, jitter)
+        return func
+    return deco
+
+
+def get_sources() -> Dict[str, Source]:
+    return dict(_sources)
+
+
+async def fan_out(pushes: List[Push]):
+    '''
+    同一个服务的开启群列表在一次推送中只查一次
+    '''
+    enabled: Dict[str, dict] = {}
+    for push in pushes:
+        sv = push.sv
+        if sv.name not in enabled:
+            enabled[sv.name] = await sv.get_enable_groups()
+        gdict = enabled[sv.name]
+        gids = gdict.keys() if push.groups is None else push.groups & gdict.keys()
+        for gid in gids:
+            bot = gdict[gid][0]
+            sid = int(bot.self_id)
+            for msg in push.msgs:
+                await asyncio.sleep(PUSH_INTERVAL)
+                try:
+                    await bot.send_group_msg(self_id=sid, group_id=gid, message=msg)
+                    sv.logger.info(f'{sid}在群{gid}投递{push.tag}成功')
+                except Exception as e:
+                    sv.logger.error(f'{sid}在群{gid}投递{push.tag}失败: {type(e)}')
+
+
+async def run_source(src: Source):
+    if (host := src.host) and (host := _hosts.get(src.host)) is None:
+        host = _hosts[src.host] = asyncio.Semaphore(HOST_LIMIT)
+    res = None
+    try:
+        async with _global:
+            if host:
+                async with host:
+                    src.last_run = time.time()
+                    res = await src.func(src)
+            else:
+                src.last_run = time.time()
+                res = await src.func(src)
+        changed = bool(res)
+        src.stats['poll'] += 1
+        src.stats['change'] += changed
+    except Exception as e:
+        logger.opt(exception=e).error(f'轮询源{src.name}出错')
+        src.stats['error'] += 1
+        changed = None
+    src.last_cost = time.time() - src.last_run
+    try:
+        if isinstance(res, list) and res:
+            src.stats['push'] += len(res)
+            await fan_out(res)
+    finally:
+        src.reschedule(changed)
+        src.running = False
+        _wakeup.set()
+        try:
+            await run_sync(src.save)()
+        except Exception as e:
+            logger.exception(e)
+
+
+async def _loop():
+    while True:
+        now = time.time()
+        wait = 60.0
+        for src in _sources.values():
+            if src.running or src.paused:
+                continue
+            if src.next_run <= now:
+                src.running = True
+                task = asyncio.get_running_loop().create_task(run_source(src))
+                _running.add(task)
+                task.add_done_callback(_running.discard)
+            else:
+                wait = min(wait, src.next_run - now)
+        # 有轮询结束时提前醒来，重新计算下一次的时间
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), max(wait, 0.5))
+        except asyncio.TimeoutError:
+            pass
+
+
+def start():
+    '''
+    启动时已过期的轮询源在几秒内错开执行，避免同时请求
+    '''
+    global _global, _task, _wakeup
+    if _task:
+        return
+    _global = asyncio.Semaphore(GLOBAL_LIMIT)
+    _wakeup = asyncio.Event()
+    now = time.time()
+    for src in _sources.values():
+        src.next_run = max(src.next_run, now + random.uniform(1, 10))
+    _task = asyncio.get_running_loop().create_task(_loop())
+
+
+def stop():
+    global _task
+    if _task:
+        _task.cancel()
+        _task = None
+    for task in list(_running):
+        task.cancel()
+    for src in _sources.values():
+        src.running = False
+        try:
+            src.save()
+        except Exception as e:
+            logger.exception(e)
@@ -10,11 +10,169 @@ from loguru import logger
 from io import UnsupportedOperation
 from PIL import Image
 import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from nonebot.adapters.cqhttp.message import MessageSegment
 from hoshino import hsn_config
 STATIC = os.path.expanduser(hsn_config.static or 'static')
+VARIANT_DIR = os.path.join(hsn_config.data, 'variant/')
+# 配置的画质下限，只选质量不低于它的变体
+VARIANT_QUALITY = int(hsn_config.dict().get('image_quality', 80))
+VARIANT_MAX_SIDE = int(hsn_config.dict().get('image_max_side', 1600))
+# 小于这个大小的图直接发原图
+VARIANT_MIN_BYTES = 200 * 1024
+VARIANT_SUFFIXES = ('.png', '.jpg', '.jpeg', '.webp')
+# (格式, 质量)
+VARIANT_SPECS = (('webp', 90), ('webp', 80), ('webp', 70),
+                 ('jpeg', 90), ('jpeg', 80), ('jpeg', 70))
 
 os.makedirs(STATIC, exist_ok=1)
+os.makedirs(VARIANT_DIR, exist_ok=1)
+
+
+class VariantSet:
+    '''
+    一张静态图的转码变体，`mtime`变了就整体作废
+
+    *`items`: `(文件大小, 质量, 路径)`，按文件大小升序
+    '''
+
+    def __init__(self, mtime: int, items: List[Tuple[int, int, str]]) -> None:
+        self.mtime = mtime
+        self.items = sorted(items)
+
+    def best(self, quality: int) -> Optional[str]:
+        for size, q, path in self.items:
+            if q >= quality:
+                return path
+        return None
+
+
+_variants: Dict[str, VariantSet] = {}
+_pending = set()
+# 生成失败的图片到当时的`mtime`，文件没变之前不再重试
+_failed: Dict[str, int] = {}
+_variant_lock = threading.Lock()
+_variant_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='variant')
+
+
+def _variant_prefix(path: str) -> str:
+    return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+
+def _variant_path(prefix: str, mtime: int, fmt: str, quality: int) -> str:
+    return os.path.join(VARIANT_DIR, f'{prefix}_{mtime}_{quality}.{fmt}')
+
+
+def _scan_variants(path: str, mtime: int) -> Optional[VariantSet]:
+    '''
+    重启后从磁盘上找回已经生成的变体，一个都没有时返回`None`
+    '''
+    prefix = _variant_prefix(path)
+    items = [(os.path.getsize(p), q, p) for fmt, q in VARIANT_SPECS
+             if os.path.isfile(p := _variant_path(prefix, mtime, fmt, q))]
+    if not items:
+        return None
+    items.append((os.path.getsize(path), 100, path))
+    return VariantSet(mtime, items)
+
+
+def build_variants(path: str) -> VariantSet:
+    '''
+    在后台线程里调用，生成所有变体并删掉旧`mtime`的变体；原图也算一个质量为100的候选
+    '''
+    mtime = os.stat(path).st_mtime_ns
+    prefix = _variant_prefix(path)
+    items = [(os.path.getsize(path), 100, path)]
+    with Image.open(path) as im:
+        im.load()
+        im.thumbnail((VARIANT_MAX_SIDE, VARIANT_MAX_SIDE), Image.LANCZOS)
+        alpha = im.mode in ('RGBA', 'LA', 'P') and im.convert('RGBA').getextrema()[3][0] < 255
+        rgb = im.convert('RGBA' if alpha else 'RGB')
+    for fmt, q in VARIANT_SPECS:
+        # JPEG没有透明通道，有透明像素的图只转WebP
+        if fmt == 'jpeg' and alpha:
+            continue
+        dst = _variant_path(prefix, mtime, fmt, q)
+        tmp = f'{dst}.tmp'
+        rgb.save(tmp, fmt, quality=q, **({'method': 4} if fmt == 'webp' else {'optimize': True}))
+        os.replace(tmp, dst)
+        items.append((os.path.getsize(dst), q, dst))
+    for name in os.listdir(VARIANT_DIR):
+        if name.startswith(f'{prefix}_') and not name.startswith(f'{prefix}_{mtime}_'):
+            try:
+                os.remove(os.path.join(VARIANT_DIR, name))
+            except OSError:
+                pass
+    return VariantSet(mtime, items)
+
+
+def _build_task(path: str, mtime: int):
+    try:
+        vs = build_variants(path)
+        with _variant_lock:
+            _variants[path] = vs
+            _failed.pop(path, None)
+        logger.info(f'生成图片变体 {path}: {os.path.getsize(path)} -> {os.path.getsize(vs.best(VARIANT_QUALITY))} bytes')
+    except Exception as e:
+        with _variant_lock:
+            _failed[path] = mtime
+        logger.exception(e)
+        logger.error(f'生成图片变体失败 {path}，文件修改之前不再重试')
+    finally:
+        with _variant_lock:
+            _pending.discard(path)
+
+
+def _wants_variant(path: str, st: os.stat_result) -> bool:
+    return st.st_size >= VARIANT_MIN_BYTES and path.lower().endswith(VARIANT_SUFFIXES)
+
+
+def best_variant(path: str, quality: int = VARIANT_QUALITY) -> str:
+    '''
+    返回质量不低于`quality`的最小变体，变体还没生成或已经过期时在后台生成，这次先返回原图
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path
+    if not _wants_variant(path, st):
+        return path
+    with _variant_lock:
+        vs = _variants.get(path)
+        if _failed.get(path) == st.st_mtime_ns:
+            return path
+    if vs is None or vs.mtime != st.st_mtime_ns:
+        if (vs := _scan_variants(path, st.st_mtime_ns)) is not None:
+            with _variant_lock:
+                _variants[path] = vs
+        else:
+            prepare_variants(path)
+            return path
+    return vs.best(quality) or path
+
+
+def prepare_variants(*paths: str):
+    '''
+    提前在后台为这些图片生成变体，已经在排队的和生成失败后没有修改过的不会重复生成
+    '''
+    for path in paths:
+        try:
+            if not _wants_variant(path, st := os.stat(path)):
+                continue
+        except OSError:
+            continue
+        if (vs := _scan_variants(path, st.st_mtime_ns)) is not None:
+            with _variant_lock:
+                _variants[path] = vs
+            continue
+        with _variant_lock:
+            if path in _pending or _failed.get(path) == st.st_mtime_ns:
+                continue
+            _pending.add(path)
+        _variant_executor.submit(_build_task, path, st.st_mtime_ns)
 
 
 class rhelper(str):
@@ -103,8 +261,11 @@ class rhelper(str):
 
     @property
     def CQcode(self) -> MessageSegment:
+        '''
+        大图会换成质量不低于`image_quality`配置的最小转码变体
+        '''
         try:
-            return MessageSegment.image('file:///'+os.path.abspath(self.path))
+            return MessageSegment.image('file:///'+os.path.abspath(best_variant(self.path)))
         except Exception as e:
             logger.exception(e)
             return MessageSegment.text('[图片出错]')
@@ -1,35 +1,151 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, deque
 from functools import wraps
 from nonebot_plugin_apscheduler import scheduler
 from loguru import logger
 from apscheduler import job
-from .typing import Callable, Any, Awaitable
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, JobEvent
+from .typing import Callable, Any, Awaitable, Dict, Optional
+from .util.aiohttpx import Histogram
+RECENT = 10
+THREAD_WORKERS = 4
+
+
+class JobHistogram(Histogram):
+    '''
+    定时任务耗时直方图，单位毫秒，分桶比HTTP请求的粗
+    '''
+    BUCKETS = (100, 500, 1000, 5000, 10000, 30000, 60000, 120000, 300000)
+
+
+class JobStats:
+    '''
+    *`overlaps`: 上一次还没结束又开始了一次，只在`max_instances`大于1时出现
+    *`skips`: 因为达到`max_instances`被apscheduler跳过的次数
+    *`misfires`: 超过`misfire_grace_time`没能执行的次数
+    '''
+
+    def __init__(self) -> None:
+        self.hist = JobHistogram()
+        self.recent = deque(maxlen=RECENT)
+        self.running = 0
+        self.errors = 0
+        self.overlaps = 0
+        self.skips = 0
+        self.misfires = 0
+
+    @property
+    def last(self) -> Optional[float]:
+        return self.recent[-1] if self.recent else None
+
+    def observe(self, seconds: float):
+        self.recent.append(seconds)
+        self.hist.observe(seconds * 1000)
+
+
+_stats: Dict[str, JobStats] = defaultdict(JobStats)
+
+
+def get_job_stats(id: str) -> JobStats:
+    return _stats[id]
+
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+
+
+def get_executor(kind: str) -> ThreadPoolExecutor:
+    '''
+    定时任务共用的线程池，第一次用到时才创建
+    '''
+    if (pool := _executors.get(kind)) is None:
+        if kind != 'thread':
+            raise ValueError(f'unknown executor {kind}')
+        pool = _executors[kind] = ThreadPoolExecutor(
+            THREAD_WORKERS, thread_name_prefix='scheduled_job')
+    return pool
+
+
+def shutdown_executors():
+    for pool in _executors.values():
+        pool.shutdown(wait=False)
+    _executors.clear()
+
+
+def offload(func: Callable[[], Any], executor: str = 'loop',
+            then: Optional[Callable[[Any], Awaitable[Any]]] = None) -> Callable[[], Awaitable[Any]]:
+    '''
+    把同步函数包装成协程函数: 在`executor`里执行，结果回到事件循环后交给`then`
+    '''
+    if executor == 'loop':
+        return func
+
+    async def _offload():
+        res = await asyncio.get_running_loop().run_in_executor(get_executor(executor), func)
+        return await then(res) if then else res
+    return _offload
 
 
 def wrapper(func: Callable[[], Any], id: str) -> Callable[[], Awaitable[Any]]:
     @wraps(func)
     async def _wrapper() -> Awaitable[Any]:
+        st = _stats[id]
+        if st.running:
+            st.overlaps += 1
+            logger.opt(colors=True).warning(
+                f'<ly>Scheduled job <c>{id}</c> overlaps with {st.running} running instance(s).</ly>')
+        st.running += 1
+        start = time.perf_counter()
         try:
             logger.opt(colors=True).info(
                 f'<ly>Scheduled job <c>{id}</c> started.</ly>')
             res = await func()
             logger.opt(colors=True).info(
-                f'<ly>Scheduled job <c>{id}</c> completed.</ly>')
+                f'<ly>Scheduled job <c>{id}</c> completed in {time.perf_counter() - start:.2f}s.</ly>')
             return res
         except Exception as e:
+            st.errors += 1
             logger.opt(colors=True, exception=e).error(
                 f'<r><bg #f8bbd0>Scheduled job <c>{id}</c> failed.</bg #f8bbd0></r>')
+        finally:
+            st.running -= 1
+            st.observe(time.perf_counter() - start)
     return _wrapper
 
 
-def scheduled_job(trigger: str, **kwargs):
-    def deco(func: Callable[[], Any]) -> Callable[[], Awaitable[Any]]:
+def _on_event(event: JobEvent):
+    # apscheduler自己会打警告日志，这里只计数
+    st = _stats[event.job_id]
+    if event.code == EVENT_JOB_MAX_INSTANCES:
+        st.skips += 1
+    elif event.code == EVENT_JOB_MISSED:
+        st.misfires += 1
+
+
+scheduler.add_listener(_on_event, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+
+
+def scheduled_job(trigger: str, executor: str = 'loop',
+                  then: Optional[Callable[[Any], Awaitable[Any]]] = None, **kwargs):
+    '''
+    `max_instances`和`coalesce`原样交给apscheduler，超出`max_instances`时跳过本次并警告
+
+    *`executor`: `loop`时被装饰的是协程函数；`thread`时是同步函数，在线程池里执行，装饰后模块里保留原函数
+    *`then`: `thread`时可选的协程函数，在事件循环里接收同步函数的返回值，用来发送消息等
+    *放到池里的函数不能读写事件循环上同时在改的状态；这类任务用`loop`，在循环里复制好数据后只把写盘交给`run_sync`
+    '''
+    def deco(func: Callable[[], Any]) -> Callable[[], Any]:
         id = kwargs.get('id', func.__name__)
         kwargs['id'] = id
-        return scheduler.scheduled_job(trigger, **kwargs)(wrapper(func, id))
+        job = scheduler.scheduled_job(trigger, **kwargs)(
+            wrapper(offload(func, executor, then), id))
+        return job if executor == 'loop' else func
     return deco
 
 
-def add_job(func: Callable[[], Any], trigger: str, **kwargs)->job.Job:
+def add_job(func: Callable[[], Any], trigger: str, executor: str = 'loop',
+            then: Optional[Callable[[Any], Awaitable[Any]]] = None, **kwargs) -> job.Job:
     id = kwargs.get('id', func.__name__)
     kwargs['id'] = id
-    return scheduler.add_job(wrapper(func, id), trigger, **kwargs)
+    return scheduler.add_job(wrapper(offload(func, executor, then), id), trigger, **kwargs)
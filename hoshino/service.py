@@ -105,11 +105,14 @@ class Service:
                 gl[g].append(bot)
         return gl
 
+    @property
+    def config_path(self) -> str:
+        return f'hoshino/service_config/{self.name}.json'
+
     @property
     def config(self) -> dict:
-        filename = f'hoshino/service_config/{self.name}.json'
         try:
-            with open(filename, encoding='utf8') as f:
+            with open(self.config_path, encoding='utf8') as f:
                 return json.load(f)
         except:
             self.logger.error(f'Failed to load config')
@@ -6,18 +6,14 @@ LastEditTime: 2021-03-14 21:35:52
 Description: 
 Github: http://github.com/AkiraXie/
 '''
-import pytz
 import base64
 import zhconv
 import nonebot
 import unicodedata
-import time
 import os
 from typing import List, Optional, Tuple, Type
 from io import BytesIO
-from collections import defaultdict
 from PIL import Image, ImageDraw, ImageFont
-from datetime import datetime, timedelta
 from nonebot.adapters.cqhttp import MessageSegment
 from nonebot.adapters.cqhttp.event import Event, GroupMessageEvent, PrivateMessageEvent
 from nonebot.typing import T_State
@@ -28,49 +24,11 @@ from nonebot.matcher import Matcher
 from nonebot.permission import SUPERUSER
 from nonebot.plugin import CommandGroup, on_command
 from nonebot.rule import Rule, to_me
+from .limiter import FreqLimiter, DailyNumberLimiter
 DEFAULTFONT = ImageFont.truetype(
     R.img('priconne/gadget/SourceHanSerif-Regular.ttc'), size=48)
 
 
-class FreqLimiter:
-    def __init__(self, default_cd_seconds):
-        self.next_time = defaultdict(float)
-        self.default_cd = default_cd_seconds
-
-    def check(self, key) -> bool:
-        return bool(time.time() >= self.next_time[key])
-
-    def start_cd(self, key, cd_time=0):
-        self.next_time[key] = time.time(
-        ) + cd_time if cd_time > 0 else self.default_cd
-
-
-class DailyNumberLimiter:
-    tz = pytz.timezone('Asia/Shanghai')
-
-    def __init__(self, max_num):
-        self.today = -1
-        self.count = defaultdict(int)
-        self.max = max_num
-
-    def check(self, key) -> bool:
-        now = datetime.now(self.tz)
-        day = (now - timedelta(hours=5)).day
-        if day != self.today:
-            self.today = day
-            self.count.clear()
-        return bool(self.count[key] < self.max)
-
-    def get_num(self, key):
-        return self.count[key]
-
-    def increase(self, key, num=1):
-        self.count[key] += num
-
-    def reset(self, key):
-        self.count[key] = 0
-
-
 def get_bot_list() -> List[Bot]:
     return list(nonebot.get_bots().values())
 
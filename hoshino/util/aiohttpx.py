@@ -6,7 +6,13 @@ LastEditTime: 2021-02-15 04:00:41
 Description: 
 Github: http://github.com/AkiraXie/
 '''
-from aiohttp import ClientSession
+import sys
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple
+from aiohttp import ClientSession, TraceConfig, TraceRequestChunkSentParams, TraceRequestEndParams, TraceConnectionCreateEndParams
 from multidict import CIMultiDictProxy
 from yarl import URL
 from loguru import logger
@@ -41,22 +47,208 @@ class Response(BaseResponse):
             logger.exception(e)
 
 
-async def get(url: str, *args, **kwargs) -> Response:
+class Histogram:
+    '''
+    固定分桶的延迟直方图，单位毫秒
+    '''
+    BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0.0
+        self.num = 0
+
+    def observe(self, ms: float):
+        self.counts[bisect_left(self.BUCKETS, ms)] += 1
+        self.total += ms
+        self.num += 1
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.num if self.num else 0.0
+
+    def percentile(self, p: float) -> float:
+        '''
+        返回所在分桶的上界，落在最后一个桶时返回`inf`
+        '''
+        if not self.num:
+            return 0.0
+        rank = p * self.num
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return float(self.BUCKETS[i]) if i < len(self.BUCKETS) else float('inf')
+        return float('inf')
+
+    def merge(self, other: "Histogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.num += other.num
+
+    def to_dict(self) -> dict:
+        return {
+            'buckets': list(self.BUCKETS),
+            'counts': self.counts,
+            'avg': round(self.avg, 2),
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+        }
+
+
+class HttpStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.status = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connect = Histogram()
+        self.ttfb = Histogram()
+        self.latency = Histogram()
+
+    def merge(self, other: "HttpStats"):
+        self.requests += other.requests
+        self.errors += other.errors
+        self.status.update(other.status)
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.connect.merge(other.connect)
+        self.ttfb.merge(other.ttfb)
+        self.latency.merge(other.latency)
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'status': {str(k): v for k, v in self.status.items()},
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'connect_ms': self.connect.to_dict(),
+            'ttfb_ms': self.ttfb.to_dict(),
+            'total_ms': self.latency.to_dict(),
+        }
+
+
+_stats: Dict[Tuple[str, str], HttpStats] = defaultdict(HttpStats)
+_redirect: Optional[str] = None
+
+
+def redirect_to(base: Optional[str]):
+    '''
+    把之后所有请求转发到`base`,`https://host/path?q`会被改写为`{base}/host/path?q`
+
+    传入`None`取消转发，离线测试时配合`standin`使用
+    '''
+    global _redirect
+    _redirect = base.rstrip('/') if base else None
+
+
+def _caller_service() -> str:
+    '''
+    取调用`get`/`post`/`head`的模块名作为服务名，`hoshino.modules.`前缀会被去掉
+    '''
+    frame = sys._getframe(3)
+    name = frame.f_globals.get('__name__', 'unknown')
+    return name[len('hoshino.modules.'):] if name.startswith('hoshino.modules.') else name
+
+
+def get_stats(by: str = 'host') -> Dict[str, HttpStats]:
+    '''
+    按`host`或`service`聚合的网络请求统计
+    '''
+    idx = 0 if by == 'host' else 1
+    ret = defaultdict(HttpStats)
+    for k, v in _stats.items():
+        ret[k[idx]].merge(v)
+    return dict(ret)
+
+
+def dump_stats() -> dict:
+    return {
+        'time': int(time.time()),
+        'host': {k: v.to_dict() for k, v in get_stats('host').items()},
+        'service': {k: v.to_dict() for k, v in get_stats('service').items()},
+    }
+
+
+def reset_stats():
+    _stats.clear()
+
+
+# 各回调的`ctx.trace_request_ctx`就是`_request`里传入的那个`SimpleNamespace`
+async def _on_connection_create_start(session, ctx: SimpleNamespace, params):
+    ctx.trace_request_ctx.connect_start = time.perf_counter()
+
+
+async def _on_connection_create_end(session, ctx: SimpleNamespace, params: TraceConnectionCreateEndParams):
+    rctx = ctx.trace_request_ctx
+    rctx.connect = (time.perf_counter() - rctx.connect_start) * 1000
+
+
+async def _on_request_chunk_sent(session, ctx: SimpleNamespace, params: TraceRequestChunkSentParams):
+    ctx.trace_request_ctx.bytes_out += len(params.chunk)
+
+
+async def _on_request_end(session, ctx: SimpleNamespace, params: TraceRequestEndParams):
+    rctx = ctx.trace_request_ctx
+    rctx.ttfb = (time.perf_counter() - rctx.start) * 1000
+
+
+_trace_config = TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+_trace_config.on_connection_create_start.append(_on_connection_create_start)
+_trace_config.on_connection_create_end.append(_on_connection_create_end)
+_trace_config.on_request_chunk_sent.append(_on_request_chunk_sent)
+_trace_config.on_request_end.append(_on_request_end)
+
+
+def _record(host: str, service: str, status: Optional[int], bytes_in: int, ctx: SimpleNamespace):
+    st = _stats[(host, service)]
+    st.requests += 1
+    if status is None:
+        st.errors += 1
+    else:
+        st.status[status] += 1
+    st.bytes_in += bytes_in
+    st.bytes_out += ctx.bytes_out
+    st.latency.observe((time.perf_counter() - ctx.start) * 1000)
+    if ctx.connect is not None:
+        st.connect.observe(ctx.connect)
+    if ctx.ttfb is not None:
+        st.ttfb.observe(ctx.ttfb)
+
+
+async def _request(method: str, url: str, *args, read: bool = True, **kwargs):
     kwargs.setdefault('verify_ssl', False)
-    async with ClientSession() as session:
-        async with session.get(url, *args, **kwargs) as resp:
-            return Response(resp.url, await resp.read(), resp.status, resp.headers, resp.ok)
+    service = _caller_service()
+    host = URL(url).host or 'unknown'
+    if _redirect:
+        url = f'{_redirect}/{host}{URL(url).raw_path_qs}'
+    ctx = SimpleNamespace(start=time.perf_counter(),
+                          bytes_out=0, connect=None, ttfb=None)
+    kwargs['trace_request_ctx'] = ctx
+    status = None
+    content = b''
+    try:
+        async with ClientSession(trace_configs=[_trace_config]) as session:
+            async with session.request(method, url, *args, **kwargs) as resp:
+                status = resp.status
+                if not read:
+                    return BaseResponse(resp.url, resp.status, resp.headers, resp.ok)
+                content = await resp.read()
+                return Response(resp.url, content, resp.status, resp.headers, resp.ok)
+    finally:
+        _record(host, service, status, len(content), ctx)
+
+
+async def get(url: str, *args, **kwargs) -> Response:
+    return await _request('GET', url, *args, **kwargs)
 
 
 async def post(url: str, *args, **kwargs) -> Response:
-    kwargs.setdefault('verify_ssl', False)
-    async with ClientSession() as session:
-        async with session.post(url, *args, **kwargs) as resp:
-            return Response(resp.url, await resp.read(), resp.status, resp.headers, resp.ok)
+    return await _request('POST', url, *args, **kwargs)
 
 
 async def head(url: str, *args, **kwargs) -> BaseResponse:
-    kwargs.setdefault('verify_ssl', False)
-    async with ClientSession() as session:
-        async with session.head(url, *args, **kwargs) as resp:
-            return BaseResponse(resp.url, resp.status, resp.headers, resp.ok)
+    kwargs.setdefault('allow_redirects', False)
+    return await _request('HEAD', url, *args, read=False, **kwargs)
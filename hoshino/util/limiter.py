@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import heapq
+import pytz
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, List, Optional, Tuple
+from loguru import logger
+from hoshino import hsn_config
+
+limiter_dir = os.path.join(hsn_config.data, 'limiter/')
+os.makedirs(limiter_dir, exist_ok=True)
+_limiters: Dict[str, "BaseLimiter"] = {}
+
+
+def _dump_key(key: Hashable):
+    return list(key) if isinstance(key, tuple) else key
+
+
+def _load_key(key) -> Hashable:
+    return tuple(key) if isinstance(key, list) else key
+
+
+class BaseLimiter(ABC):
+    '''
+    传入`name`的限制器会注册到全局以便统计；`persist`为真时还会定时快照到`data/limiter/{name}.json`，构造时从快照恢复
+    '''
+
+    def __init__(self, name: Optional[str] = None, persist: bool = False) -> None:
+        self.name = name
+        self.persist = bool(name and persist)
+        if name:
+            if name in _limiters:
+                logger.warning(f'限制器{name}重复注册')
+            _limiters[name] = self
+        if self.persist:
+            self.restore()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(limiter_dir, f'{self.name}.json')
+
+    @abstractmethod
+    def purge(self):
+        '''
+        清掉已过期的条目
+        '''
+
+    @abstractmethod
+    def dump(self) -> dict:
+        ...
+
+    @abstractmethod
+    def load(self, data: dict):
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        ...
+
+    def capture(self) -> Optional[dict]:
+        '''
+        在事件循环里调用，清掉过期条目并复制出可序列化的数据；不持久化时返回`None`
+        '''
+        if not self.persist:
+            return None
+        self.purge()
+        return self.dump()
+
+    def write(self, data: dict):
+        '''
+        只写文件，不碰限制器本身，可以放到线程里
+        '''
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def snapshot(self):
+        if (data := self.capture()) is not None:
+            self.write(data)
+
+    def restore(self):
+        try:
+            with open(self.path, encoding='utf8') as f:
+                self.load(json.load(f))
+            self.purge()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'限制器{self.name}的快照损坏，已忽略')
+
+
+class FreqLimiter(BaseLimiter):
+    '''
+    冷却时间限制器，冷却结束的条目由最小堆按到期时间淘汰
+    '''
+
+    def __init__(self, default_cd_seconds, name: Optional[str] = None, persist: bool = False):
+        self.next_time: Dict[Hashable, float] = {}
+        # (到期时间, key)，重复`start_cd`留下的旧条目在出堆时跳过
+        self.heap: List[Tuple[float, Hashable]] = []
+        self.default_cd = default_cd_seconds
+        super().__init__(name, persist)
+
+    def purge(self, now: Optional[float] = None):
+        now = now or time.time()
+        heap, next_time = self.heap, self.next_time
+        removed = 0
+        while heap and heap[0][0] <= now:
+            t, key = heapq.heappop(heap)
+            if next_time.get(key) == t:
+                del next_time[key]
+                removed += 1
+        # dict删除后不会缩容，删得比剩下的多时复制一份紧凑的
+        if removed > len(next_time) + 64:
+            self.next_time = dict(next_time)
+        # 旧条目太多时重建堆
+        if len(heap) > 2 * len(self.next_time) + 64:
+            self.heap = [(t, k) for k, t in self.next_time.items()]
+            heapq.heapify(self.heap)
+
+    def check(self, key) -> bool:
+        now = time.time()
+        self.purge(now)
+        return bool(now >= self.next_time.get(key, 0.0))
+
+    def left_time(self, key) -> float:
+        return max(0.0, self.next_time.get(key, 0.0) - time.time())
+
+    def start_cd(self, key, cd_time=0):
+        t = time.time() + (cd_time if cd_time > 0 else self.default_cd)
+        self.next_time[key] = t
+        heapq.heappush(self.heap, (t, key))
+
+    def dump(self) -> dict:
+        return {'next_time': [[_dump_key(k), t] for k, t in self.next_time.items()]}
+
+    def load(self, data: dict):
+        for k, t in data['next_time']:
+            self.next_time[_load_key(k)] = t
+        self.heap = [(t, k) for k, t in self.next_time.items()]
+        heapq.heapify(self.heap)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'keys': len(self.next_time),
+            'heap': len(self.heap),
+            # 堆里每项是一个二元组，按56字节估算
+            'bytes': sys.getsizeof(self.next_time) + sys.getsizeof(self.heap) + 56 * len(self.heap),
+        }
+
+
+class DailyNumberLimiter(BaseLimiter):
+    '''
+    每日次数限制器，每天5点整体过期
+    '''
+    tz = pytz.timezone('Asia/Shanghai')
+
+    def __init__(self, max_num, name: Optional[str] = None, persist: bool = False):
+        self.today = -1
+        self.count: Dict[Hashable, int] = {}
+        self.max = max_num
+        super().__init__(name, persist)
+
+    def _day(self) -> int:
+        return (datetime.now(self.tz) - timedelta(hours=5)).toordinal()
+
+    def purge(self):
+        day = self._day()
+        if day != self.today:
+            self.today = day
+            self.count.clear()
+
+    def check(self, key) -> bool:
+        self.purge()
+        return bool(self.count.get(key, 0) < self.max)
+
+    def get_num(self, key):
+        self.purge()
+        return self.count.get(key, 0)
+
+    def increase(self, key, num=1):
+        self.purge()
+        self.count[key] = self.count.get(key, 0) + num
+
+    def reset(self, key):
+        self.count.pop(key, None)
+
+    def dump(self) -> dict:
+        return {'today': self.today, 'count': [[_dump_key(k), v] for k, v in self.count.items()]}
+
+    def load(self, data: dict):
+        self.today = data['today']
+        self.count = {_load_key(k): v for k, v in data['count']}
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'keys': len(self.count),
+            'bytes': sys.getsizeof(self.count),
+        }
+
+
+def get_limiters() -> Dict[str, BaseLimiter]:
+    return dict(_limiters)
+
+
+def capture_all() -> List[Tuple[BaseLimiter, dict]]:
+    '''
+    必须在事件循环里调用，`check`和`start_cd`也在事件循环里改这些字典
+    '''
+    items = []
+    for name, lmt in _limiters.items():
+        try:
+            if (data := lmt.capture()) is not None:
+                items.append((lmt, data))
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'复制限制器{name}的数据失败')
+    return items
+
+
+def write_all(items: List[Tuple[BaseLimiter, dict]]):
+    '''
+    只写`capture_all`复制出来的数据，可以放到线程里
+    '''
+    for lmt, data in items:
+        try:
+            lmt.write(data)
+        except Exception as e:
+            logger.exception(e)
+            logger.error(f'保存限制器{lmt.name}的快照失败')
+
+
+def snapshot_all():
+    write_all(capture_all())
@@ -0,0 +1,8 @@
+'''
+网络依赖模块的离线替身，用于在没有外网的机器上调试、压测
+
+`server.StandIn`按`fixtures`里注册的替身响应请求，并支持延迟与故障注入；
+`harness.offline`启动替身并把`hoshino.util.aiohttpx`的请求全部转发过去。
+'''
+from .server import StandIn, Injection
+from .fixtures import fixture, FIXTURES
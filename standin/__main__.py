@@ -0,0 +1,78 @@
+import asyncio
+import argparse
+import json
+from .server import StandIn, Injection
+from .targets import TARGETS
+
+'''
+离线替身服务器和压测入口，在项目根目录运行
+
+python -m standin serve --port 8900 --latency 0.2 --fail-rate 0.1
+
+python -m standin bench arena news rss -n 200 -c 20 --latency 0.05
+'''
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='standin')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    for name in ('serve', 'bench'):
+        p = sub.add_parser(name)
+        p.add_argument('--latency', type=float, default=0.0)
+        p.add_argument('--jitter', type=float, default=0.0)
+        p.add_argument('--fail-rate', type=float, default=0.0)
+        p.add_argument('--reset-rate', type=float, default=0.0)
+        p.add_argument('--timeout-rate', type=float, default=0.0)
+        p.add_argument('--seed', type=int, default=None)
+    serve = sub.choices['serve']
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8900)
+    bench = sub.choices['bench']
+    bench.add_argument('targets', nargs='*', default=list(TARGETS))
+    bench.add_argument('-n', '--total', type=int, default=100)
+    bench.add_argument('-c', '--concurrency', type=int, default=10)
+    return parser
+
+
+def build_injection(args) -> Injection:
+    return Injection(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate,
+                     reset_rate=args.reset_rate, timeout_rate=args.timeout_rate)
+
+
+async def serve(args):
+    standin = StandIn(build_injection(args), args.seed)
+    base = await standin.start(args.host, args.port)
+    print(f'standin listening on {base}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await standin.stop()
+
+
+async def bench(args):
+    from .harness import offline, load
+    from hoshino.util.aiohttpx import get_stats, reset_stats
+    funcs = {name: TARGETS[name]() for name in args.targets}
+    async with offline(build_injection(args), args.seed):
+        for name, func in funcs.items():
+            reset_stats()
+            res = await load(func, args.total, args.concurrency)
+            res['http'] = {k: v.requests for k, v in get_stats('host').items()}
+            print(name, json.dumps(res, ensure_ascii=False))
+
+
+def main():
+    args = build_parser().parse_args()
+    if args.cmd == 'serve':
+        asyncio.run(serve(args))
+    else:
+        import nonebot
+        from nonebot.adapters.cqhttp import Bot
+        nonebot.init()
+        nonebot.get_driver().register_adapter('cqhttp', Bot)
+        nonebot.load_plugins('hoshino/base/')
+        asyncio.run(bench(args))
+
+
+if __name__ == '__main__':
+    main()
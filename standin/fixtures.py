@@ -0,0 +1,249 @@
+import re
+import json
+import time
+import sqlite3
+import brotli
+import os
+import tempfile
+import zlib
+from io import BytesIO
+from functools import lru_cache
+from email.utils import formatdate
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+from PIL import Image
+from aiohttp import web
+
+'''
+各外部接口的离线替身，响应内容按真实接口录制的结构精简而来。
+
+每个替身用`fixture(host, path)`注册，`path`是一个正则，会对`/`之后的路径做全匹配。
+'''
+Handler = Callable[[web.Request], web.StreamResponse]
+FIXTURES: Dict[str, List[Tuple[Pattern, Tuple[str, ...], Handler]]] = {}
+
+
+def fixture(host: str, path: str, methods: Tuple[str, ...] = ('GET', 'HEAD')):
+    def deco(func: Handler) -> Handler:
+        FIXTURES.setdefault(host, []).append(
+            (re.compile(path), methods, func))
+        return func
+    return deco
+
+
+def find_fixture(host: str, path: str, method: str) -> Optional[Handler]:
+    for pat, methods, func in FIXTURES.get(host, []):
+        if method in methods and pat.fullmatch(path):
+            return func
+    return None
+
+
+def _fmt(ts: float, fmt: str = '%Y/%m/%d %H:%M:%S') -> str:
+    return time.strftime(fmt, time.localtime(ts))
+
+
+@lru_cache(maxsize=8)
+def _png(size: int, color: Tuple[int, int, int] = (255, 182, 193)) -> bytes:
+    buf = BytesIO()
+    Image.new('RGB', (size, size), color).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+# pcrdfans 竞技场查询
+@fixture('api.pcrdfans.com', r'x/v1/search', ('POST',))
+async def pcrdfans_search(request: web.Request):
+    payload = await request.json()
+    defen = payload.get('def', [])
+    pool = [100101, 100201, 100301, 100501, 100701, 101001, 101101, 101801, 102101, 105201]
+    pool = [c for c in pool if c not in defen]
+    result = []
+    for i in range(6):
+        atk = [{'id': pool[(i + j) % len(pool)], 'star': 5, 'equip': 1}
+               for j in range(5)]
+        result.append({'atk': atk, 'up': 120 - i * 7, 'down': i * 3})
+    return web.json_response({'code': 0, 'message': '', 'data': {'result': result}})
+
+
+# 台服官网新闻
+@fixture('www.princessconnect.so-net.tw', r'news/?')
+async def sonet_news(request: web.Request):
+    now = time.time()
+    rows = []
+    for i in range(10):
+        rows.append(f'<dt>{_fmt(now - i * 86400, "%Y.%m.%d")}</dt>\n'
+                    f'<dd><a href="/news/newsDetail/{1200 - i}">公告{1200 - i}：維護通知</a></dd>')
+    html = '<html><body><dl class="news_con">\n' + \
+        '\n'.join(rows) + '\n</dl></body></html>'
+    return web.Response(text=html, content_type='text/html')
+
+
+# B服官网新闻
+@fixture('api.biligame.com', r'news/list')
+async def bili_news(request: web.Request):
+    now = time.time()
+    data = [{'id': 9000 - i, 'title': f'公主连结新闻{9000 - i}', 'ctime': _fmt(now - i * 86400, '%Y-%m-%d %H:%M:%S')}
+            for i in range(int(request.query.get('pageSize', 5)))]
+    return web.json_response({'code': 0, 'data': data})
+
+
+# rsshub
+@fixture('rsshub.akiraxie.cc', r'.+')
+async def rsshub(request: web.Request):
+    limit = int(request.query.get('limit', 8))
+    now = time.time()
+    items = []
+    for i in range(limit):
+        ts = now - i * 600
+        items.append(f'''<item>
+<title>{request.path} 第{i}条</title>
+<link>https://example.com/{i}</link>
+<description><![CDATA[<p>正文{i}</p><img src="https://standin.local/img/{i}.png">]]></description>
+<pubDate>{formatdate(ts)}</pubDate>
+</item>''')
+    xml = f'''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel>
+<title>standin {request.path}</title>
+<link>https://example.com{request.path}</link>
+<description>standin feed</description>
+{"".join(items)}
+</channel></rss>'''
+    return web.Response(text=xml, content_type='application/rss+xml')
+
+
+@fixture('standin.local', r'img/.+')
+async def standin_img(request: web.Request):
+    return web.Response(body=_png(480), content_type='image/png')
+
+
+# steam
+@fixture('api.steampowered.com', r'ISteamUser/GetPlayerSummaries/v2/?')
+async def steam_summaries(request: web.Request):
+    ids = [i for i in request.query.get('steamids', '').split(',') if i]
+    minute = int(time.time() // 60)
+    players = []
+    for n, sid in enumerate(ids):
+        p = {'steamid': sid, 'personaname': f'player{sid[-4:]}'}
+        if (minute + n) % 3:
+            p['gameextrainfo'] = 'Princess Connect! Re:Dive'
+        players.append(p)
+    return web.json_response({'response': {'players': players}})
+
+
+@fixture('steamcommunity.com', r'id/[^/]+')
+async def steam_profile(request: web.Request):
+    name = request.path.rstrip('/').rsplit('/', 1)[-1]
+    sid = '76561198' + str(zlib.crc32(name.encode()) % 10 ** 9).zfill(9)
+    xml = f'<?xml version="1.0" encoding="UTF-8"?><profile><steamID64>{sid}</steamID64><steamID>{name}</steamID></profile>'
+    return web.Response(text=xml, content_type='text/xml')
+
+
+# bilibili
+@fixture('b23.tv', r'[A-Za-z0-9]{6}')
+async def b23(request: web.Request):
+    raise web.HTTPFound('https://www.bilibili.com/video/BV1GJ411x7h7')
+
+
+@fixture('api.bilibili.com', r'x/web-interface/view')
+async def bili_view(request: web.Request):
+    bvid = request.query.get('bvid', 'BV1GJ411x7h7')
+    return web.json_response({'code': 0, 'data': {
+        'bvid': bvid, 'aid': 80433022, 'title': f'{bvid} 标题',
+        'desc': '简介', 'pic': 'https://standin.local/img/cover.png',
+        'owner': {'mid': 2, 'name': 'UP主'}}})
+
+
+# nbnhhsh
+@fixture('lab.magiconch.com', r'api/nbnhhsh/guess', ('POST',))
+async def nbnhhsh(request: web.Request):
+    text = (await request.json()).get('text', '')
+    return web.json_response([{'name': text, 'trans': [f'{text}的翻译一', f'{text}的翻译二']}])
+
+
+# 日程数据库
+def _build_calendar_db() -> bytes:
+    '''
+    生成一个只含日程用到的三张表的数据库，开始/结束时间分布在当前时间前后
+    '''
+    now = time.time()
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        db = sqlite3.connect(path)
+        db.execute(
+            'CREATE TABLE campaign_schedule (id INTEGER, campaign_category INTEGER, value REAL, start_time TEXT, end_time TEXT)')
+        db.execute(
+            'CREATE TABLE hatsune_schedule (event_id INTEGER, start_time TEXT, end_time TEXT)')
+        db.execute(
+            'CREATE TABLE event_story_data (value INTEGER, title TEXT)')
+        cats = [31, 32, 41, 44, 91, 36, 37, 131, 132, 34]
+        for i in range(120):
+            start = now + (i - 60) * 86400 * 0.5
+            db.execute('INSERT INTO campaign_schedule VALUES (?,?,?,?,?)',
+                       (i, cats[i % len(cats)], 2000, _fmt(start), _fmt(start + 3 * 86400)))
+        for i in range(20):
+            start = now + (i - 10) * 86400 * 3
+            db.execute('INSERT INTO hatsune_schedule VALUES (?,?,?)',
+                       (10000 + i, _fmt(start), _fmt(start + 10 * 86400)))
+            db.execute('INSERT INTO event_story_data VALUES (?,?)',
+                       (10000 + i, f'活动{i}'))
+        db.commit()
+        db.close()
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+@lru_cache(maxsize=1)
+def _calendar_db_br(hour: int) -> bytes:
+    return brotli.compress(_build_calendar_db())
+
+
+def _calendar_ver() -> dict:
+    hour = int(time.time() // 3600)
+    return {'TruthVersion': str(10000000 + hour), 'hash': f'{hour:x}'}
+
+
+@fixture('redive.estertion.win', r'last_version_(jp|cn)\.json')
+@fixture('api.redive.lolikon.icu', r'json/lastver_tw\.json')
+async def calendar_ver(request: web.Request):
+    return web.json_response(_calendar_ver())
+
+
+@fixture('redive.estertion.win', r'db/redive_(jp|cn)\.db\.br')
+@fixture('api.redive.lolikon.icu', r'br/redive_tw\.db\.br')
+async def calendar_db(request: web.Request):
+    return web.Response(body=_calendar_db_br(int(time.time() // 3600)), content_type='application/octet-stream')
+
+
+# 头像和卡面
+@fixture('redive.estertion.win', r'(icon/unit|card/full|card/profile)/\d+\.webp')
+async def estertion_asset(request: web.Request):
+    name = request.path.rsplit('/', 1)[-1]
+    body = _png(128 if '/icon/' in request.path else 512)
+    headers = {'ETag': f'"{name}-1"'}
+    if request.method == 'HEAD':
+        return web.Response(headers=headers, content_type='image/webp')
+    return web.Response(body=body, headers=headers, content_type='image/webp')
+
+
+# QQ头像
+@fixture('q1.qlogo.cn', r'g')
+async def qlogo(request: web.Request):
+    return web.Response(body=_png(640, (135, 206, 235)), content_type='image/png')
+
+
+# 卡池配置与花名册
+@fixture('api.akiraxie.cc', r'pcr/config\.json')
+async def pcr_config(request: web.Request):
+    path = os.path.join(os.path.dirname(os.path.dirname(
+        __file__)), 'hoshino/service_config_sample/gacha.json')
+    with open(path, encoding='utf8') as f:
+        return web.json_response(json.load(f))
+
+
+@fixture('api.akiraxie.cc', r'pcr/_pcr_data\.py')
+async def pcr_data(request: web.Request):
+    path = os.path.join(os.path.dirname(os.path.dirname(
+        __file__)), 'hoshino/modules/priconne/_pcr_data_sample.py')
+    with open(path, 'rb') as f:
+        return web.Response(body=f.read(), content_type='text/x-python')
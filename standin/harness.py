@@ -0,0 +1,60 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+from .server import StandIn, Injection
+
+
+@asynccontextmanager
+async def offline(injection: Optional[Injection] = None, seed: Optional[int] = None):
+    '''
+    启动替身服务器并让`aiohttpx`的所有请求都转发过去，退出时恢复
+
+    需要在`nonebot.init()`之后使用，因为导入`hoshino`本身依赖`nonebot`的配置
+
+    e.g:
+
+    async with offline(Injection(latency=0.2, fail_rate=0.1)) as standin:
+        await do_query([1001, 1002, 1003, 1004, 1005])
+    '''
+    from hoshino.util import aiohttpx
+    standin = StandIn(injection, seed)
+    base = await standin.start()
+    aiohttpx.redirect_to(base)
+    try:
+        yield standin
+    finally:
+        aiohttpx.redirect_to(None)
+        await standin.stop()
+
+
+async def load(func: Callable[[], Awaitable], total: int = 100, concurrency: int = 10) -> Dict[str, float]:
+    '''
+    以`concurrency`的并发调用`func`共`total`次，统计耗时(毫秒)和失败数
+    '''
+    sem = asyncio.Semaphore(concurrency)
+    costs: List[float] = []
+    errors = 0
+
+    async def _one():
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                await func()
+            except Exception:
+                errors += 1
+            costs.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    await asyncio.gather(*[_one() for _ in range(total)])
+    wall = time.perf_counter() - start
+    costs.sort()
+    return {
+        'total': total,
+        'errors': errors,
+        'wall_s': round(wall, 3),
+        'qps': round(total / wall, 1) if wall else 0.0,
+        'p50_ms': round(costs[len(costs) // 2], 2),
+        'p95_ms': round(costs[min(len(costs) - 1, int(len(costs) * 0.95))], 2),
+        'max_ms': round(costs[-1], 2),
+    }
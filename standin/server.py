@@ -0,0 +1,84 @@
+import asyncio
+import random
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from aiohttp import web
+from .fixtures import find_fixture
+
+
+@dataclass
+class Injection:
+    '''
+    延迟与故障注入配置，可以用`hosts`对单个域名单独配置
+
+    *`latency`: 固定延迟，秒
+    *`jitter`: 在固定延迟上叠加的`[0, jitter)`随机延迟，秒
+    *`fail_rate`: 返回`fail_status`的概率
+    *`reset_rate`: 直接断开连接的概率
+    *`timeout_rate`: 挂起`hang`秒后才响应的概率，用来触发调用方超时
+    '''
+    latency: float = 0.0
+    jitter: float = 0.0
+    fail_rate: float = 0.0
+    fail_status: int = 503
+    reset_rate: float = 0.0
+    timeout_rate: float = 0.0
+    hang: float = 30.0
+    hosts: Dict[str, "Injection"] = field(default_factory=dict)
+
+    def for_host(self, host: str) -> "Injection":
+        return self.hosts.get(host, self)
+
+
+class StandIn:
+    '''
+    把`/{host}/{path}`分发给`fixtures`里注册的替身
+
+    `aiohttpx.redirect_to(standin.base_url)`之后，所有外部请求都会落到这里
+    '''
+
+    def __init__(self, injection: Optional[Injection] = None, seed: Optional[int] = None) -> None:
+        self.injection = injection or Injection()
+        self.random = random.Random(seed)
+        self.hits = Counter()
+        self.app = web.Application()
+        self.app.router.add_route('*', '/{host}/{path:.*}', self.dispatch)
+        self.runner: Optional[web.AppRunner] = None
+        self.base_url: Optional[str] = None
+
+    async def dispatch(self, request: web.Request) -> web.StreamResponse:
+        host = request.match_info['host']
+        path = request.match_info['path']
+        self.hits[host] += 1
+        inj = self.injection.for_host(host)
+        delay = inj.latency + (self.random.random() * inj.jitter if inj.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        roll = self.random.random()
+        if roll < inj.reset_rate:
+            request.transport.close()
+            return web.Response(status=499)
+        roll -= inj.reset_rate
+        if roll < inj.timeout_rate:
+            await asyncio.sleep(inj.hang)
+        elif roll - inj.timeout_rate < inj.fail_rate:
+            return web.Response(status=inj.fail_status, text='injected failure')
+        handler = find_fixture(host, path, request.method)
+        if handler is None:
+            return web.Response(status=404, text=f'no fixture for {request.method} {host}/{path}')
+        return await handler(request)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,137 @@
+import os
+import random
+import tempfile
+from typing import Awaitable, Callable, Dict
+
+'''
+压测目标，每个目标是一个返回无参协程函数的工厂
+
+工厂在`nonebot.init()`之后才会被调用，所以可以在里面加载插件
+'''
+Target = Callable[[], Callable[[], Awaitable]]
+TARGETS: Dict[str, Target] = {}
+
+
+def target(name: str):
+    def deco(func: Target) -> Target:
+        TARGETS[name] = func
+        return func
+    return deco
+
+
+def _plugin(module_path: str):
+    '''
+    按`run.py`的方式加载`module_path`所在的整个模块目录，插件之间用短名互相`require`
+    '''
+    import nonebot
+    name = module_path.rsplit('.', 1)[-1]
+    if not nonebot.get_plugin(name):
+        nonebot.load_plugins(os.path.dirname(module_path.replace('.', '/')))
+    return nonebot.get_plugin(name).module
+
+
+@target('arena')
+def _arena():
+    arena = _plugin('hoshino.modules.priconne.pcr_arena').arena
+    return lambda: arena.do_query([1001, 1002, 1003, 1004, 1005], 2)
+
+
+@target('news')
+def _news():
+    spider = _plugin('hoshino.modules.priconne.news').spider
+
+    async def run():
+        await spider.SonetSpider.get_update()
+        await spider.BiliSpider.get_update()
+    return run
+
+
+@target('news_parse')
+def _news_parse():
+    spider = _plugin('hoshino.modules.priconne.news').spider
+    rows = ''.join(f'<dt>2021.03.{i % 28 + 1:02d}</dt>\n<dd><a href="/news/newsDetail/{1200 - i}">公告{1200 - i}：維護通知</a></dd>\n'
+                   for i in range(50))
+    page = f'<html><head><meta charset="utf-8"></head><body><dl class="news_con">\n{rows}</dl></body></html>'.encode()
+
+    async def run():
+        spider.SonetSpider.parse(page)
+    return run
+
+
+@target('rss')
+def _rss():
+    data = _plugin('hoshino.modules.information.rsspush').data
+
+    async def run():
+        rss = await data.Rss.new(data.BASE_URL + 'bilibili/user/dynamic/2')
+        await rss.get_interval_entry_info('2021-01-01 00:00:00+0800')
+    return run
+
+
+@target('steam')
+def _steam():
+    steam = _plugin('hoshino.modules.information.steam')
+    return lambda: steam.get_account_status('hoshino')
+
+
+@target('bilibili')
+def _bilibili():
+    data = _plugin('hoshino.modules.tools.bilibili').data
+
+    async def run():
+        bvid = await data.get_bvid('https://b23.tv/abcdef')
+        await data.get_resp(bvid)
+    return run
+
+
+@target('nbnhhsh')
+def _nbnhhsh():
+    from hoshino.util import aiohttpx
+    return lambda: aiohttpx.post('https://lab.magiconch.com/api/nbnhhsh/guess', json={'text': 'yyds'})
+
+
+@target('calendar')
+def _calendar():
+    util = _plugin('hoshino.modules.priconne.pcr_calendar').util
+    tmp = tempfile.mkdtemp(prefix='standin_calendar_')
+    # 数据库写到临时目录，不要覆盖真实数据
+    for serid, ls in util.regiondic.items():
+        ls[2] = os.path.join(tmp, os.path.basename(ls[2]))
+        ls[3] = os.path.join(tmp, os.path.basename(ls[3]))
+
+    async def run():
+        await util.check_ver('jp')
+        await util.db_message('jp')
+    return run
+
+
+@target('throwandcreep')
+def _throwandcreep():
+    util = _plugin('hoshino.modules.entertainment.throwandcreep').util
+    return lambda: util.throw(10000)
+
+
+@target('tenjou')
+def _tenjou():
+    gacha = _plugin('hoshino.modules.priconne.gacha').gacha.Gacha('MIX')
+
+    async def run():
+        gacha.gacha_tenjou()
+    return run
+
+
+@target('gacha')
+def _gacha():
+    gacha = _plugin('hoshino.modules.priconne.gacha')
+    data = gacha.data
+    # 数据库写到临时目录，不要覆盖真实数据
+    data.db.init(os.path.join(tempfile.mkdtemp(prefix='standin_gacha_'), 'gacha.db'))
+    data.db.create_tables([data.usercollection, data.grouppool])
+    data.db.close()
+
+    async def run():
+        uid = random.randint(1, 5000)
+        pool = gacha.get_gacha(data.get_pool(uid % 50))
+        result, _ = pool.gacha_tenjou(gacha.user_rng(uid))
+        await data.set_collection(uid, [c.id for c in result['s3']])
+    return run